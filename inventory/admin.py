@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Medicine
+from .models import Medicine, ApiToken
 
 @admin.register(Medicine)
 class MedicineAdmin(admin.ModelAdmin):
@@ -33,3 +33,9 @@ class MedicineAdmin(admin.ModelAdmin):
         return obj.is_low_stock
     is_low_stock.boolean = True
     is_low_stock.short_description = 'Low Stock'
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'created_at')
+    search_fields = ('name', 'user__username')
+    readonly_fields = ('key_hash', 'created_at')
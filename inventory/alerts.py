@@ -0,0 +1,140 @@
+import os
+from itertools import groupby
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, F, Q
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from .mailqueue import enqueue_emails
+from .models import Medicine, AlertWatermark, DaysUntil, low_stock_q
+
+ALERT_KINDS = (AlertWatermark.KIND_EXPIRED, AlertWatermark.KIND_EXPIRING_SOON, AlertWatermark.KIND_LOW_STOCK)
+
+
+class AlertDigest:
+    """Alerts that have not been sent to a user yet"""
+
+    def __init__(self, user):
+        self.user = user
+        self.alerts = {kind: [] for kind in ALERT_KINDS}
+
+    def add(self, kind, medicine):
+        self.alerts[kind].append(medicine)
+
+    @property
+    def count(self):
+        return sum(len(medicines) for medicines in self.alerts.values())
+
+    def get_watermarks(self, now):
+        return [
+            AlertWatermark(medicine_id=medicine.pk, kind=kind, sent_at=now)
+            for kind, medicines in self.alerts.items()
+            for medicine in medicines
+        ]
+
+    def get_email(self, alerts_url):
+        """enqueue_email keyword arguments for the digest"""
+        context = {
+            'user': self.user,
+            'expired': self.alerts[AlertWatermark.KIND_EXPIRED],
+            'expiring_soon': self.alerts[AlertWatermark.KIND_EXPIRING_SOON],
+            'low_stock': self.alerts[AlertWatermark.KIND_LOW_STOCK],
+            'alerts_url': alerts_url,
+        }
+        return {
+            'subject': f'PharmaTrack - {self.count} new inventory alert{"s" if self.count != 1 else ""}',
+            'body': render_to_string('inventory/email/alert_digest.txt', context),
+            'html_body': render_to_string('inventory/email/alert_digest.html', context),
+            'recipient_list': [self.user.email],
+        }
+
+
+def clear_resolved_alerts(today=None):
+    """Drop watermarks whose condition no longer holds so the alert can fire again"""
+    today = today or timezone.now().date()
+    days_to_expiry = Q(days_to_expiry__lt=0) | Q(days_to_expiry__gt=F('alert_horizon'))
+    resolved = AlertWatermark.objects.annotate(
+        days_to_expiry=DaysUntil('medicine__expiry_date', today),
+        alert_horizon=F('medicine__user__userprofile__expiry_horizon_days'),
+    ).filter(
+        Q(kind=AlertWatermark.KIND_EXPIRED, days_to_expiry__gte=0)
+        | (Q(kind=AlertWatermark.KIND_EXPIRING_SOON) & days_to_expiry)
+        | Q(kind=AlertWatermark.KIND_LOW_STOCK, medicine__quantity__gt=F('medicine__low_stock_threshold'))
+    )
+    ids = list(resolved.values_list('id', flat=True))
+    if ids:
+        AlertWatermark.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def get_unsent_alert_medicines(today):
+    """Medicines of every notifiable user with at least one alert not sent yet
+
+    One query across all users, ordered by user so digests can be grouped
+    while iterating.
+    """
+    def sent(kind):
+        return Exists(AlertWatermark.objects.filter(medicine=OuterRef('pk'), kind=kind))
+
+    expired = Q(days_to_expiry__lt=0)
+    expiring_soon = Q(days_to_expiry__gte=0, days_to_expiry__lte=F('alert_horizon'))
+    return (
+        Medicine.objects
+        .filter(user__is_active=True, user__userprofile__email_verified=True)
+        .exclude(user__email='')
+        .annotate(
+            days_to_expiry=DaysUntil('expiry_date', today),
+            alert_horizon=F('user__userprofile__expiry_horizon_days'),
+            expired_sent=sent(AlertWatermark.KIND_EXPIRED),
+            expiring_soon_sent=sent(AlertWatermark.KIND_EXPIRING_SOON),
+            low_stock_sent=sent(AlertWatermark.KIND_LOW_STOCK),
+        )
+        .filter(
+            (expired & Q(expired_sent=False))
+            | (expiring_soon & Q(expiring_soon_sent=False))
+            | (low_stock_q() & Q(low_stock_sent=False))
+        )
+        .select_related('user')
+        .order_by('user_id', 'expiry_date', 'id')
+    )
+
+
+def collect_alert_digests(today=None):
+    """Build one AlertDigest per user with new alerts"""
+    today = today or timezone.now().date()
+    medicines = get_unsent_alert_medicines(today).iterator(chunk_size=2000)
+    digests = []
+    for _, user_medicines in groupby(medicines, key=lambda medicine: medicine.user_id):
+        digest = None
+        for medicine in user_medicines:
+            if digest is None:
+                digest = AlertDigest(medicine.user)
+            if medicine.days_to_expiry < 0:
+                if not medicine.expired_sent:
+                    digest.add(AlertWatermark.KIND_EXPIRED, medicine)
+            elif medicine.days_to_expiry <= medicine.alert_horizon and not medicine.expiring_soon_sent:
+                digest.add(AlertWatermark.KIND_EXPIRING_SOON, medicine)
+            if medicine.quantity <= medicine.low_stock_threshold and not medicine.low_stock_sent:
+                digest.add(AlertWatermark.KIND_LOW_STOCK, medicine)
+        if digest.count:
+            digests.append(digest)
+    return digests
+
+
+def queue_alert_digests(digests):
+    """Queue the digest emails and record their watermarks in one transaction"""
+    alerts_url = get_base_url() + reverse('alerts')
+    now = timezone.now()
+    with transaction.atomic():
+        emails = enqueue_emails(digest.get_email(alerts_url) for digest in digests)
+        AlertWatermark.objects.bulk_create(
+            [watermark for digest in digests for watermark in digest.get_watermarks(now)],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+    return emails
+
+
+def get_base_url():
+    return getattr(settings, 'BASE_URL', '') or os.environ.get('BASE_URL', '')
@@ -0,0 +1,376 @@
+import json
+import re
+from functools import wraps
+from django.forms.models import model_to_dict
+from django.http import HttpResponse, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.csrf import csrf_exempt
+from .decorators import get_or_create_user_profile
+from .forms import MedicineForm
+from .models import Medicine, ApiToken, InventoryVersion, get_expiry_horizon
+from .pagination import KeysetPaginator
+from .search import search_medicines, RANK_FIELD as SEARCH_RANK_FIELD
+from .stats import InventoryStatistics
+from .stock import adjust_stock, StockAdjustmentError, MAX_STOCK_ADJUSTMENTS
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Annotated by MedicineQuerySet.with_status, only computed when requested
+STATUS_FIELDS = ('status', 'days_to_expiry')
+MODEL_FIELDS = ('id', *MedicineForm.Meta.fields, 'created_at', 'updated_at')
+API_FIELDS = (*MODEL_FIELDS, *STATUS_FIELDS)
+# Filters whose results depend on today's date
+DATED_FILTERS = ('expired', 'expiring_soon')
+DATED_ETAG_SUFFIX = re.compile(r'-\d{4}-\d{2}-\d{2}"$')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+    def response(self):
+        return JsonResponse({'error': self.message, **self.extra}, status=self.status)
+
+
+class _CsrfCheck(CsrfViewMiddleware):
+    def _reject(self, request, reason):
+        return reason
+
+
+def authenticate_request(request):
+    """User of a Bearer token or, failing that, of the session"""
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header:
+        scheme, _, key = header.partition(' ')
+        if scheme.lower() != 'bearer' or not key.strip():
+            raise ApiError('Unsupported authorization header.', 401)
+        # Same joins as ProfileModelBackend, so later checks cost no queries
+        token = (
+            ApiToken.objects
+            .select_related('user__userprofile', 'user__inventory_version')
+            .filter(key_hash=ApiToken.hash_key(key.strip()), user__is_active=True)
+            .first()
+        )
+        if token is None:
+            raise ApiError('Invalid token.', 401)
+        return token.user
+
+    if not request.user.is_authenticated:
+        raise ApiError('Authentication credentials were not provided.', 401)
+    # Session cookies are sent by browsers automatically, so writes need the CSRF token
+    check = _CsrfCheck(lambda request: None)
+    check.process_request(request)
+    reason = check.process_view(request, None, (), {})
+    if reason:
+        raise ApiError(f'CSRF failed: {reason}', 403)
+    return request.user
+
+
+def api_view(methods):
+    """JSON view accepting session or token authentication for a verified user"""
+    def decorator(view_func):
+        @csrf_exempt
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    response = ApiError(f'Method "{request.method}" not allowed.', 405).response()
+                    response['Allow'] = ', '.join(methods)
+                    return response
+                request.user = authenticate_request(request)
+                if not get_or_create_user_profile(request.user).email_verified:
+                    raise ApiError('Email address is not verified.', 403)
+                return view_func(request, *args, **kwargs)
+            except ApiError as e:
+                response = e.response()
+                if e.status == 401:
+                    response['WWW-Authenticate'] = 'Bearer'
+                return response
+        return wrapper
+    return decorator
+
+
+def parse_json_body(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        raise ApiError('Request body is not valid JSON.')
+    if not isinstance(data, dict):
+        raise ApiError('Request body must be a JSON object.')
+    return data
+
+
+def parse_fields(request):
+    """Fields selected with ?fields=a,b (all fields by default)"""
+    value = request.GET.get('fields', '').strip()
+    if not value:
+        return API_FIELDS
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in API_FIELDS]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}", allowed=list(API_FIELDS))
+    return fields
+
+
+def parse_page_size(request):
+    try:
+        limit = int(request.GET.get('limit', API_PAGE_SIZE))
+    except ValueError:
+        raise ApiError('limit must be an integer.')
+    return max(1, min(limit, API_MAX_PAGE_SIZE))
+
+
+def serialize_medicine(medicine, fields=API_FIELDS):
+    return {field: getattr(medicine, field) for field in fields}
+
+
+def _start_of_day():
+    return timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _with_day(etag, dated):
+    """Add today's date to a tag whose representation has day-dependent statuses"""
+    if not dated:
+        return etag
+    return f'{etag[:-1]}-{timezone.now().date().isoformat()}"'
+
+
+def inventory_validators(user, scope, horizon, dated=True):
+    """(ETag, Last-Modified) of a representation derived from the whole inventory
+
+    The inventory version is bumped on every medicine change, deletions
+    included, and is loaded with the user, so revalidating costs no queries.
+    Pass dated when the representation holds statuses or expiry counts, which
+    roll over at midnight without any change to the inventory.
+    """
+    try:
+        inventory = user.inventory_version
+        version, updated_at = inventory.version, inventory.updated_at
+    except InventoryVersion.DoesNotExist:
+        version, updated_at = 0, None
+    etag = _with_day(f'"{scope}-{user.pk}-v{version}-h{horizon}"', dated)
+    if not dated:
+        return etag, updated_at or user.date_joined
+    start_of_day = _start_of_day()
+    return etag, max(updated_at or start_of_day, start_of_day)
+
+
+def medicine_validators(pk, updated_at, horizon, dated=True):
+    """(ETag, Last-Modified) of a single medicine, dated as inventory_validators"""
+    etag = _with_day(f'"medicine-{pk}-{updated_at.timestamp():.6f}-h{horizon}"', dated)
+    return etag, max(updated_at, _start_of_day()) if dated else updated_at
+
+
+def write_precondition_failed(request, pk, updated_at, horizon):
+    """412 response when If-Match or If-Unmodified-Since names an older medicine
+
+    A write only depends on the stored row, so the day in a tag handed out by
+    a GET is ignored and a tag from before midnight still matches.
+    """
+    etag, last_modified = medicine_validators(pk, updated_at, horizon, dated=False)
+    if_match = request.META.get('HTTP_IF_MATCH')
+    if if_match:
+        tags = {DATED_ETAG_SUFFIX.sub('"', tag) for tag in parse_etags(if_match)}
+        failed = '*' not in tags and etag not in tags
+    else:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_UNMODIFIED_SINCE', ''))
+        failed = since is not None and int(last_modified.timestamp()) > since
+    if not failed:
+        return None
+    return set_validators(HttpResponse(status=412), *medicine_validators(pk, updated_at, horizon))
+
+
+def conditional_response(request, etag, last_modified):
+    """304 or 412 response for the request's preconditions, None to carry on"""
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def get_medicine(queryset, pk):
+    medicine = queryset.filter(pk=pk).first()
+    if medicine is None:
+        raise ApiError('Medicine not found.', 404)
+    return medicine
+
+
+def validation_error(form):
+    return ApiError('Validation failed.', 400, errors=form.errors.get_json_data())
+
+
+@api_view(['GET', 'POST'])
+def medicine_list(request):
+    """List medicines newest first with keyset pagination, or create one"""
+    if request.method == 'POST':
+        return create_medicine(request)
+
+    fields = parse_fields(request)
+    per_page = parse_page_size(request)
+    horizon = get_expiry_horizon(request.user)
+    filter_type = request.GET.get('filter', '')
+    dated = filter_type in DATED_FILTERS or any(field in STATUS_FIELDS for field in fields)
+    validators = inventory_validators(request.user, 'medicines', horizon, dated)
+    not_modified = conditional_response(request, *validators)
+    if not_modified is not None:
+        return not_modified
+
+    today = timezone.now().date()
+    medicines = Medicine.objects.filter(user=request.user)
+    if any(field in STATUS_FIELDS for field in fields):
+        medicines = medicines.with_status(today, horizon)
+
+    search_query = request.GET.get('search', '').strip()
+    if search_query:
+        medicines = search_medicines(medicines, search_query)
+
+    if filter_type == 'expired':
+        medicines = medicines.expired(today)
+    elif filter_type == 'expiring_soon':
+        medicines = medicines.expiring_within(horizon, today)
+    elif filter_type == 'low_stock':
+        medicines = medicines.low_stock()
+    elif filter_type:
+        raise ApiError('filter must be one of expired, expiring_soon, low_stock.')
+
+    # Only read the selected columns (plus the pagination key)
+    medicines = medicines.only(*{field for field in fields if field in MODEL_FIELDS}, 'id', 'created_at')
+
+    paginator = KeysetPaginator(
+        medicines, per_page=per_page, key=SEARCH_RANK_FIELD if search_query else 'created_at'
+    )
+    page = paginator.get_page(after=request.GET.get('after'), before=request.GET.get('before'))
+
+    def page_url(**cursor):
+        params = request.GET.copy()
+        params.pop('after', None)
+        params.pop('before', None)
+        params.update(cursor)
+        return f'{request.path}?{params.urlencode()}'
+
+    data = {
+        'results': [serialize_medicine(medicine, fields) for medicine in page],
+        'next': page_url(after=page.next_cursor) if page.next_cursor else None,
+        'previous': page_url(before=page.previous_cursor) if page.previous_cursor else None,
+    }
+    return set_validators(JsonResponse(data), *validators)
+
+
+def create_medicine(request):
+    form = MedicineForm(data=parse_json_body(request))
+    if not form.is_valid():
+        raise validation_error(form)
+    medicine = form.save(commit=False)
+    medicine.user = request.user
+    medicine.save()
+    response = medicine_response(request, medicine.pk, status=201)
+    response['Location'] = reverse('api_medicine_detail', args=[medicine.pk])
+    return response
+
+
+def medicine_response(request, pk, status=200):
+    horizon = get_expiry_horizon(request.user)
+    medicine = get_medicine(
+        Medicine.objects.filter(user=request.user).with_status(timezone.now().date(), horizon), pk
+    )
+    response = JsonResponse(serialize_medicine(medicine), status=status)
+    return set_validators(response, *medicine_validators(medicine.pk, medicine.updated_at, horizon))
+
+
+@api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
+def medicine_detail(request, pk):
+    """Retrieve, replace, partially update or delete one medicine"""
+    horizon = get_expiry_horizon(request.user)
+    medicines = Medicine.objects.filter(user=request.user)
+
+    if request.method == 'GET':
+        if 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META:
+            # Revalidate from updated_at alone, the full row is only read when it changed
+            updated_at = medicines.filter(pk=pk).values_list('updated_at', flat=True).first()
+            if updated_at is None:
+                raise ApiError('Medicine not found.', 404)
+            not_modified = conditional_response(request, *medicine_validators(pk, updated_at, horizon))
+            if not_modified is not None:
+                return not_modified
+        return medicine_response(request, pk)
+
+    medicine = get_medicine(medicines, pk)
+    # A stale If-Match gets 412 instead of overwriting someone else's change
+    precondition_failed = write_precondition_failed(request, pk, medicine.updated_at, horizon)
+    if precondition_failed is not None:
+        return precondition_failed
+
+    if request.method == 'DELETE':
+        medicine.delete()
+        return HttpResponse(status=204)
+
+    data = parse_json_body(request)
+    if request.method == 'PATCH':
+        data = {**model_to_dict(medicine, fields=MedicineForm.Meta.fields), **data}
+    form = MedicineForm(data=data, instance=medicine)
+    if not form.is_valid():
+        raise validation_error(form)
+    form.save()
+    return medicine_response(request, pk)
+
+
+def parse_adjustments(data):
+    adjustments = data.get('adjustments')
+    if not isinstance(adjustments, list) or not adjustments:
+        raise ApiError('adjustments must be a non-empty list of {"id": ..., "delta": ...} objects.')
+    if len(adjustments) > MAX_STOCK_ADJUSTMENTS:
+        raise ApiError(f'At most {MAX_STOCK_ADJUSTMENTS} adjustments per request.')
+    pairs = []
+    for adjustment in adjustments:
+        values = (adjustment.get('id'), adjustment.get('delta')) if isinstance(adjustment, dict) else (None, None)
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            raise ApiError('Every adjustment needs an integer id and delta.')
+        pairs.append(values)
+    return pairs
+
+
+@api_view(['POST'])
+def adjust_medicine_stock(request):
+    """Apply a batch of stock movements atomically"""
+    adjustments = parse_adjustments(parse_json_body(request))
+    try:
+        quantities = adjust_stock(request.user, adjustments)
+    except StockAdjustmentError as e:
+        status = 404 if all(error['error'] == 'Medicine not found.' for error in e.errors) else 409
+        raise ApiError('No stock was adjusted.', status, errors=e.errors)
+    return JsonResponse({
+        'results': [{'id': medicine_id, 'quantity': quantity} for medicine_id, quantity in quantities.items()],
+    })
+
+
+@api_view(['GET'])
+def inventory_summary(request):
+    """Status bucket totals and the expiry histogram"""
+    horizon = get_expiry_horizon(request.user)
+    validators = inventory_validators(request.user, 'summary', horizon)
+    not_modified = conditional_response(request, *validators)
+    if not_modified is not None:
+        return not_modified
+
+    statistics = InventoryStatistics(request.user)
+    data = {
+        'expiry_horizon_days': horizon,
+        'summary': statistics.get_summary(),
+        'expiry_histogram': statistics.get_expiry_histogram(),
+    }
+    return set_validators(JsonResponse(data), *validators)
@@ -0,0 +1,205 @@
+import math
+import random
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .models import Medicine
+from .reports import REPORT_TYPES, REPORT_EXTENSIONS
+from .search import index_medicines
+from .stats import rebuild_inventory_rollups
+from .versioning import bump_inventory_version
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+MEDICINE_NAMES = (
+    'Paracetamol', 'Ibuprofen', 'Amoxicillin', 'Metformin', 'Atorvastatin', 'Omeprazole', 'Amlodipine',
+    'Cetirizine', 'Azithromycin', 'Losartan', 'Salbutamol', 'Ciprofloxacin', 'Diclofenac', 'Pantoprazole',
+    'Levothyroxine', 'Prednisolone', 'Doxycycline', 'Fluconazole', 'Ranitidine', 'Clopidogrel',
+)
+STRENGTHS = ('50mg', '100mg', '250mg', '500mg', '1g')
+MANUFACTURERS = (
+    'Acme Pharma', 'Zenith Labs', 'Nova Healthcare', 'Medline', 'Sunrise Generics', 'Apex Biotech',
+)
+
+# Budgets by case kind, or by case name to single one out. queries is the
+# maximum per request; p95_ms is (base, per 1k rows) so it scales with the
+# inventory. The p95 includes the first, cold request of each case.
+DEFAULT_BUDGETS = {
+    'page': {'queries': 10, 'p95_ms': (250, 10)},
+    'alerts': {'queries': 10, 'p95_ms': (250, 150)},
+    'download:pdf': {'queries': 5, 'p95_ms': (500, 400)},
+    'download:excel': {'queries': 5, 'p95_ms': (500, 250)},
+    'download:csv': {'queries': 5, 'p95_ms': (250, 30)},
+    'download:jsonl': {'queries': 5, 'p95_ms': (250, 30)},
+}
+
+
+class BenchmarkCase:
+    def __init__(self, name, url, kind='page', params=None):
+        self.name = name
+        self.url = url
+        self.kind = kind
+        self.params = params or {}
+
+
+def get_benchmark_cases():
+    """Every page and report download the benchmark requests"""
+    cases = [
+        BenchmarkCase('dashboard', reverse('dashboard')),
+        BenchmarkCase('medicine_list', reverse('medicine_list')),
+        BenchmarkCase('medicine_list:search', reverse('medicine_list'), params={'search': 'para'}),
+    ]
+    cases += [
+        BenchmarkCase(f'medicine_list:{filter_type}', reverse('medicine_list'), params={'filter': filter_type})
+        for filter_type in ('expired', 'expiring_soon', 'low_stock')
+    ]
+    cases += [
+        # Lists every alert, so it grows with the inventory
+        BenchmarkCase('alerts', reverse('alerts'), kind='alerts'),
+        BenchmarkCase('reports', reverse('reports')),
+    ]
+    cases += [
+        BenchmarkCase(
+            f'download_report:{report_type}:{format_type}',
+            reverse('download_report', args=[report_type, format_type]),
+            kind=f'download:{format_type}',
+        )
+        for report_type in REPORT_TYPES
+        for format_type in REPORT_EXTENSIONS
+    ]
+    return cases
+
+
+def seed_inventory(user, count, seed=0, batch_size=2000):
+    """Insert count generated medicines for user with bulk_create
+
+    The mix covers every status: about a sixth expired, some expiring within
+    the default horizon and about a tenth low on stock.
+    """
+    rng = random.Random(seed)
+    today = timezone.now().date()
+    for start in range(0, count, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, count)):
+            expiry_date = today + timedelta(days=rng.randint(-120, 600))
+            batch.append(Medicine(
+                user=user,
+                name=f'{rng.choice(MEDICINE_NAMES)} {rng.choice(STRENGTHS)}',
+                batch_number=f'BN{user.pk}-{index:06d}',
+                manufacturer=rng.choice(MANUFACTURERS),
+                manufacturing_date=min(today, expiry_date) - timedelta(days=rng.randint(180, 720)),
+                expiry_date=expiry_date,
+                quantity=rng.randint(0, 100) if rng.random() < 0.1 else rng.randint(101, 1000),
+                price_per_unit=Decimal(rng.randint(50, 5000)) / 100,
+                low_stock_threshold=100,
+            ))
+        # bulk_create skips the signals, keep the index, rollup and version in sync by hand
+        index_medicines(Medicine.objects.bulk_create(batch))
+    rebuild_inventory_rollups([user.pk])
+    bump_inventory_version(user.pk)
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def get_budget(budgets, case, size):
+    """(max queries, p95 ms) for a case; case names override their kind"""
+    budget = dict(budgets.get(case.kind, budgets['page']))
+    budget.update(budgets.get(case.name, {}))
+    base, per_1k_rows = budget['p95_ms']
+    return budget['queries'], base + per_1k_rows * size / 1000
+
+
+def measure(client, case, repeat):
+    """Request a case repeat times; the first run is cold"""
+    durations = []
+    queries = 0
+    size = 0
+    status = None
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = client.get(case.url, case.params)
+            # Streaming and file responses only do their work while being read
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+            durations.append((time.perf_counter() - start) * 1000)
+        queries = max(queries, len(ctx.captured_queries))
+        size = len(body)
+        status = response.status_code
+    return {
+        'status': status,
+        'queries': queries,
+        'cold_ms': round(durations[0], 2),
+        'p50_ms': round(percentile(durations, 50), 2),
+        'p95_ms': round(percentile(durations, 95), 2),
+        'max_ms': round(max(durations), 2),
+        'bytes': size,
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, repeat=5, budgets=None, cases=None, log=None):
+    """Seed one user per inventory size, time every case and check the budgets
+
+    Everything runs in a transaction that is rolled back, with a private
+    cache and report cache directory, so the database and shared caches are
+    left as they were. Returns the results dict; results['failures'] lists
+    the budgets that were exceeded.
+    """
+    budgets = budgets or DEFAULT_BUDGETS
+    results = {
+        'started_at': timezone.now().isoformat(),
+        'database': connection.vendor,
+        'repeat': repeat,
+        'sizes': {},
+        'failures': [],
+    }
+    with tempfile.TemporaryDirectory() as report_cache_dir, override_settings(
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+        REPORT_CACHE_DIR=report_cache_dir,
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+    ):
+        cases = cases or get_benchmark_cases()
+        with transaction.atomic():
+            for size in sizes:
+                user = User.objects.create_user(f'benchmark-{size}', f'benchmark-{size}@example.com')
+                user.userprofile.email_verified = True
+                user.userprofile.save()
+
+                start = time.perf_counter()
+                seed_inventory(user, size)
+                size_results = {'seed_seconds': round(time.perf_counter() - start, 2), 'cases': {}}
+                results['sizes'][str(size)] = size_results
+                if log:
+                    log(f'Seeded {size} medicines in {size_results["seed_seconds"]}s')
+
+                client = Client()
+                client.force_login(user)
+                for case in cases:
+                    result = measure(client, case, repeat)
+                    size_results['cases'][case.name] = result
+                    max_queries, max_p95 = get_budget(budgets, case, size)
+                    if result['status'] != 200:
+                        results['failures'].append(f'{size} {case.name}: status {result["status"]}')
+                    if result['queries'] > max_queries:
+                        results['failures'].append(
+                            f'{size} {case.name}: {result["queries"]} queries (budget {max_queries})'
+                        )
+                    if result['p95_ms'] > max_p95:
+                        results['failures'].append(
+                            f'{size} {case.name}: p95 {result["p95_ms"]}ms (budget {max_p95:.0f}ms)'
+                        )
+                    if log:
+                        log(f'{size:>7} {case.name:<40} {result["queries"]:>3} queries  p95 {result["p95_ms"]:>9.2f}ms')
+            transaction.set_rollback(True)
+    return results
@@ -0,0 +1,31 @@
+from functools import wraps
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect
+from .models import UserProfile
+
+
+def get_or_create_user_profile(user):
+    """Get or create UserProfile for a user"""
+    try:
+        return user.userprofile
+    except UserProfile.DoesNotExist:
+        # Create UserProfile if it doesn't exist (safety measure)
+        return UserProfile.objects.create(user=user, email_verified=True)
+
+
+def verified_email_required(view_func):
+    """Require a logged in user whose email address is verified
+
+    The profile comes preloaded with request.user (see ProfileModelBackend),
+    so the check does not cost a query.
+    """
+    @wraps(view_func)
+    @login_required
+    def wrapper(request, *args, **kwargs):
+        profile = get_or_create_user_profile(request.user)
+        if not profile.email_verified:
+            messages.warning(request, 'Please verify your email address to access all features.')
+            return redirect('resend_verification')
+        return view_func(request, *args, **kwargs)
+    return wrapper
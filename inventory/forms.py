@@ -2,7 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from .models import Medicine
+from .models import Medicine, UserProfile
 from datetime import date
 
 class UserRegistrationForm(UserCreationForm):
@@ -55,4 +55,19 @@ class MedicineForm(forms.ModelForm):
         threshold = self.cleaned_data.get('low_stock_threshold')
         if threshold < 0:
             raise forms.ValidationError("Low stock threshold cannot be negative.")
-        return threshold 
\ No newline at end of file
+        return threshold
+
+
+class MedicineImportForm(forms.Form):
+    file = forms.FileField(help_text='CSV or Excel (.xlsx) file with one medicine batch per row.')
+
+    def clean_file(self):
+        uploaded = self.cleaned_data.get('file')
+        if not uploaded.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError("Upload a .csv or .xlsx file.")
+        return uploaded
+
+class ExpiryHorizonForm(forms.ModelForm):
+    class Meta:
+        model = UserProfile
+        fields = ['expiry_horizon_days']
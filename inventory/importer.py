@@ -0,0 +1,170 @@
+import csv
+import io
+import os
+import zipfile
+from django.db import transaction, DatabaseError
+from .forms import MedicineForm
+from .models import Medicine
+from .search import index_medicines
+from .stats import rebuild_inventory_rollups
+from .versioning import bump_inventory_version
+
+IMPORT_FIELDS = MedicineForm.Meta.fields
+
+# Column headers accepted besides the field names, matching the report exports
+HEADER_ALIASES = {
+    'medicine_name': 'name',
+    'batch': 'batch_number',
+    'expiry': 'expiry_date',
+    'price': 'price_per_unit',
+}
+
+
+class ImportReadError(ValueError):
+    """The file could not be parsed as CSV or XLSX"""
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.errors.append((row_number, message))
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+
+class MedicineImporter:
+    """Load medicines from CSV/XLSX in batches
+
+    Every row goes through MedicineForm so imports follow the same rules as
+    the add form; valid rows are written with bulk_create, one transaction per
+    batch, and invalid rows are reported without stopping the import.
+    """
+
+    def __init__(self, user, batch_size=500):
+        self.user = user
+        self.batch_size = batch_size
+
+    def import_file(self, fileobj, filename):
+        """Import an uploaded or opened binary file, picking the reader by extension"""
+        extension = os.path.splitext(filename)[1].lower()
+        if extension == '.csv':
+            rows = self.read_csv(fileobj)
+        elif extension == '.xlsx':
+            rows = self.read_xlsx(fileobj)
+        else:
+            raise ValueError('Unsupported file type. Upload a .csv or .xlsx file.')
+        return self.import_rows(rows)
+
+    def read_csv(self, fileobj):
+        """Yield row dicts from a binary CSV stream without loading it whole"""
+        text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+        reader = csv.reader(text)
+        try:
+            header = next(reader, None)
+            if header is None:
+                return
+            columns = self._map_header(header)
+            for values in reader:
+                yield self._row_dict(columns, values)
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise ImportReadError(f'The file is not valid UTF-8 CSV: {e}') from e
+
+    def read_xlsx(self, fileobj):
+        """Yield row dicts from the first worksheet using openpyxl's read-only mode"""
+        import openpyxl
+        from openpyxl.utils.exceptions import InvalidFileException
+
+        try:
+            wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+        except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError) as e:
+            raise ImportReadError('The file is not a valid .xlsx workbook.') from e
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                return
+            columns = self._map_header(['' if cell is None else str(cell) for cell in header])
+            for values in rows:
+                if values and any(value is not None for value in values):
+                    yield self._row_dict(columns, values)
+        finally:
+            wb.close()
+
+    def import_rows(self, rows):
+        """Validate and insert an iterable of row dicts
+
+        An ImportReadError before the first row is raised; one further into
+        the file is reported as an error on the row it stopped at, keeping
+        the rows already read.
+        """
+        result = ImportResult()
+        batch = []
+        try:
+            # Row 1 is the header
+            for row_number, row in enumerate(rows, 2):
+                result.rows += 1
+                form = MedicineForm(data=row)
+                if not form.is_valid():
+                    result.add_error(row_number, self._format_errors(form))
+                    continue
+                medicine = form.save(commit=False)
+                medicine.user = self.user
+                batch.append((row_number, medicine))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch, result)
+                    batch = []
+        except ImportReadError as e:
+            if not result.rows:
+                raise
+            result.add_error(result.rows + 2, f'{e} The rest of the file was skipped.')
+        if batch:
+            self._flush(batch, result)
+
+        if result.created:
+            # bulk_create skips the rollup signals too
+            rebuild_inventory_rollups([self.user.pk])
+            bump_inventory_version(self.user.pk)
+        return result
+
+    def _flush(self, batch, result):
+        try:
+            with transaction.atomic():
+                created = Medicine.objects.bulk_create([medicine for _, medicine in batch])
+                # bulk_create skips signals, keep the search index in sync by hand
+                index_medicines(created)
+        except DatabaseError as e:
+            for row_number, _ in batch:
+                result.add_error(row_number, f'Database error: {e}')
+            return
+        result.created += len(created)
+
+    def _map_header(self, header):
+        columns = []
+        for title in header:
+            key = title.strip().lower().replace(' ', '_')
+            key = HEADER_ALIASES.get(key, key)
+            columns.append(key if key in IMPORT_FIELDS else None)
+        missing = [field for field in IMPORT_FIELDS if field not in columns and field != 'description']
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+        return columns
+
+    def _row_dict(self, columns, values):
+        row = {}
+        for column, value in zip(columns, values):
+            if column is not None and value is not None:
+                row[column] = value.strip() if isinstance(value, str) else value
+        return row
+
+    def _format_errors(self, form):
+        messages = []
+        for field, errors in form.errors.items():
+            prefix = '' if field == '__all__' else f'{field}: '
+            messages.extend(f'{prefix}{error}' for error in errors)
+        return '; '.join(messages)
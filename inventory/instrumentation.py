@@ -0,0 +1,109 @@
+import logging
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import LazyObject, empty
+from .metrics import observe_request
+
+request_logger = logging.getLogger('inventory.requests')
+slow_query_logger = logging.getLogger('inventory.slow_queries')
+
+# Log queries slower than this (milliseconds); None turns the slow query log off
+DEFAULT_SLOW_QUERY_THRESHOLD_MS = 200
+
+
+def get_user_id(request):
+    """Id of the request's user, unless reading it would cost a query"""
+    user = getattr(request, 'user', None)
+    if user is None or (isinstance(user, LazyObject) and user._wrapped is empty):
+        return None
+    return user.pk if user.is_authenticated else None
+
+
+def get_view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else None
+
+
+class QueryTimer:
+    """connection.execute_wrapper that counts and times the queries of one request"""
+
+    def __init__(self, request, slow_query_ms):
+        self.request = request
+        self.slow_query_ms = slow_query_ms
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.slow_query_ms is not None and elapsed * 1000 >= self.slow_query_ms:
+                slow_query_logger.warning('slow query', extra={'data': {
+                    'view': get_view_name(self.request),
+                    'path': self.request.path,
+                    'duration_ms': round(elapsed * 1000, 2),
+                    'sql': sql,
+                    'many': many,
+                    'database': context['connection'].alias,
+                }})
+
+
+class RequestTimingMiddleware:
+    """Time each request and its database queries
+
+    Adds a Server-Timing header (total, db and query count), feeds the
+    /metrics request metrics and logs one JSON line per request to
+    inventory.requests. Queries slower than
+    SLOW_QUERY_THRESHOLD_MS are logged with their SQL to inventory.slow_queries.
+    The overhead is two perf_counter calls per query, so it can stay on in
+    production. Queries run while a streaming response is consumed happen after
+    the middleware returns and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_query_ms = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', DEFAULT_SLOW_QUERY_THRESHOLD_MS)
+        self.server_timing = getattr(settings, 'SERVER_TIMING_HEADER', True)
+
+    def __call__(self, request):
+        timer = QueryTimer(request, self.slow_query_ms)
+        start = time.perf_counter()
+        response = None
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timer))
+                response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            self.record(request, response, duration, timer)
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f'total;dur={duration * 1000:.1f}, '
+                f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"'
+            )
+        return response
+
+    def record(self, request, response, duration, timer):
+        """Update the metrics and log the request; response is None when the view raised"""
+        view = get_view_name(request)
+        status = response.status_code if response is not None else 500
+        observe_request(view, request.method, status, duration, timer.count, timer.duration)
+        if not request_logger.isEnabledFor(logging.INFO):
+            return
+        request_logger.info('request', extra={'data': {
+            'method': request.method,
+            'path': request.path,
+            'view': view,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': timer.count,
+            'db_time_ms': round(timer.duration * 1000, 2),
+            'user_id': get_user_id(request),
+        }})
@@ -0,0 +1,94 @@
+import logging
+import traceback
+from datetime import timedelta
+from django.db.models import F
+from django.utils import timezone
+from .metrics import REPORT_JOB_DURATION, REPORT_JOB_FAILURES
+from .models import ReportJob
+from .reports import MedicineReportGenerator
+from .report_cache import report_cache
+
+logger = logging.getLogger(__name__)
+
+# A job running this long lost its worker to a crash or redeploy
+JOB_TIMEOUT = timedelta(minutes=30)
+# Runs a job gets before a stale one is marked failed instead of queued again
+MAX_JOB_ATTEMPTS = 2
+
+
+def enqueue_report_job(user, report_type, format_type):
+    """Queue a report for the run_report_jobs worker"""
+    return ReportJob.objects.create(user=user, report_type=report_type, format_type=format_type)
+
+
+def recover_stale_jobs():
+    """Queue running jobs older than JOB_TIMEOUT again, or fail them after MAX_JOB_ATTEMPTS
+
+    Returns the number of jobs recovered.
+    """
+    now = timezone.now()
+    stale = ReportJob.objects.filter(status=ReportJob.STATUS_RUNNING, started_at__lt=now - JOB_TIMEOUT)
+    failed = stale.filter(attempts__gte=MAX_JOB_ATTEMPTS).update(
+        status=ReportJob.STATUS_FAILED, finished_at=now, error='The worker stopped before the report was finished.'
+    )
+    requeued = stale.update(status=ReportJob.STATUS_PENDING, started_at=None)
+    if failed or requeued:
+        logger.warning('Recovered stale report jobs: %s queued again, %s failed', requeued, failed)
+    return failed + requeued
+
+
+def claim_next_job():
+    """Atomically move the oldest pending job to running and return it
+
+    The claim is a conditional UPDATE, so several workers can poll the same
+    table without a broker or row locks. Jobs abandoned by a dead worker are
+    recovered first.
+    """
+    recover_stale_jobs()
+    while True:
+        job = ReportJob.objects.filter(status=ReportJob.STATUS_PENDING).order_by('created_at', 'id').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = ReportJob.objects.filter(pk=job.pk, status=ReportJob.STATUS_PENDING).update(
+            status=ReportJob.STATUS_RUNNING, started_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            job.status = ReportJob.STATUS_RUNNING
+            job.started_at = now
+            job.attempts += 1
+            return job
+
+
+def run_report_job(job):
+    """Generate the job's report into its content
+
+    The result is only written while the job is still held by this claim, so
+    a job recovered and claimed again elsewhere is not overwritten.
+    """
+    values = {'content': None, 'error': ''}
+    try:
+        # Reuse a cached copy when the inventory has not changed since
+        with report_cache.open_report(job.user, job.report_type, job.format_type) as report_file:
+            values['content'] = report_file.read()
+        values['status'] = ReportJob.STATUS_COMPLETED
+    except Exception:
+        logger.exception('Report job %s failed', job.pk)
+        values['status'] = ReportJob.STATUS_FAILED
+        values['error'] = traceback.format_exc(limit=5)
+    values['finished_at'] = timezone.now()
+
+    claimed = ReportJob.objects.filter(
+        pk=job.pk, status=ReportJob.STATUS_RUNNING, attempts=job.attempts
+    ).update(**values)
+    if not claimed:
+        logger.warning('Report job %s was recovered while running, discarding this result', job.pk)
+        job.refresh_from_db()
+        return job
+    for field, value in values.items():
+        setattr(job, field, value)
+    if job.status == ReportJob.STATUS_COMPLETED:
+        REPORT_JOB_DURATION.observe((job.finished_at - job.started_at).total_seconds(), format=job.format_type)
+    else:
+        REPORT_JOB_FAILURES.inc(format=job.format_type)
+    return job
@@ -0,0 +1,18 @@
+import json
+import logging
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; fields passed as extra={'data': {...}} are merged in"""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'data', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
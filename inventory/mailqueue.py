@@ -0,0 +1,149 @@
+import logging
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Q
+from django.utils import timezone
+from .metrics import EMAIL_SEND_FAILURES, EMAIL_SEND_LATENCY, EMAILS_FAILED
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 60 * 60
+# Emails left sending this long, by a worker that crashed or was redeployed, are claimed again
+CLAIM_TIMEOUT = timedelta(minutes=15)
+
+
+def enqueue_email(subject, body, recipient_list, html_body='', from_email=None):
+    """Queue an email for the send_queued_emails worker and return immediately"""
+    return OutboundEmail.objects.create(
+        subject=subject,
+        body=body,
+        html_body=html_body or '',
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=','.join(recipient_list),
+    )
+
+
+def enqueue_emails(emails):
+    """Queue many emails with one bulk insert
+
+    emails is an iterable of dicts with enqueue_email's keyword arguments.
+    """
+    return OutboundEmail.objects.bulk_create([
+        OutboundEmail(
+            subject=email['subject'],
+            body=email['body'],
+            html_body=email.get('html_body') or '',
+            from_email=email.get('from_email') or settings.DEFAULT_FROM_EMAIL,
+            to=','.join(email['recipient_list']),
+        )
+        for email in emails
+    ])
+
+
+def get_retry_delay(attempts):
+    """Exponential backoff after the given number of failed attempts"""
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+def get_claimable_q(now):
+    """Emails that are due, or whose claim has gone stale"""
+    return (
+        Q(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)
+        | Q(status=OutboundEmail.STATUS_SENDING, claimed_at__lt=now - CLAIM_TIMEOUT)
+    )
+
+
+def get_claimable_ids(now, batch_size):
+    return list(
+        OutboundEmail.objects.filter(get_claimable_q(now))
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+
+
+def claim_due_emails(batch_size):
+    """Move up to batch_size due emails to sending and return them
+
+    The UPDATE repeats the claimable conditions, so of several workers that
+    picked the same ids only one changes each row. The rows are marked with
+    a token of this claim and only those are returned. A stale claim is taken
+    over after CLAIM_TIMEOUT, so an email whose worker died after sending it
+    but before saving may be delivered twice.
+    """
+    now = timezone.now()
+    ids = get_claimable_ids(now, batch_size)
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    OutboundEmail.objects.filter(get_claimable_q(now), id__in=ids).update(
+        status=OutboundEmail.STATUS_SENDING, claim_token=token, claimed_at=now
+    )
+    return list(OutboundEmail.objects.filter(id__in=ids, claim_token=token).order_by('next_attempt_at', 'id'))
+
+
+def send_queued_emails(batch_size=50, connection=None):
+    """Deliver one batch of due emails over a single backend connection
+
+    Returns (sent, failed) counts for the batch.
+    """
+    emails = claim_due_emails(batch_size)
+    if not emails:
+        return 0, 0
+
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as e:
+        # Could not reach the mail server at all, retry the whole batch later
+        logger.warning('Could not open email connection: %s', e)
+        for email in emails:
+            _mark_failed(email, e)
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            message = EmailMultiAlternatives(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email,
+                to=email.recipients,
+                connection=connection,
+            )
+            if email.html_body:
+                message.attach_alternative(email.html_body, 'text/html')
+            try:
+                # One message per call keeps failures per email, the connection stays open
+                connection.send_messages([message])
+            except Exception as e:
+                logger.warning('Sending email %s failed: %s', email.pk, e)
+                _mark_failed(email, e)
+                failed += 1
+            else:
+                email.status = OutboundEmail.STATUS_SENT
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                email.save(update_fields=['status', 'attempts', 'sent_at'])
+                EMAIL_SEND_LATENCY.observe((email.sent_at - email.created_at).total_seconds())
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    EMAIL_SEND_FAILURES.inc()
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = OutboundEmail.STATUS_FAILED
+        EMAILS_FAILED.inc()
+    else:
+        email.status = OutboundEmail.STATUS_PENDING
+        email.next_attempt_at = timezone.now() + get_retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
@@ -0,0 +1,37 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from inventory.benchmark import run_benchmark, DEFAULT_SIZES, DEFAULT_BUDGETS
+
+class Command(BaseCommand):
+    help = 'Seed large inventories, time every page and report download, and check query and p95 budgets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='Inventory sizes to seed')
+        parser.add_argument('--repeat', type=int, default=5, help='Requests per case, the first one is cold')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--budgets', help='JSON file overriding the default budgets by kind or case name')
+        parser.add_argument('--no-budgets', action='store_true', help='Report only, do not fail on budgets')
+
+    def handle(self, *args, **options):
+        budgets = dict(DEFAULT_BUDGETS)
+        if options['budgets']:
+            try:
+                with open(options['budgets']) as fileobj:
+                    budgets.update(json.load(fileobj))
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read budgets: {e}')
+
+        results = run_benchmark(
+            sizes=options['sizes'], repeat=options['repeat'], budgets=budgets, log=self.stdout.write
+        )
+        if options['output']:
+            with open(options['output'], 'w') as fileobj:
+                json.dump(results, fileobj, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if results['failures']:
+            for failure in results['failures']:
+                self.stderr.write(failure)
+            if not options['no_budgets']:
+                raise CommandError(f'{len(results["failures"])} budget(s) exceeded.')
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from inventory.models import ApiToken
+
+class Command(BaseCommand):
+    help = 'Create an API token for a user; the key is only shown once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--name', default='API client', help='Label to recognise the token by, e.g. the device')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User \"{options['username']}\" does not exist.")
+        token, key = ApiToken.create_token(user, options['name'])
+        self.stdout.write(self.style.SUCCESS(f'Created token "{token.name}" for {user.username}.'))
+        self.stdout.write(key)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from inventory.models import Medicine, get_expiry_horizon
+from inventory.stats import InventoryStatistics
+from inventory.search import search_medicines, RANK_FIELD as SEARCH_RANK_FIELD
+
+class Command(BaseCommand):
+    help = 'Print EXPLAIN plans for the hot inventory queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username whose inventory is queried (defaults to the largest inventory)')
+        parser.add_argument('--analyze', action='store_true', help='Run EXPLAIN ANALYZE (PostgreSQL only)')
+
+    def handle(self, *args, **options):
+        user = self._get_user(options['user'])
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--analyze is only supported on PostgreSQL.')
+            explain_options = {'analyze': True, 'buffers': True}
+
+        self.stdout.write(f'Backend: {connection.vendor}, user: {user.username}')
+        for name, queryset in self.get_hot_queries(user).items():
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n== {name} =='))
+            self.stdout.write(queryset.explain(**explain_options))
+
+    def get_hot_queries(self, user):
+        """Querysets issued by the dashboard, medicine list, alerts and reports pages"""
+        today = timezone.now().date()
+        horizon = get_expiry_horizon(user)
+        medicines = Medicine.objects.filter(user=user)
+        statistics = InventoryStatistics(user)
+        return {
+            'inventory summary': medicines.order_by().values('user').annotate(
+                **statistics.get_aggregates(today)
+            ),
+            'recent medicines': medicines.with_status(today, horizon)[:5],
+            'expired': medicines.expired(today),
+            'expiring soon': medicines.expiring_within(horizon, today),
+            'expiry histogram': statistics.get_expiry_histogram_queryset(today),
+            'low stock': medicines.low_stock(),
+            'search': search_medicines(medicines, 'para').order_by(f'-{SEARCH_RANK_FIELD}', '-id'),
+        }
+
+    def _get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist.')
+        user = User.objects.annotate(medicine_count=Count('medicine')).order_by('-medicine_count').first()
+        if user is None:
+            raise CommandError('No users found.')
+        return user
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from inventory.importer import MedicineImporter
+
+class Command(BaseCommand):
+    help = 'Bulk import medicines for a user from a CSV or Excel (.xlsx) file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Owner of the imported medicines')
+        parser.add_argument('path', help='CSV or .xlsx file to import')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows inserted per transaction')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'User "{options["username"]}" does not exist.')
+
+        importer = MedicineImporter(user, batch_size=options['batch_size'])
+        try:
+            with open(options['path'], 'rb') as fileobj:
+                result = importer.import_file(fileobj, options['path'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for row_number, message in result.errors:
+            self.stderr.write(f'Row {row_number}: {message}')
+        self.stdout.write(
+            self.style.SUCCESS(f'Imported {result.created} of {result.rows} rows ({result.failed} rejected).')
+        )
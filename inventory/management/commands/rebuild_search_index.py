@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from inventory.models import Medicine
+from inventory.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuild the medicine search index from the Medicine table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Medicines indexed per batch')
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        batch_size = options['batch_size']
+        medicines = Medicine.objects.only('id', 'name', 'batch_number', 'manufacturer').order_by('id')
+
+        batch = []
+        total = 0
+        for medicine in medicines.iterator(chunk_size=batch_size):
+            batch.append(medicine)
+            if len(batch) >= batch_size:
+                backend.index(batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            backend.index(batch)
+            total += len(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Indexed {total} medicines with {type(backend).__name__}.')
+        )
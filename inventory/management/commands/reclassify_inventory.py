@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from inventory.stats import rebuild_inventory_rollups
+
+class Command(BaseCommand):
+    help = 'Rebuild every inventory rollup for today so medicines crossing into expiring soon or expired are reclassified (run nightly)'
+
+    def handle(self, *args, **options):
+        rollups = rebuild_inventory_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Reclassified {len(rollups)} inventory rollup(s).'))
@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from inventory.jobs import claim_next_job, run_report_job
+from inventory.metrics import start_metrics_server
+
+class Command(BaseCommand):
+    help = 'Generate queued reports off the request path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the pending jobs and exit')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this port (0 = off)')
+        parser.add_argument('--max-jobs', type=int, default=0, help='Exit after this many jobs (0 = no limit)')
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+        processed = 0
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            job = run_report_job(job)
+            processed += 1
+            if job.status == job.STATUS_COMPLETED:
+                self.stdout.write(self.style.SUCCESS(f'Job {job.pk} completed: {len(job.content)} bytes'))
+            else:
+                self.stdout.write(self.style.ERROR(f'Job {job.pk} failed'))
+
+            if options['max_jobs'] and processed >= options['max_jobs']:
+                break
+
+        self.stdout.write(f'Processed {processed} report job(s).')
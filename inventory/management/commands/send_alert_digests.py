@@ -0,0 +1,45 @@
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from inventory.alerts import clear_resolved_alerts, collect_alert_digests, queue_alert_digests
+from inventory.mailqueue import send_queued_emails
+
+class Command(BaseCommand):
+    help = 'Email each user a digest of newly expired, expiring soon and low stock medicines (run from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Print the digests without queueing or recording them')
+        parser.add_argument('--queue-only', action='store_true', help='Queue the digests for the send_queued_emails worker instead of sending now')
+        parser.add_argument('--batch-size', type=int, default=500, help='Emails sent per connection')
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+        if not options['dry_run']:
+            cleared = clear_resolved_alerts(today)
+            self.stdout.write(f'Cleared {cleared} resolved alert(s).')
+
+        digests = collect_alert_digests(today)
+        for digest in digests:
+            counts = ', '.join(f'{len(medicines)} {kind}' for kind, medicines in digest.alerts.items() if medicines)
+            self.stdout.write(f'{digest.user.username} <{digest.user.email}>: {counts}')
+        if options['dry_run'] or not digests:
+            self.stdout.write(self.style.SUCCESS(f'{len(digests)} digest(s) to send.'))
+            return
+
+        queue_alert_digests(digests)
+        if options['queue_only']:
+            self.stdout.write(self.style.SUCCESS(f'Queued {len(digests)} digest(s).'))
+            return
+
+        # Deliver everything due over one mail server connection
+        connection = get_connection(fail_silently=False)
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_queued_emails(batch_size=options['batch_size'], connection=connection)
+            if not sent and not failed:
+                break
+            total_sent += sent
+            total_failed += failed
+        self.stdout.write(self.style.SUCCESS(
+            f'Queued {len(digests)} digest(s); sent {total_sent} email(s), {total_failed} failed.'
+        ))
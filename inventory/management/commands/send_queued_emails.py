@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from inventory.mailqueue import send_queued_emails
+from inventory.metrics import start_metrics_server
+
+class Command(BaseCommand):
+    help = 'Deliver queued outbound emails, reusing one mail server connection per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the due emails and exit')
+        parser.add_argument('--batch-size', type=int, default=50, help='Emails sent per connection')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--metrics-port', type=int, default=0, help='Serve Prometheus metrics on this port (0 = off)')
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_queued_emails(batch_size=options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write(f'Sent {sent} email(s), {failed} failed.')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Sent {total_sent} email(s), {total_failed} failed.'))
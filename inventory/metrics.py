@@ -0,0 +1,308 @@
+import secrets
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.http import HttpResponse
+from django.utils import timezone
+from .models import ReportJob, OutboundEmail
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REPORT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+EMAIL_LATENCY_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 3600)
+# The email gauges cover emails whose last attempt was due this recently, read
+# through the (status, next_attempt_at) index rather than the whole history
+EMAIL_METRICS_WINDOW = timedelta(hours=1)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class MetricFamily:
+    """Samples of one metric in the Prometheus text exposition format"""
+
+    def __init__(self, name, metric_type, documentation):
+        self.name = name
+        self.type = metric_type
+        self.documentation = documentation
+        self.samples = []
+
+    def add(self, value, suffix='', **labels):
+        self.samples.append((self.name + suffix, labels, value))
+
+    def add_histogram(self, bounds, cumulative_counts, total, count, **labels):
+        """Add one labelled histogram; cumulative_counts[i] is the count at or below bounds[i]"""
+        for bound, bucket_count in zip(bounds, cumulative_counts):
+            self.add(bucket_count, '_bucket', **labels, le=format_value(float(bound)))
+        self.add(count, '_bucket', **labels, le='+Inf')
+        self.add(total, '_sum', **labels)
+        self.add(count, '_count', **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(
+            f'{name}{format_labels(labels)} {format_value(value)}' for name, labels, value in self.samples
+        )
+        return '\n'.join(lines)
+
+
+class Metric:
+    """Metric kept in process memory, safe to update from several threads"""
+
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self):
+        family = MetricFamily(self.name, self.metric_type, self.documentation)
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            self._add_samples(family, dict(zip(self.labelnames, key)), value)
+        return family
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _add_samples(self, family, labels, value):
+        family.add(value, **labels)
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one past the largest bound), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block, unless it raises"""
+        start = time.perf_counter()
+        yield
+        self.observe(time.perf_counter() - start, **labels)
+
+    def _add_samples(self, family, labels, value):
+        counts, total, count = value
+        cumulative = []
+        running = 0
+        for bucket_count in counts[:-1]:
+            running += bucket_count
+            cumulative.append(running)
+        family.add_histogram(self.buckets, cumulative, total, count, **labels)
+
+
+REGISTRY = []
+
+REQUEST_DURATION = Histogram(
+    'pharmatrack_request_duration_seconds', 'Request latency by URL name.', ('view', 'method')
+)
+RESPONSES = Counter(
+    'pharmatrack_responses_total', 'Responses by URL name and status class.', ('view', 'status')
+)
+DB_QUERIES = Counter(
+    'pharmatrack_db_queries_total', 'Database queries run while handling requests.', ('view',)
+)
+DB_QUERY_TIME = Counter(
+    'pharmatrack_db_query_seconds_total', 'Time spent in database queries while handling requests.', ('view',)
+)
+REPORT_DURATION = Histogram(
+    'pharmatrack_report_generation_seconds', 'Report generation time in the web process by format.',
+    ('format',), buckets=REPORT_BUCKETS
+)
+# Observed by the worker processes, see start_metrics_server
+REPORT_JOB_DURATION = Histogram(
+    'pharmatrack_report_job_duration_seconds', 'Background report job run time by format.',
+    ('format',), buckets=REPORT_BUCKETS
+)
+REPORT_JOB_FAILURES = Counter(
+    'pharmatrack_report_job_failures_total', 'Failed background report jobs by format.', ('format',)
+)
+EMAIL_SEND_LATENCY = Histogram(
+    'pharmatrack_email_send_latency_seconds', 'Time from queueing an email to delivering it.',
+    buckets=EMAIL_LATENCY_BUCKETS
+)
+EMAIL_SEND_FAILURES = Counter(
+    'pharmatrack_email_send_failures_total', 'Failed email delivery attempts, retries included.'
+)
+EMAILS_FAILED = Counter(
+    'pharmatrack_emails_failed_total', 'Emails given up on after the maximum attempts.'
+)
+
+
+def observe_request(view, method, status, duration, db_queries, db_time):
+    """Record one request, called by RequestTimingMiddleware"""
+    view = view or 'unmatched'
+    REQUEST_DURATION.observe(duration, view=view, method=method)
+    RESPONSES.inc(view=view, status=f'{status // 100}xx')
+    DB_QUERIES.inc(db_queries, view=view)
+    DB_QUERY_TIME.inc(db_time, view=view)
+
+
+def timed_chunks(chunks, histogram, **labels):
+    """Pass chunks through, observing the time until the last one is produced"""
+    start = time.perf_counter()
+    yield from chunks
+    histogram.observe(time.perf_counter() - start, **labels)
+
+
+def collect_email_metrics():
+    """Gauges over the last EMAIL_METRICS_WINDOW, covering every mail worker"""
+    totals = OutboundEmail.objects.filter(
+        status__in=[OutboundEmail.STATUS_SENT, OutboundEmail.STATUS_FAILED, OutboundEmail.STATUS_PENDING],
+        next_attempt_at__gte=timezone.now() - EMAIL_METRICS_WINDOW,
+    ).aggregate(
+        attempts=Sum('attempts'),
+        sent=Count('id', filter=Q(status=OutboundEmail.STATUS_SENT)),
+        failed=Count('id', filter=Q(status=OutboundEmail.STATUS_FAILED)),
+    )
+    attempt_failures = MetricFamily(
+        'pharmatrack_recent_email_send_failures', 'gauge',
+        'Failed delivery attempts, retries included, of emails last attempted in the last hour.'
+    )
+    # Every attempt that did not end in a sent email failed
+    attempt_failures.add((totals['attempts'] or 0) - totals['sent'])
+    given_up = MetricFamily(
+        'pharmatrack_recent_emails_failed', 'gauge',
+        'Emails given up on after the maximum attempts in the last hour.'
+    )
+    given_up.add(totals['failed'])
+    return [attempt_failures, given_up]
+
+
+def collect_queue_depths():
+    now = timezone.now()
+    depth = MetricFamily('pharmatrack_queue_depth', 'gauge', 'Background work waiting or in progress.')
+    jobs = dict(
+        ReportJob.objects.filter(status__in=[ReportJob.STATUS_PENDING, ReportJob.STATUS_RUNNING])
+        .order_by().values_list('status').annotate(Count('id'))
+    )
+    for status in (ReportJob.STATUS_PENDING, ReportJob.STATUS_RUNNING):
+        depth.add(jobs.get(status, 0), queue='report_jobs', state=status)
+    emails = OutboundEmail.objects.aggregate(
+        due=Count('id', filter=Q(status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now)),
+        retrying=Count('id', filter=Q(status=OutboundEmail.STATUS_PENDING, next_attempt_at__gt=now)),
+        sending=Count('id', filter=Q(status=OutboundEmail.STATUS_SENDING)),
+    )
+    for state, count in emails.items():
+        depth.add(count, queue='emails', state=state)
+    oldest = (
+        ReportJob.objects.filter(status=ReportJob.STATUS_PENDING).order_by('created_at')
+        .values_list('created_at', flat=True).first()
+    )
+    age = MetricFamily(
+        'pharmatrack_report_job_oldest_pending_seconds', 'gauge', 'Age of the oldest pending report job.'
+    )
+    age.add(round((now - oldest).total_seconds(), 3) if oldest else 0)
+    return [depth, age]
+
+
+def render_families(families):
+    return '\n'.join(family.render() for family in families) + '\n'
+
+
+def render_metrics():
+    families = [metric.collect() for metric in REGISTRY]
+    families += collect_email_metrics() + collect_queue_depths()
+    return render_families(families)
+
+
+def is_authorized(authorization):
+    """Whether an Authorization header carries METRICS_TOKEN"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    supplied = authorization.partition(' ')[2]
+    return secrets.compare_digest(supplied.encode(), token.encode())
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, protected by METRICS_TOKEN
+
+    Without a token it is only served with DEBUG on.
+    """
+    if getattr(settings, 'METRICS_TOKEN', ''):
+        if not is_authorized(request.META.get('HTTP_AUTHORIZATION', '')):
+            return HttpResponse('Unauthorized\n', status=401, content_type='text/plain')
+    elif not settings.DEBUG:
+        return HttpResponse('Set METRICS_TOKEN to enable metrics.\n', status=403, content_type='text/plain')
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the in-process metrics of a worker, with METRICS_TOKEN when one is set"""
+
+    def do_GET(self):
+        if getattr(settings, 'METRICS_TOKEN', '') and not is_authorized(self.headers.get('Authorization', '')):
+            self._respond(401, b'Unauthorized\n', 'text/plain')
+            return
+        body = render_families([metric.collect() for metric in REGISTRY]).encode('utf-8')
+        self._respond(200, body, CONTENT_TYPE)
+
+    def _respond(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # One line per scrape would drown the worker's own output
+        pass
+
+
+def start_metrics_server(port, address=''):
+    """Serve this process's metrics from a daemon thread and return the server
+
+    Workers run in their own processes, so the job and email histograms and
+    counters they observe are scraped from them rather than from /metrics.
+    """
+    server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_userprofile_otp_attempts_userprofile_otp_code_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['user', 'expiry_date'], name='medicine_user_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='medicine_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(condition=models.Q(('quantity__lte', models.F('low_stock_threshold'))), fields=['user', '-created_at', '-id'], name='medicine_low_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:31
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_medicine_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='medicine',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:33
+
+import django.db.models.deletion
+import inventory.models
+from django.db import migrations, models
+
+TRIGRAM_COLUMNS = ['name', 'batch_number', 'manufacturer']
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                # Search falls back to LIKE queries without FTS5
+                return
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE inventory_medicine_fts "
+            "USING fts5(name, batch_number, manufacturer, prefix='2 3')"
+        )
+        # Weight name over batch number over manufacturer when ranking
+        schema_editor.execute(
+            "INSERT INTO inventory_medicine_fts (inventory_medicine_fts, rank) "
+            "VALUES ('rank', 'bm25(10.0, 5.0, 2.0)')"
+        )
+        schema_editor.execute(
+            "INSERT INTO inventory_medicine_fts (rowid, name, batch_number, manufacturer) "
+            "SELECT id, name, batch_number, manufacturer FROM inventory_medicine"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # Match the UPPER(col::text) expression Django emits for icontains/istartswith
+        for column in TRIGRAM_COLUMNS:
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS medicine_{column}_trgm_idx ON inventory_medicine '
+                f'USING gin ((UPPER("{column}"::text)) gin_trgm_ops)'
+            )
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS inventory_medicine_fts')
+    elif vendor == 'postgresql':
+        for column in TRIGRAM_COLUMNS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS medicine_{column}_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_medicine_keyset_ordering'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineSearchEntry',
+            fields=[
+                ('medicine', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='inventory.medicine')),
+                ('name', models.TextField()),
+                ('batch_number', models.TextField()),
+                ('manufacturer', models.TextField()),
+                ('document', inventory.models.FullTextDocumentField(db_column='inventory_medicine_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'inventory_medicine_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
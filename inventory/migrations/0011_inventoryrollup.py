@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:44
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_outboundemail'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('as_of', models.DateField()),
+                ('total_medicines', models.IntegerField(default=0)),
+                ('expired_medicines', models.IntegerField(default=0)),
+                ('expiring_soon', models.IntegerField(default=0)),
+                ('low_stock', models.IntegerField(default=0)),
+                ('total_quantity', models.BigIntegerField(default=0)),
+                ('total_stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('expired_stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('expiring_soon_stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('low_stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_rollup', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
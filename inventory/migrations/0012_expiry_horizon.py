@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:50
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_inventoryrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventoryrollup',
+            name='horizon_days',
+            field=models.PositiveSmallIntegerField(default=30),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='expiry_horizon_days',
+            field=models.PositiveSmallIntegerField(default=30, help_text='Medicines expiring within this many days are flagged as expiring soon.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(365)]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 02:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_expiry_horizon'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('expired', 'Expired'), ('expiring_soon', 'Expiring Soon'), ('low_stock', 'Low Stock')], max_length=20)),
+                ('sent_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alert_watermarks', to='inventory.medicine')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('medicine', 'kind'), name='alert_watermark_unique')],
+            },
+        ),
+    ]
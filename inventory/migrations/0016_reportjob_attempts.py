@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 03:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_outboundemail_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
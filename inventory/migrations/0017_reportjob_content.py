@@ -0,0 +1,22 @@
+# Generated by Django 5.2.4 on 2026-10-18 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_reportjob_attempts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='reportjob',
+            name='artifact',
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='content',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -1,9 +1,17 @@
-from django.db import models
+from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db import models, transaction
+from django.db.models import F, Q, Case, When, Value
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
+import hashlib
+import secrets
 import uuid
-from datetime import date
+from datetime import date, timedelta
+
+EXPIRING_SOON_DAYS = 30
+MAX_EXPIRY_HORIZON_DAYS = 365
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -16,9 +24,53 @@ class UserProfile(models.Model):
     otp_created_at = models.DateTimeField(null=True, blank=True)
     otp_attempts = models.PositiveIntegerField(default=0)
     
+    # Days ahead a medicine counts as expiring soon
+    expiry_horizon_days = models.PositiveSmallIntegerField(
+        default=EXPIRING_SOON_DAYS,
+        validators=[MinValueValidator(1), MaxValueValidator(MAX_EXPIRY_HORIZON_DAYS)],
+        help_text='Medicines expiring within this many days are flagged as expiring soon.'
+    )
+    
     def __str__(self):
         return f"{self.user.username}'s profile"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_values = dict(zip(field_names, values))
+        return instance
+
+    def get_dirty_fields(self):
+        """Names of loaded fields whose value changed since the last load or save"""
+        saved_values = getattr(self, '_saved_values', {})
+        return [
+            field.attname for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in saved_values
+            and getattr(self, field.attname) != saved_values[field.attname]
+        ]
+
+    def save(self, *args, **kwargs):
+        # Only write the columns that changed, and skip the UPDATE when none did
+        if not self._state.adding and hasattr(self, '_saved_values') and kwargs.get('update_fields') is None:
+            dirty_fields = self.get_dirty_fields()
+            if not dirty_fields:
+                return
+            kwargs['update_fields'] = dirty_fields
+        super().save(*args, **kwargs)
+        self._snapshot(kwargs.get('update_fields'))
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._snapshot(fields)
+
+    def _snapshot(self, fields=None):
+        if not hasattr(self, '_saved_values'):
+            self._saved_values = {}
+        for field in self._meta.concrete_fields:
+            if fields is None or field.name in fields or field.attname in fields:
+                self._saved_values[field.attname] = getattr(self, field.attname)
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
@@ -26,7 +78,109 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
+    # Only a profile already loaded through this user can carry unsaved changes,
+    # so never fetch one just to save it (e.g. on the last_login update at login)
+    if not User.userprofile.is_cached(instance):
+        return
+    try:
+        profile = instance.userprofile
+    except UserProfile.DoesNotExist:
+        return
+    profile.save()
+
+def get_expiry_horizon(user):
+    """The user's expiring soon window in days"""
+    try:
+        return user.userprofile.expiry_horizon_days
+    except UserProfile.DoesNotExist:
+        return EXPIRING_SOON_DAYS
+
+class DaysUntil(models.Func):
+    """Whole days from the given date to a date column, negative once it has passed"""
+    arg_joiner = ' - '
+    template = '(%(expressions)s)'
+    output_field = models.IntegerField()
+
+    def __init__(self, expression, today, **extra):
+        super().__init__(expression, Value(today, output_field=models.DateField()), **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)',
+            arg_joiner=') - julianday(',
+            **extra_context
+        )
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template='DATEDIFF(%(expressions)s)',
+            arg_joiner=', ',
+            **extra_context
+        )
+
+def expired_q(today):
+    return Q(expiry_date__lt=today)
+
+def expiring_within_q(days, today):
+    return Q(expiry_date__gte=today, expiry_date__lte=today + timedelta(days=days))
+
+def low_stock_q():
+    return Q(quantity__lte=F('low_stock_threshold'))
+
+class MedicineQuerySet(models.QuerySet):
+    """Status filters shared by views, reports and statistics
+
+    Each method takes an optional today so callers building several
+    querysets resolve the date once and every filter agrees on it.
+    """
+
+    def expired(self, today=None):
+        return self.filter(expired_q(today or timezone.now().date()))
+
+    def expiring_within(self, days=EXPIRING_SOON_DAYS, today=None):
+        """Not yet expired, expiring in the next `days` days (today included)"""
+        return self.filter(expiring_within_q(days, today or timezone.now().date()))
+
+    def low_stock(self):
+        return self.filter(low_stock_q())
+
+    def active(self, today=None):
+        """Not expired and stocked above the low stock threshold"""
+        return self.filter(expiry_date__gte=today or timezone.now().date()).exclude(low_stock_q())
+
+    def with_status(self, today=None, horizon=EXPIRING_SOON_DAYS):
+        """Annotate expiry and stock status computed by the database
+
+        days_to_expiry / days_since_expiry: days left (negative once expired) and its negation
+        expiry_status: 'expired', 'expiring-soon' or 'good' (matches the status-* CSS classes)
+        low_on_stock: quantity at or below the threshold
+        status: report label, 'Expired', 'Expiring Soon', 'Low Stock' or 'Good'
+        """
+        today = today or timezone.now().date()
+        expired = expired_q(today)
+        # Checked after expired, so the upper bound alone is enough
+        expiring_soon = Q(expiry_date__lte=today + timedelta(days=horizon))
+        low_stock = low_stock_q()
+        return self.annotate(
+            days_to_expiry=DaysUntil('expiry_date', today),
+            days_since_expiry=DaysUntil('expiry_date', today) * -1,
+            expiry_status=Case(
+                When(expired, then=Value('expired')),
+                When(expiring_soon, then=Value('expiring-soon')),
+                default=Value('good'),
+                output_field=models.CharField(),
+            ),
+            low_on_stock=models.ExpressionWrapper(low_stock, output_field=models.BooleanField()),
+            status=Case(
+                When(expired, then=Value('Expired')),
+                When(expiring_soon, then=Value('Expiring Soon')),
+                When(low_stock, then=Value('Low Stock')),
+                default=Value('Good'),
+                output_field=models.CharField(),
+            ),
+        )
 
 class Medicine(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -42,9 +196,16 @@ class Medicine(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = MedicineQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name} - {self.batch_number}"
 
+    def save(self, *args, **kwargs):
+        # The rollup delta and version bump in post_save commit with the row
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
     @property
     def is_expired(self):
         return self.expiry_date < date.today()
@@ -64,7 +225,235 @@ class Medicine(models.Model):
 
     @property
     def is_expiring_soon(self):
-        return 0 <= self.days_until_expiry <= 30
+        """Within the owner's expiry horizon
+
+        Free when loaded with with_status() or select_related('user__userprofile'),
+        otherwise the owner's profile is read, so avoid it in loops over plain rows.
+        """
+        if hasattr(self, 'expiry_status'):
+            return self.expiry_status == 'expiring-soon'
+        return self.is_expiring_within(get_expiry_horizon(self.user))
+
+    def is_expiring_within(self, days):
+        return 0 <= self.days_until_expiry <= days
+
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # Expired / expiring soon range scans per user
+            models.Index(fields=['user', 'expiry_date'], name='medicine_user_expiry_idx'),
+            # Default listing order and keyset pagination per user
+            models.Index(fields=['user', '-created_at', '-id'], name='medicine_user_created_idx'),
+            # Partial index over low stock rows (ignored where unsupported)
+            models.Index(
+                fields=['user', '-created_at', '-id'],
+                name='medicine_low_stock_idx',
+                condition=Q(quantity__lte=F('low_stock_threshold')),
+            ),
+        ]
+
+class InventoryVersion(models.Model):
+    """Per-user counter bumped whenever any of the user's medicines change"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='inventory_version')
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user.username}'s inventory v{self.version}"
+
+class InventoryRollup(models.Model):
+    """Per-user inventory summary kept current by Medicine signals
+
+    Status buckets depend on the date and the user's expiry horizon, so a row
+    is only valid for its as_of day and horizon_days; the reclassify_inventory
+    command rebuilds rows every night and readers rebuild a stale row on demand.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='inventory_rollup')
+    as_of = models.DateField()
+    # Expiry horizon the expiring soon buckets were counted with
+    horizon_days = models.PositiveSmallIntegerField(default=EXPIRING_SOON_DAYS)
+    total_medicines = models.IntegerField(default=0)
+    expired_medicines = models.IntegerField(default=0)
+    expiring_soon = models.IntegerField(default=0)
+    low_stock = models.IntegerField(default=0)
+    total_quantity = models.BigIntegerField(default=0)
+    total_stock_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    expired_stock_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    expiring_soon_stock_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    low_stock_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    SUMMARY_FIELDS = (
+        'total_medicines', 'expired_medicines', 'expiring_soon', 'low_stock', 'total_quantity',
+        'total_stock_value', 'expired_stock_value', 'expiring_soon_stock_value', 'low_stock_value',
+    )
+
+    def __str__(self):
+        return f"{self.user.username}'s inventory rollup ({self.as_of})"
+
+    def get_summary(self):
+        return {field: getattr(self, field) for field in self.SUMMARY_FIELDS}
+
+class AlertWatermark(models.Model):
+    """Alert already included in a digest email, so it is only sent once
+
+    Rows are removed when the condition clears (e.g. the medicine is
+    restocked), letting the alert fire again if it comes back.
+    """
+    KIND_EXPIRED = 'expired'
+    KIND_EXPIRING_SOON = 'expiring_soon'
+    KIND_LOW_STOCK = 'low_stock'
+    KIND_CHOICES = [
+        (KIND_EXPIRED, 'Expired'),
+        (KIND_EXPIRING_SOON, 'Expiring Soon'),
+        (KIND_LOW_STOCK, 'Low Stock'),
+    ]
+
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='alert_watermarks')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.kind} alert for medicine {self.medicine_id}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['medicine', 'kind'], name='alert_watermark_unique'),
+        ]
+
+class ApiToken(models.Model):
+    """Bearer token for API clients such as scanners and POS terminals
+
+    Only a SHA-256 digest of the key is stored; the key itself is shown once
+    when the token is created.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100)
+    key_hash = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.user.username})"
+
+    @staticmethod
+    def hash_key(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def create_token(cls, user, name):
+        """Create a token and return (token, key)"""
+        key = secrets.token_urlsafe(32)
+        return cls.objects.create(user=user, name=name, key_hash=cls.hash_key(key)), key
+
+class ReportJob(models.Model):
+    """Report generated off the request path by the run_report_jobs worker"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_jobs')
+    report_type = models.CharField(max_length=20)
+    format_type = models.CharField(max_length=10)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # Stored in the database so the web service can serve what a worker service wrote
+    content = models.BinaryField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.report_type} {self.format_type} report for {self.user.username} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_COMPLETED, self.STATUS_FAILED)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Worker queue scan
+            models.Index(fields=['status', 'created_at'], name='reportjob_status_created_idx'),
+        ]
+
+class OutboundEmail(models.Model):
+    """Queued email delivered by the send_queued_emails worker"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254)
+    to = models.TextField(help_text='Comma-separated recipient addresses')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # Set by the worker that moved the email to sending
+    claim_token = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.subject} -> {self.to} ({self.status})"
+
+    @property
+    def recipients(self):
+        return [address for address in self.to.split(',') if address]
+
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            # Worker queue scan
+            models.Index(fields=['status', 'next_attempt_at'], name='email_status_next_idx'),
+        ]
+
+class FullTextDocumentField(models.TextField):
+    """Hidden FTS5 column named after its table, used as the MATCH target"""
+
+@FullTextDocumentField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+class MedicineSearchEntry(models.Model):
+    """Row of the SQLite FTS5 shadow table kept in sync with Medicine (rowid = medicine id)"""
+    medicine = models.OneToOneField(
+        Medicine,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column='rowid',
+        db_constraint=False,
+        related_name='search_entry',
+    )
+    name = models.TextField()
+    batch_number = models.TextField()
+    manufacturer = models.TextField()
+    document = FullTextDocumentField(db_column='inventory_medicine_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'inventory_medicine_fts'
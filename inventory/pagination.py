@@ -0,0 +1,102 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(value, pk):
+    """Encode a (key value, id) position as an opaque URL-safe cursor"""
+    if isinstance(value, datetime):
+        raw = f"d{value.isoformat()}|{pk}"
+    else:
+        raw = f"f{float(value)!r}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        value, pk = raw[1:].split('|')
+        if raw[0] == 'd':
+            return datetime.fromisoformat(value), int(pk)
+        if raw[0] == 'f':
+            return float(value), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, key='created_at'):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.key = key
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            last = self.object_list[-1]
+            return encode_cursor(getattr(last, self.key), last.pk)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            first = self.object_list[0]
+            return encode_cursor(getattr(first, self.key), first.pk)
+        return None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Paginate in descending (key, id) order without OFFSET
+
+    Each page is a single indexed range query, so page N costs the same as
+    page 1 no matter how deep the cursor is. The key defaults to created_at
+    (newest first); search results page on their rank annotation instead.
+    """
+
+    def __init__(self, queryset, per_page=25, key='created_at'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.key = key
+
+    def get_page(self, after=None, before=None):
+        """Get the page following `after` or preceding `before` (first page if neither)"""
+        key = self.key
+        queryset = self.queryset
+        try:
+            if before:
+                value, pk = decode_cursor(before)
+                queryset = queryset.filter(
+                    Q(**{f'{key}__gt': value}) | Q(**{key: value, 'pk__gt': pk})
+                ).order_by(key, 'id')
+                rows = list(queryset[:self.per_page + 1])
+                has_previous = len(rows) > self.per_page
+                rows = rows[:self.per_page]
+                rows.reverse()
+                return KeysetPage(rows, has_next=True, has_previous=has_previous, key=key)
+
+            if after:
+                value, pk = decode_cursor(after)
+                queryset = queryset.filter(
+                    Q(**{f'{key}__lt': value}) | Q(**{key: value, 'pk__lt': pk})
+                )
+        except InvalidCursor:
+            # Unknown cursor, fall back to the first page
+            queryset, after = self.queryset, None
+
+        rows = list(queryset.order_by(f'-{key}', '-id')[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page], has_next=has_next, has_previous=bool(after), key=key)
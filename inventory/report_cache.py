@@ -0,0 +1,130 @@
+import os
+import tempfile
+from django.conf import settings
+from django.utils import timezone
+from .reports import MedicineReportGenerator, REPORT_EXTENSIONS
+from .versioning import get_inventory_version
+
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+
+class ReportCache:
+    """Size-bounded LRU cache of generated report files on local disk
+
+    Entries are keyed by (user, report type, format, inventory version, date),
+    so any change to the inventory or the date rolling over makes old entries
+    unreachable; they are then dropped eagerly or by LRU eviction.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+
+    @property
+    def directory(self):
+        return str(self._directory or getattr(
+            settings, 'REPORT_CACHE_DIR',
+            os.path.join(tempfile.gettempdir(), 'pharmatrack-report-cache')
+        ))
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or getattr(settings, 'REPORT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    def get_key(self, user, report_type, format_type, version=None, day=None):
+        if version is None:
+            version = get_inventory_version(user)
+        day = day or timezone.now().date()
+        return f"{user.pk}-{report_type}-{format_type}-v{version}-{day.isoformat()}.{REPORT_EXTENSIONS[format_type]}"
+
+    def open_report(self, user, report_type, format_type):
+        """Open the cached report file, generating and storing it on a miss"""
+        key = self.get_key(user, report_type, format_type)
+        report_file = self.get(key)
+        if report_file is None:
+            generator = MedicineReportGenerator(user)
+            report_file = self.put(
+                key, lambda output: generator.write_report(report_type, format_type, output)
+            )
+        return report_file
+
+    def get(self, key):
+        """Open a cached entry for reading, or return None on a miss"""
+        path = os.path.join(self.directory, key)
+        try:
+            report_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        # Mark as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return report_file
+
+    def put(self, key, write):
+        """Store an entry produced by write(output) and return it opened for reading"""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                write(output)
+            path = os.path.join(self.directory, key)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        # Open before evicting so the new entry survives even if it is evicted
+        report_file = open(path, 'rb')
+        self.discard_stale(key)
+        self.evict()
+        return report_file
+
+    def discard_stale(self, key):
+        """Remove older versions of the same report, they can never be hit again
+
+        Entries for a newer inventory version or day are kept: another request
+        may have written one after this key was computed.
+        """
+        prefix, written = self._split_key(key)
+        for name in os.listdir(self.directory):
+            if not name.startswith(prefix):
+                continue
+            other_prefix, other = self._split_key(name)
+            if other_prefix == prefix and other is not None and other < written:
+                self._remove(name)
+
+    @staticmethod
+    def _split_key(name):
+        """(user-type-format prefix, (inventory version, ISO day)) of a cache file name"""
+        prefix, _, rest = name.partition('-v')
+        version, _, day = rest.partition('-')
+        if not version.isdigit():
+            return prefix + '-v', None
+        return prefix + '-v', (int(version), day.split('.', 1)[0])
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith('.tmp-'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.name))
+                total += stat.st_size
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(name)
+            total -= size
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+report_cache = ReportCache()
@@ -1,72 +1,164 @@
-from datetime import date, timedelta
-from django.http import HttpResponse
-from django.utils import timezone
-from django.db.models import F
+from datetime import date
+from decimal import Decimal
+import csv
+import json
+import tempfile
+from django.http import HttpResponse, FileResponse, StreamingHttpResponse
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-from .models import Medicine
+import xlsxwriter
+from .metrics import REPORT_DURATION, timed_chunks
+from .models import Medicine, get_expiry_horizon
+from .stats import InventoryStatistics
+
+# Rows fetched per database round trip when streaming exports
+EXPORT_CHUNK_SIZE = 2000
+
+REPORT_TYPES = ['all', 'expired', 'expiring_soon', 'low_stock', 'active']
+REPORT_EXTENSIONS = {
+    'pdf': 'pdf',
+    'excel': 'xlsx',
+    'csv': 'csv',
+    'jsonl': 'jsonl',
+}
+REPORT_CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+# Formats written row by row and streamed straight to the client
+STREAMING_FORMATS = ('csv', 'jsonl')
+
+EXPORT_FIELDS = [
+    'name', 'batch_number', 'manufacturer', 'manufacturing_date', 'expiry_date',
+    'quantity', 'price_per_unit', 'low_stock_threshold', 'description',
+]
+EXPORT_HEADERS = [
+    'Medicine Name', 'Batch Number', 'Manufacturer', 'Manufacturing Date',
+    'Expiry Date', 'Quantity', 'Price per Unit', 'Low Stock Threshold',
+    'Description', 'Status', 'Days Until Expiry'
+]
+
+
+# The PDF medicine table is split into tables of this many rows, about a page each
+PDF_TABLE_CHUNK_ROWS = 40
+PDF_FIELDS = ['name', 'batch_number', 'manufacturer', 'expiry_date', 'quantity']
+PDF_HEADERS = ['Name', 'Batch', 'Manufacturer', 'Expiry', 'Quantity', 'Status']
+PDF_COLUMN_WIDTHS = [1.5*inch, 1*inch, 1.5*inch, 1*inch, 0.8*inch, 1*inch]
+# Shared by every chunk of the medicine table
+PDF_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+])
+
+
+class _LineBuffer:
+    """File-like object whose write() hands back the line for streaming"""
+    
+    def write(self, value):
+        return value
+
+
+class _FlowableFeed(list):
+    """Flowable list for doc.build() that is topped up from an iterator
+    
+    build() checks len(flowables) before handling each flowable and deletes
+    it from the front once drawn, so only a few chunk tables are built and
+    held at a time instead of every row. reportlab still keeps the finished,
+    compressed pages in memory until the document is saved, so memory grows
+    with the size of the PDF, just far more slowly than with every row held.
+    This relies on build() internals, so reportlab is pinned to a minor
+    release and a test compares the drawn rows with an eager build.
+    """
+    
+    def __init__(self, flowables, more, queued=2):
+        super().__init__(flowables)
+        self.more = more
+        self.queued = queued
+    
+    def __len__(self):
+        while self.more is not None and super().__len__() < self.queued:
+            flowable = next(self.more, None)
+            if flowable is None:
+                self.more = None
+            else:
+                self.append(flowable)
+        return super().__len__()
+
 
 class MedicineReportGenerator:
     def __init__(self, user):
         self.user = user
         self.medicines = Medicine.objects.filter(user=user)
+        self.horizon = get_expiry_horizon(user)
     
     def get_inventory_summary(self):
         """Get summary statistics for inventory"""
-        total_medicines = self.medicines.count()
-        expired_medicines = self.medicines.filter(expiry_date__lt=timezone.now().date()).count()
-        expiring_soon = self.medicines.filter(
-            expiry_date__lte=timezone.now().date() + timedelta(days=30),
-            expiry_date__gt=timezone.now().date()
-        ).count()
-        low_stock = self.medicines.filter(quantity__lte=F('low_stock_threshold')).count()
-        
-        return {
-            'total_medicines': total_medicines,
-            'expired_medicines': expired_medicines,
-            'expiring_soon': expiring_soon,
-            'low_stock': low_stock,
-        }
+        return InventoryStatistics(self.user).get_summary()
     
     def generate_excel_report(self, report_type='all'):
         """Generate Excel report with formatting"""
-        # Create workbook and worksheet
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"Medicine Report - {report_type.title()}"
+        # Spool to a temporary file so the response streams from disk
+        output = tempfile.TemporaryFile()
+        self.write_excel_report(report_type, output)
+        output.seek(0)
         
-        # Define styles
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=self.get_filename(report_type, 'excel'),
+            content_type=REPORT_CONTENT_TYPES['excel']
+        )
+    
+    def write_excel_report(self, report_type, output):
+        """Write the Excel report to a binary file object in a single streaming pass"""
+        # constant_memory flushes each row to disk as soon as the next one starts
+        wb = xlsxwriter.Workbook(output, {'constant_memory': True})
+        ws = wb.add_worksheet(f"Medicine Report - {report_type.title()}"[:31])
         
-        # Write header
-        headers = [
-            'Medicine Name', 'Batch Number', 'Manufacturer', 'Manufacturing Date',
-            'Expiry Date', 'Quantity', 'Price per Unit', 'Low Stock Threshold',
-            'Description', 'Status', 'Days Until Expiry'
-        ]
+        # Define styles once, every cell shares them
+        header_format = wb.add_format({
+            'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#366092',
+            'align': 'center', 'valign': 'vcenter',
+        })
+        status_colors = {
+            'Expired': '#FFB6C1',
+            'Expiring Soon': '#FFE4B5',
+            'Low Stock': '#ADD8E6',
+            'Good': None,
+        }
+        cell_formats = {}
+        date_formats = {}
+        for status, color in status_colors.items():
+            properties = {'bg_color': color} if color else {}
+            cell_formats[status] = wb.add_format(properties)
+            date_formats[status] = wb.add_format(dict(properties, num_format='yyyy-mm-dd'))
         
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
+        # Write header
+        headers = EXPORT_HEADERS
+        ws.write_row(0, 0, headers, header_format)
+        widths = [len(header) for header in headers]
         
-        # Filter medicines based on report type
-        medicines = self._filter_medicines_by_type(report_type)
+        # Filter medicines based on report type, status computed by the database
+        medicines = self._filter_medicines_by_type(report_type).with_status(horizon=self.horizon)
         
-        # Write data
-        for row, medicine in enumerate(medicines, 2):
-            status = self._get_medicine_status(medicine)
-            days_until_expiry = medicine.days_until_expiry
+        # Write data, tracking column widths as we go
+        for row, medicine in enumerate(medicines.iterator(chunk_size=EXPORT_CHUNK_SIZE), 1):
+            status = medicine.status
+            cell_format = cell_formats[status]
+            date_format = date_formats[status]
             
             data = [
                 medicine.name,
@@ -79,49 +171,38 @@ class MedicineReportGenerator:
                 medicine.low_stock_threshold,
                 medicine.description or '',
                 status,
-                days_until_expiry
+                medicine.days_to_expiry
             ]
             
-            for col, value in enumerate(data, 1):
-                cell = ws.cell(row=row, column=col, value=value)
-                
-                # Color coding based on status
-                if status == 'Expired':
-                    cell.fill = PatternFill(start_color="FFB6C1", end_color="FFB6C1", fill_type="solid")
-                elif status == 'Expiring Soon':
-                    cell.fill = PatternFill(start_color="FFE4B5", end_color="FFE4B5", fill_type="solid")
-                elif status == 'Low Stock':
-                    cell.fill = PatternFill(start_color="ADD8E6", end_color="ADD8E6", fill_type="solid")
+            for col, value in enumerate(data):
+                if isinstance(value, date):
+                    ws.write_datetime(row, col, value, date_format)
+                    length = 10
+                elif isinstance(value, (int, Decimal)):
+                    ws.write_number(row, col, value, cell_format)
+                    length = len(str(value))
+                else:
+                    ws.write_string(row, col, value, cell_format)
+                    length = len(value)
+                if length > widths[col]:
+                    widths[col] = length
         
-        # Auto-adjust column widths
-        for column in ws.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
+        for col, width in enumerate(widths):
+            ws.set_column(col, col, min(width + 2, 50))
         
-        # Save to response
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="medicine_report_{report_type}_{date.today()}.xlsx"'
-        
-        wb.save(response)
-        return response
+        wb.close()
     
     def generate_pdf_report(self, report_type='all'):
         """Generate PDF report"""
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="medicine_report_{report_type}_{date.today()}.pdf"'
-        
+        response = HttpResponse(content_type=REPORT_CONTENT_TYPES['pdf'])
+        response['Content-Disposition'] = f'attachment; filename="{self.get_filename(report_type, "pdf")}"'
+        self.write_pdf_report(report_type, response)
+        return response
+    
+    def write_pdf_report(self, report_type, output):
+        """Write the PDF report to a binary file object"""
         # Create PDF document
-        doc = SimpleDocTemplate(response, pagesize=A4)
+        doc = SimpleDocTemplate(output, pagesize=A4)
         elements = []
         
         # Get styles
@@ -143,7 +224,7 @@ class MedicineReportGenerator:
         summary_data = [
             ['Total Medicines', summary['total_medicines']],
             ['Expired Medicines', summary['expired_medicines']],
-            ['Expiring Soon (30 days)', summary['expiring_soon']],
+            [f'Expiring Soon ({self.horizon} days)', summary['expiring_soon']],
             ['Low Stock Items', summary['low_stock']],
         ]
         
@@ -161,74 +242,108 @@ class MedicineReportGenerator:
         elements.append(summary_table)
         elements.append(Spacer(1, 20))
         
-        # Filter medicines based on report type
-        medicines = self._filter_medicines_by_type(report_type)
-        
-        if medicines:
-            # Prepare data for table
-            data = [['Name', 'Batch', 'Manufacturer', 'Expiry', 'Quantity', 'Status']]
-            
-            for medicine in medicines:
-                status = self._get_medicine_status(medicine)
-                data.append([
-                    medicine.name,
-                    medicine.batch_number,
-                    medicine.manufacturer,
-                    medicine.expiry_date.strftime('%Y-%m-%d'),
-                    str(medicine.quantity),
-                    status
-                ])
-            
-            # Create table
-            table = Table(data, colWidths=[1.5*inch, 1*inch, 1.5*inch, 1*inch, 0.8*inch, 1*inch])
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black),
-                ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ]))
-            elements.append(table)
+        # Medicine table, in page-sized chunks handed to the builder as it goes
+        tables = self._iter_pdf_tables(report_type)
+        first_table = next(tables, None)
+        if first_table is not None:
+            elements.append(first_table)
         else:
             no_data = Paragraph("No medicines found for this report type.", styles['Normal'])
             elements.append(no_data)
         
         # Build PDF
-        doc.build(elements)
+        doc.build(_FlowableFeed(elements, tables))
+    
+    def _iter_pdf_tables(self, report_type):
+        """Yield the PDF medicine table in chunks of PDF_TABLE_CHUNK_ROWS rows
+        
+        Laying out one table of every row costs more than linear time, as each
+        page split copies the rest of the table. Chunks about a page long keep
+        layout linear, and each chunk repeats the header row when it spans a
+        page break.
+        """
+        medicines = self._filter_medicines_by_type(report_type).with_status(horizon=self.horizon).values_list(
+            *PDF_FIELDS, 'status'
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        rows = []
+        for name, batch_number, manufacturer, expiry_date, quantity, status in medicines:
+            rows.append([name, batch_number, manufacturer, expiry_date.strftime('%Y-%m-%d'), str(quantity), status])
+            if len(rows) == PDF_TABLE_CHUNK_ROWS:
+                yield self._pdf_table(rows)
+                rows = []
+        if rows:
+            yield self._pdf_table(rows)
+    
+    @staticmethod
+    def _pdf_table(rows):
+        table = Table([PDF_HEADERS] + rows, colWidths=PDF_COLUMN_WIDTHS, repeatRows=1)
+        table.setStyle(PDF_TABLE_STYLE)
+        return table
+    
+    def stream_report(self, report_type, format_type):
+        """Stream a CSV or JSON Lines report row by row"""
+        response = StreamingHttpResponse(
+            timed_chunks(self.iter_report_chunks(report_type, format_type), REPORT_DURATION, format=format_type),
+            content_type=REPORT_CONTENT_TYPES[format_type]
+        )
+        response['Content-Disposition'] = f'attachment; filename="{self.get_filename(report_type, format_type)}"'
         return response
     
+    def iter_report_chunks(self, report_type, format_type):
+        """Yield encoded CSV or JSON Lines chunks for a report"""
+        if format_type == 'csv':
+            return self._iter_csv(report_type)
+        return self._iter_jsonl(report_type)
+    
+    def _iter_export_rows(self, report_type):
+        """Yield export rows, status columns last, with constant memory"""
+        medicines = self._filter_medicines_by_type(report_type).with_status(horizon=self.horizon).values_list(
+            *EXPORT_FIELDS, 'status', 'days_to_expiry', named=True
+        )
+        return medicines.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    
+    def _iter_csv(self, report_type):
+        buffer = _LineBuffer()
+        writer = csv.writer(buffer)
+        yield writer.writerow(EXPORT_HEADERS).encode('utf-8')
+        for medicine in self._iter_export_rows(report_type):
+            yield writer.writerow(medicine).encode('utf-8')
+    
+    def _iter_jsonl(self, report_type):
+        for medicine in self._iter_export_rows(report_type):
+            record = medicine._asdict()
+            record['manufacturing_date'] = medicine.manufacturing_date.isoformat()
+            record['expiry_date'] = medicine.expiry_date.isoformat()
+            record['price_per_unit'] = str(medicine.price_per_unit)
+            record['days_until_expiry'] = record.pop('days_to_expiry')
+            yield (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+    
+    def write_report(self, report_type, format_type, output):
+        """Write a report in any supported format to a binary file object"""
+        with REPORT_DURATION.time(format=format_type):
+            if format_type in STREAMING_FORMATS:
+                for chunk in self.iter_report_chunks(report_type, format_type):
+                    output.write(chunk)
+                return
+            writers = {
+                'excel': self.write_excel_report,
+                'pdf': self.write_pdf_report,
+            }
+            writers[format_type](report_type, output)
+    
+    @staticmethod
+    def get_filename(report_type, format_type):
+        """Download filename for a report"""
+        return f"medicine_report_{report_type}_{date.today()}.{REPORT_EXTENSIONS[format_type]}"
+    
     def _filter_medicines_by_type(self, report_type):
         """Filter medicines based on report type"""
-        if report_type == 'all':
-            return self.medicines
-        elif report_type == 'expired':
-            return self.medicines.filter(expiry_date__lt=timezone.now().date())
+        if report_type == 'expired':
+            return self.medicines.expired()
         elif report_type == 'expiring_soon':
-            return self.medicines.filter(
-                expiry_date__lte=timezone.now().date() + timedelta(days=30),
-                expiry_date__gt=timezone.now().date()
-            )
+            return self.medicines.expiring_within(self.horizon)
         elif report_type == 'low_stock':
-            return self.medicines.filter(quantity__lte=F('low_stock_threshold'))
+            return self.medicines.low_stock()
         elif report_type == 'active':
-            return self.medicines.filter(
-                expiry_date__gt=timezone.now().date(),
-                quantity__gt=F('low_stock_threshold')
-            )
-        else:
-            return self.medicines
-    
-    def _get_medicine_status(self, medicine):
-        """Get status of medicine"""
-        if medicine.is_expired:
-            return 'Expired'
-        elif medicine.is_expiring_soon:
-            return 'Expiring Soon'
-        elif medicine.is_low_stock:
-            return 'Low Stock'
-        else:
-            return 'Good' 
\ No newline at end of file
+            return self.medicines.active()
+        return self.medicines
@@ -0,0 +1,125 @@
+import re
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Greatest
+
+FTS_TABLE = 'inventory_medicine_fts'
+RANK_FIELD = 'search_rank'
+
+
+class MedicineSearch:
+    """Fallback search: substring match on name and manufacturer, prefix match on batch number"""
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(batch_number__istartswith=query) |
+            Q(manufacturer__icontains=query)
+        ).annotate(**{RANK_FIELD: Value(0.0, output_field=FloatField())})
+
+    def index(self, medicines):
+        """Add or refresh the index entries of the given medicines"""
+
+    def remove(self, medicine_ids):
+        """Drop the index entries of the given medicine ids"""
+
+
+class SQLiteMedicineSearch(MedicineSearch):
+    """FTS5 search over the inventory_medicine_fts shadow table, ranked by bm25"""
+
+    def __init__(self):
+        self._available = None
+
+    @property
+    def available(self):
+        if self._available is None:
+            self._available = FTS_TABLE in connection.introspection.table_names()
+        return self._available
+
+    def search(self, queryset, query):
+        if not self.available:
+            return super().search(queryset, query)
+
+        match = self.build_match_expression(query)
+        if not match:
+            return queryset.none()
+
+        # bm25 ranks are negative with the best match lowest, flip them so
+        # every backend sorts search_rank descending
+        return queryset.filter(search_entry__document__match=match).annotate(
+            **{RANK_FIELD: Value(0.0, output_field=FloatField()) - F('search_entry__rank')}
+        )
+
+    def build_match_expression(self, query):
+        """Turn free text into an FTS5 query where every token is a prefix match"""
+        tokens = re.findall(r'\w+', query)
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def index(self, medicines):
+        if not self.available:
+            return
+        rows = [(m.pk, m.name, m.batch_number, m.manufacturer) for m in medicines]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, batch_number, manufacturer) VALUES (%s, %s, %s, %s)',
+                rows
+            )
+
+    def remove(self, medicine_ids):
+        if not self.available or not medicine_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in medicine_ids])
+
+
+class PostgresMedicineSearch(MedicineSearch):
+    """pg_trgm search; the GIN trigram indexes serve both the ILIKE filters and the ranking"""
+
+    def search(self, queryset, query):
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        rank = Greatest(
+            TrigramSimilarity('name', query),
+            TrigramSimilarity('manufacturer', query),
+        ) + Case(
+            When(batch_number__istartswith=query, then=Value(1.0)),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(batch_number__istartswith=query) |
+            Q(manufacturer__icontains=query)
+        ).annotate(**{RANK_FIELD: rank})
+
+
+_backends = {}
+
+
+def get_search_backend():
+    """Get the search implementation for the default database"""
+    vendor = connection.vendor
+    if vendor not in _backends:
+        if vendor == 'sqlite':
+            _backends[vendor] = SQLiteMedicineSearch()
+        elif vendor == 'postgresql':
+            _backends[vendor] = PostgresMedicineSearch()
+        else:
+            _backends[vendor] = MedicineSearch()
+    return _backends[vendor]
+
+
+def search_medicines(queryset, query):
+    """Filter a Medicine queryset by a search query and annotate it with search_rank"""
+    return get_search_backend().search(queryset, query.strip())
+
+
+def index_medicines(medicines):
+    get_search_backend().index(medicines)
+
+
+def remove_medicines(medicine_ids):
+    get_search_backend().remove(medicine_ids)
@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Medicine
+from .search import index_medicines, remove_medicines
+from .stats import ROLLUP_FIELDS, apply_rollup_change, clean_rollup_values
+from .versioning import bump_inventory_version
+
+@receiver(post_save, sender=Medicine)
+def update_medicine_search_index(sender, instance, **kwargs):
+    """Keep the search index in sync with saved medicines"""
+    index_medicines([instance])
+
+@receiver(post_delete, sender=Medicine)
+def remove_medicine_search_index(sender, instance, **kwargs):
+    """Drop deleted medicines from the search index"""
+    remove_medicines([instance.pk])
+
+@receiver(pre_save, sender=Medicine)
+def remember_medicine_rollup_values(sender, instance, **kwargs):
+    """Load the stored values an update is about to replace"""
+    instance._rollup_previous = None
+    if not instance._state.adding and instance.pk is not None:
+        # Locked until Medicine.save commits, so concurrent edits see each other's values
+        previous = Medicine.objects.select_for_update().filter(pk=instance.pk).values(*ROLLUP_FIELDS).first()
+        if previous is not None:
+            instance._rollup_previous = clean_rollup_values(previous)
+
+@receiver(post_save, sender=Medicine)
+def update_medicine_rollup(sender, instance, **kwargs):
+    """Apply the saved medicine's change to the owner's inventory rollup"""
+    current = clean_rollup_values({field: getattr(instance, field) for field in ROLLUP_FIELDS})
+    apply_rollup_change(getattr(instance, '_rollup_previous', None), current)
+
+def _deleted_with_owner(kwargs):
+    # Cascade from deleting the user, their per-user rows are going away too
+    origin = kwargs.get('origin')
+    if isinstance(origin, QuerySet):
+        return origin.model is User
+    return isinstance(origin, User)
+
+@receiver(post_delete, sender=Medicine)
+def remove_medicine_rollup(sender, instance, **kwargs):
+    """Take the deleted medicine out of the owner's inventory rollup"""
+    if _deleted_with_owner(kwargs):
+        return
+    previous = clean_rollup_values({field: getattr(instance, field) for field in ROLLUP_FIELDS})
+    apply_rollup_change(previous, None)
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+def bump_medicine_inventory_version(sender, instance, **kwargs):
+    """Invalidate cached reports and pages derived from the owner's inventory"""
+    if _deleted_with_owner(kwargs):
+        return
+    bump_inventory_version(instance.user_id)
@@ -0,0 +1,286 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import (
+    Count, Sum, F, Value, Case, When, IntegerField, DecimalField, ExpressionWrapper
+)
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import (
+    Medicine, InventoryRollup, UserProfile, EXPIRING_SOON_DAYS,
+    expired_q, expiring_within_q, low_stock_q, get_expiry_horizon
+)
+from .versioning import get_inventory_version
+
+# Medicine fields that decide which rollup buckets a row counts towards
+ROLLUP_FIELDS = ('user_id', 'expiry_date', 'quantity', 'price_per_unit', 'low_stock_threshold')
+
+# (label, first day, last day) of each expiry histogram bucket, None for open ended
+EXPIRY_HISTOGRAM_BUCKETS = (
+    ('0-7 days', 0, 7),
+    ('8-30 days', 8, 30),
+    ('31-90 days', 31, 90),
+    ('90+ days', 91, None),
+)
+EXPIRY_HISTOGRAM_CACHE_TIMEOUT = 24 * 60 * 60
+
+MONEY = DecimalField(max_digits=20, decimal_places=2)
+
+
+class InventoryStatistics:
+    """Inventory status buckets for a single user
+
+    The summary is read from the user's InventoryRollup row; the aggregate
+    query over Medicine is only run to rebuild a missing or stale rollup.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.medicines = Medicine.objects.filter(user=user)
+        self.horizon = get_expiry_horizon(user)
+
+    def get_summary(self):
+        """Get counts and stock value totals for every status bucket"""
+        today = timezone.now().date()
+        rollup = InventoryRollup.objects.filter(user=self.user).first()
+        if rollup is None or rollup.as_of != today or rollup.horizon_days != self.horizon:
+            rollup = rebuild_inventory_rollups([self.user.pk], today)[0]
+        return rollup.get_summary()
+
+    def get_aggregates(self, today=None):
+        """Aggregate expressions computing the summary from Medicine rows"""
+        return get_status_aggregates(today or timezone.now().date(), self.horizon)
+
+    def get_expiry_histogram(self, today=None):
+        """Stock expiring in each EXPIRY_HISTOGRAM_BUCKETS window, cached per inventory version"""
+        today = today or timezone.now().date()
+        key = f'expiry-histogram:{self.user.pk}:v{get_inventory_version(self.user)}:{today.isoformat()}'
+        histogram = cache.get(key)
+        if histogram is None:
+            histogram = self.compute_expiry_histogram(today)
+            cache.set(key, histogram, EXPIRY_HISTOGRAM_CACHE_TIMEOUT)
+        return histogram
+
+    def get_expiry_histogram_queryset(self, today):
+        """One grouped aggregate bucketing unexpired stock by days to expiry"""
+        whens = [
+            When(expiry_date__lte=today + timedelta(days=last), then=Value(index))
+            for index, (_, _, last) in enumerate(EXPIRY_HISTOGRAM_BUCKETS)
+            if last is not None
+        ]
+        return (
+            self.medicines.filter(expiry_date__gte=today)
+            .annotate(bucket=Case(*whens, default=Value(len(whens)), output_field=IntegerField()))
+            .order_by()
+            .values('bucket')
+            .annotate(
+                medicine_count=Count('id'),
+                total_quantity=Sum('quantity'),
+                total_stock_value=Sum(get_stock_value()),
+            )
+        )
+
+    def compute_expiry_histogram(self, today):
+        """Histogram rows for every bucket, empty buckets included"""
+        totals = {row['bucket']: row for row in self.get_expiry_histogram_queryset(today)}
+
+        histogram = []
+        for index, (label, first, last) in enumerate(EXPIRY_HISTOGRAM_BUCKETS):
+            row = totals.get(index, {})
+            histogram.append({
+                'label': label,
+                'first_day': first,
+                'last_day': last,
+                'medicines': row.get('medicine_count', 0),
+                'quantity': row.get('total_quantity') or 0,
+                'stock_value': row.get('total_stock_value') or Decimal('0.00'),
+            })
+        # Share of unexpired stock value, for the bar widths
+        total_value = sum(bucket['stock_value'] for bucket in histogram)
+        for bucket in histogram:
+            bucket['percent'] = round(bucket['stock_value'] * 100 / total_value) if total_value else 0
+        return histogram
+
+
+def get_stock_value():
+    return ExpressionWrapper(F('quantity') * F('price_per_unit'), output_field=MONEY)
+
+
+def get_status_aggregates(today, horizon=EXPIRING_SOON_DAYS):
+    """Count/Sum expressions for every status bucket as of the given day"""
+    # Same conditions as the MedicineQuerySet filters
+    expired = expired_q(today)
+    expiring_soon = expiring_within_q(horizon, today)
+    low_stock = low_stock_q()
+
+    stock_value = get_stock_value()
+    zero = Value(Decimal('0.00'), output_field=MONEY)
+
+    return dict(
+        total_medicines=Count('id'),
+        expired_medicines=Count('id', filter=expired),
+        expiring_soon=Count('id', filter=expiring_soon),
+        low_stock=Count('id', filter=low_stock),
+        total_quantity=Coalesce(Sum('quantity'), 0),
+        total_stock_value=Coalesce(Sum(stock_value), zero),
+        expired_stock_value=Coalesce(Sum(stock_value, filter=expired), zero),
+        expiring_soon_stock_value=Coalesce(Sum(stock_value, filter=expiring_soon), zero),
+        low_stock_value=Coalesce(Sum(stock_value, filter=low_stock), zero),
+    )
+
+
+def lock_rollup_owners(user_ids=None):
+    """Lock the users whose rollups are about to be rebuilt or updated
+
+    A rebuild aggregates while holding the lock, so a medicine write either
+    commits first and is counted, or waits and applies its delta on top.
+    """
+    users = User.objects.select_for_update().order_by('pk')
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    list(users.values_list('pk', flat=True))
+
+
+@transaction.atomic(savepoint=False)
+def rebuild_inventory_rollups(user_ids=None, today=None):
+    """Recompute rollups from Medicine rows
+
+    Rebuilds the given users, or every user with medicines or a rollup when
+    user_ids is None, and returns the saved rollups. Runs one grouped
+    aggregate per distinct expiry horizon among those users, holding the
+    owners' locks so concurrent medicine deltas are not lost.
+    """
+    lock_rollup_owners(user_ids)
+    today = today or timezone.now().date()
+    now = timezone.now()
+    profiles = UserProfile.objects.all()
+    if user_ids is not None:
+        profiles = profiles.filter(user_id__in=user_ids)
+    horizons = dict(profiles.values_list('user_id', 'expiry_horizon_days'))
+    custom_horizons = set(horizons.values()) - {EXPIRING_SOON_DAYS}
+
+    rollups = {}
+    for horizon in custom_horizons | {EXPIRING_SOON_DAYS}:
+        medicines = Medicine.objects.order_by()
+        if user_ids is not None:
+            medicines = medicines.filter(user_id__in=[
+                user_id for user_id in user_ids
+                if horizons.get(user_id, EXPIRING_SOON_DAYS) == horizon
+            ])
+        elif horizon == EXPIRING_SOON_DAYS:
+            # Also covers users without a profile
+            medicines = medicines.exclude(user__userprofile__expiry_horizon_days__in=custom_horizons)
+        else:
+            medicines = medicines.filter(user__userprofile__expiry_horizon_days=horizon)
+        rows = medicines.values('user_id').annotate(**get_status_aggregates(today, horizon))
+        for row in rows:
+            rollups[row['user_id']] = InventoryRollup(as_of=today, horizon_days=horizon, updated_at=now, **row)
+
+    # Users without medicines get an all-zero rollup
+    if user_ids is None:
+        user_ids = InventoryRollup.objects.values_list('user_id', flat=True)
+    for user_id in user_ids:
+        if user_id not in rollups:
+            rollups[user_id] = InventoryRollup(
+                user_id=user_id, as_of=today, updated_at=now,
+                horizon_days=horizons.get(user_id, EXPIRING_SOON_DAYS)
+            )
+
+    return InventoryRollup.objects.bulk_create(
+        list(rollups.values()),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['as_of', 'horizon_days', 'updated_at', *InventoryRollup.SUMMARY_FIELDS],
+    )
+
+
+def clean_rollup_values(values):
+    """A ROLLUP_FIELDS dict with every value converted to the field's Python type
+
+    Instances may hold what was assigned, say a date string from a fixture or
+    a float price, which the ORM accepts but the contribution maths does not.
+    """
+    return {
+        field: Medicine._meta.get_field(field).to_python(values[field])
+        for field in ROLLUP_FIELDS
+    }
+
+
+def get_rollup_contribution(values, today):
+    """Amounts one medicine adds to its owner's rollup, from a ROLLUP_FIELDS dict
+
+    The expiring soon buckets depend on the rollup's horizon and are left out;
+    apply_rollup_changes adds them using the horizon stored on the rollup.
+    """
+    stock_value = values['quantity'] * Decimal(values['price_per_unit'])
+    expired = values['expiry_date'] < today
+    low_stock = values['quantity'] <= values['low_stock_threshold']
+    return {
+        'total_medicines': 1,
+        'expired_medicines': int(expired),
+        'low_stock': int(low_stock),
+        'total_quantity': values['quantity'],
+        'total_stock_value': stock_value,
+        'expired_stock_value': stock_value if expired else 0,
+        'low_stock_value': stock_value if low_stock else 0,
+    }
+
+
+def apply_rollup_change(previous, current):
+    """Move one medicine's contribution from its previous to its current values
+
+    Either side may be None for a created or deleted medicine.
+    """
+    apply_rollup_changes([(previous, current)])
+
+
+@transaction.atomic(savepoint=False)
+def apply_rollup_changes(changes):
+    """Apply many (previous, current) medicine changes, one UPDATE per user
+
+    Only rollups that are current for today are updated in place with F()
+    deltas; a stale or missing rollup is left for the next reader or nightly
+    run to rebuild. The expiring soon deltas are summed here for the horizon
+    read from each rollup, so every UPDATE has the same size however many
+    expiry dates the changes touch. Call it in the transaction that writes
+    the medicines, the owners stay locked until it commits.
+    """
+    today = timezone.now().date()
+    deltas = {}
+    for previous, current in changes:
+        if previous == current:
+            continue
+        for values, sign in ((previous, -1), (current, 1)):
+            if values is None:
+                continue
+            user_deltas = deltas.setdefault(values['user_id'], {'fixed': {}, 'expiring': {}})
+            for field, amount in get_rollup_contribution(values, today).items():
+                user_deltas['fixed'][field] = user_deltas['fixed'].get(field, 0) + sign * amount
+            days_to_expiry = (values['expiry_date'] - today).days
+            if days_to_expiry >= 0:
+                stock_value = values['quantity'] * Decimal(values['price_per_unit'])
+                count, value = user_deltas['expiring'].get(days_to_expiry, (0, 0))
+                user_deltas['expiring'][days_to_expiry] = (count + sign, value + sign * stock_value)
+
+    # Read after taking the lock, so a rebuild that was running has committed
+    lock_rollup_owners(deltas)
+    # Counted as expiring soon only within the horizon stored on the rollup row
+    horizons = dict(
+        InventoryRollup.objects.filter(user_id__in=deltas, as_of=today).values_list('user_id', 'horizon_days')
+    )
+    now = timezone.now()
+    for user_id, user_deltas in deltas.items():
+        if user_id not in horizons:
+            continue
+        horizon = horizons[user_id]
+        amounts = dict(user_deltas['fixed'])
+        for days_to_expiry, (count_delta, value_delta) in user_deltas['expiring'].items():
+            if days_to_expiry <= horizon:
+                amounts['expiring_soon'] = amounts.get('expiring_soon', 0) + count_delta
+                amounts['expiring_soon_stock_value'] = amounts.get('expiring_soon_stock_value', 0) + value_delta
+        changes = {field: F(field) + amount for field, amount in amounts.items() if amount}
+        if changes:
+            InventoryRollup.objects.filter(user_id=user_id).update(updated_at=now, **changes)
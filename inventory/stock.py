@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+from .models import Medicine
+from .stats import ROLLUP_FIELDS, apply_rollup_changes
+from .versioning import bump_inventory_version
+
+MAX_STOCK_ADJUSTMENTS = 500
+
+
+class StockAdjustmentError(Exception):
+    """Raised when a batch cannot be applied; nothing in the batch was changed"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(f"{error['id']}: {error['error']}" for error in errors))
+        self.errors = errors
+
+
+def merge_adjustments(adjustments):
+    """Sum the deltas of repeated medicine ids, dropping zero net changes"""
+    deltas = {}
+    for medicine_id, delta in adjustments:
+        deltas[medicine_id] = deltas.get(medicine_id, 0) + delta
+    return {medicine_id: delta for medicine_id, delta in deltas.items() if delta}
+
+
+def adjust_stock(user, adjustments):
+    """Add each (medicine id, delta) pair to the user's stock, all or nothing
+
+    The whole batch is a single UPDATE of quantity = quantity + delta whose
+    WHERE clause also requires quantity + delta >= 0, so concurrent
+    terminals dispensing the same batch never lose updates or go negative.
+    Returns {medicine id: new quantity}.
+
+    update() skips the Medicine signals; the rollup and inventory version are
+    updated here. Quantity is not part of the search index.
+    """
+    deltas = merge_adjustments(adjustments)
+    if not deltas:
+        return {}
+
+    with transaction.atomic():
+        # Lock the rows so the rollup deltas are computed from the values being replaced
+        previous = {
+            row['id']: row for row in
+            Medicine.objects.select_for_update()
+            .filter(user=user, pk__in=deltas)
+            .order_by('pk')
+            .values('id', *ROLLUP_FIELDS)
+        }
+        errors = []
+        for medicine_id, delta in deltas.items():
+            row = previous.get(medicine_id)
+            if row is None:
+                errors.append({'id': medicine_id, 'error': 'Medicine not found.'})
+            elif row['quantity'] + delta < 0:
+                errors.append({'id': medicine_id, 'error': f"Only {row['quantity']} in stock."})
+        if errors:
+            raise StockAdjustmentError(errors)
+
+        in_stock = Q()
+        for medicine_id, delta in deltas.items():
+            in_stock |= Q(pk=medicine_id, quantity__gte=-delta) if delta < 0 else Q(pk=medicine_id)
+        updated = Medicine.objects.filter(in_stock, user=user).update(
+            quantity=F('quantity') + Case(
+                *[When(pk=medicine_id, then=Value(delta)) for medicine_id, delta in deltas.items()],
+                output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+        if updated != len(deltas):
+            # Only reachable where select_for_update does not lock (SQLite serialises writers instead)
+            raise StockAdjustmentError([{'id': None, 'error': 'Stock changed concurrently, retry the batch.'}])
+
+        changes = []
+        for medicine_id, delta in deltas.items():
+            current = dict(previous[medicine_id], quantity=previous[medicine_id]['quantity'] + delta)
+            changes.append((previous[medicine_id], current))
+        apply_rollup_changes(changes)
+        bump_inventory_version(user.pk)
+
+    return {medicine_id: previous[medicine_id]['quantity'] + delta for medicine_id, delta in deltas.items()}
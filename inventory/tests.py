@@ -1,3 +1,1687 @@
-from django.test import TestCase
+import base64
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from datetime import timedelta
+from io import StringIO
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+import openpyxl
+import xlsxwriter
+from .alerts import collect_alert_digests
+from .backends import ProfileModelBackend
+from .benchmark import get_benchmark_cases, run_benchmark, seed_inventory
+from .decorators import verified_email_required
+from .importer import MedicineImporter
+from .jobs import JOB_TIMEOUT, claim_next_job, enqueue_report_job, run_report_job
+from .logformat import JsonFormatter
+from .metrics import start_metrics_server
+from .mailqueue import CLAIM_TIMEOUT, MAX_ATTEMPTS, claim_due_emails, enqueue_email, send_queued_emails
+from .models import Medicine, InventoryRollup, UserProfile, ApiToken, ReportJob, OutboundEmail, MedicineSearchEntry, InventoryVersion
+from .pagination import InvalidCursor, KeysetPaginator, decode_cursor, encode_cursor
+from .report_cache import ReportCache
+from .reports import EXPORT_HEADERS, PDF_TABLE_CHUNK_ROWS, REPORT_CONTENT_TYPES, MedicineReportGenerator, _FlowableFeed
+from .search import PostgresMedicineSearch, SQLiteMedicineSearch, search_medicines, _backends as _search_backends
+from .stats import InventoryStatistics, rebuild_inventory_rollups
+from .versioning import get_inventory_version
 
-# Create your tests here.
+PASSWORD = 'pw-12345-xyz'
+
+
+def create_user(username, verified=True, **kwargs):
+    """User with PASSWORD, its email verified unless verified is False"""
+    user = User.objects.create_user(username, f'{username}@example.com', PASSWORD, **kwargs)
+    if verified:
+        user.userprofile.email_verified = True
+        user.userprofile.save()
+    return user
+
+
+def create_medicine(user, expires_in=200, **kwargs):
+    """Medicine expiring expires_in days from today; kwargs override the other fields"""
+    today = timezone.now().date()
+    values = dict(
+        user=user, name='Paracetamol', batch_number='B1', manufacturer='Acme',
+        manufacturing_date=today - timedelta(days=500), expiry_date=today + timedelta(days=expires_in),
+        quantity=50, price_per_unit='1.00', low_stock_threshold=10,
+    )
+    values.update(kwargs)
+    return Medicine.objects.create(**values)
+
+
+class ExplainQueriesTests(TestCase):
+    """explain_queries prints a plan for every hot query"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        create_medicine(self.user)
+
+    def test_prints_a_plan_per_hot_query(self):
+        out = StringIO()
+        call_command('explain_queries', '--user', 'alice', stdout=out)
+        output = out.getvalue()
+        self.assertIn(f'Backend: {connection.vendor}, user: alice', output)
+        sections = re.split(r'^== (.+) ==$', output, flags=re.M)[1:]
+        names = sections[::2]
+        self.assertEqual(names, [
+            'inventory summary', 'recent medicines', 'expired', 'expiring soon',
+            'expiry histogram', 'low stock', 'search',
+        ])
+        for name, plan in zip(names, sections[1::2]):
+            self.assertRegex(plan, r'\w', name)
+
+    def test_errors(self):
+        with self.assertRaisesMessage(CommandError, 'User "nobody" does not exist.'):
+            call_command('explain_queries', '--user', 'nobody', stdout=StringIO())
+        if connection.vendor != 'postgresql':
+            with self.assertRaisesMessage(CommandError, '--analyze is only supported on PostgreSQL.'):
+                call_command('explain_queries', '--analyze', stdout=StringIO())
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages walk the list newest first without OFFSET, ties broken by id"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        medicines = [create_medicine(self.user, name=f'Med {i}', batch_number=f'B{i}') for i in range(8)]
+        Medicine.objects.filter(pk__in=[medicine.pk for medicine in medicines[2:6]]).update(
+            created_at=medicines[2].created_at
+        )
+        self.medicines = Medicine.objects.filter(user=self.user)
+        self.expected = list(self.medicines.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.paginator = KeysetPaginator(self.medicines, per_page=3)
+
+    def pks(self, page):
+        return [medicine.pk for medicine in page]
+
+    def test_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+        self.assertEqual(decode_cursor(encode_cursor(0.0607927, 7)), (0.0607927, 7))
+        self.assertNotIn('=', encode_cursor(created_at, 42))
+        for cursor in ('not a cursor', encode_cursor(1.5, 3)[:-4], 'eDF8Mg'):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_forward_and_back(self):
+        pages = [self.paginator.get_page()]
+        while pages[-1].has_next:
+            pages.append(self.paginator.get_page(after=pages[-1].next_cursor))
+        self.assertEqual([pk for page in pages for pk in self.pks(page)], self.expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertFalse(pages[0].has_previous)
+        self.assertIsNone(pages[-1].next_cursor)
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.paginator.get_page(before=page.previous_cursor)
+            self.assertEqual(self.pks(page), self.pks(expected))
+        self.assertFalse(page.has_previous)
+
+    def test_page_is_one_query(self):
+        first = self.paginator.get_page()
+        with self.assertNumQueries(1):
+            self.paginator.get_page(after=first.next_cursor)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        page = self.paginator.get_page(after='garbage')
+        self.assertEqual(self.pks(page), self.expected[:3])
+        self.assertFalse(page.has_previous)
+
+    def test_medicine_list_links_pages(self):
+        self.client.login(username='alice', password=PASSWORD)
+        with mock.patch('inventory.views.MEDICINE_LIST_PAGE_SIZE', 5):
+            first = self.client.get(reverse('medicine_list'))
+            second = self.client.get(reverse('medicine_list'), {'after': first.context['page'].next_cursor})
+        self.assertEqual(self.pks(first.context['medicines']), self.expected[:5])
+        self.assertEqual(self.pks(second.context['medicines']), self.expected[5:])
+
+
+class MedicineSearchTests(TestCase):
+    """FTS5 prefix search on SQLite, substring and trigram fallbacks elsewhere"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.paracetamol = create_medicine(self.user, name='Paracetamol', batch_number='PX-100', manufacturer='Acme Labs')
+        self.ibuprofen = create_medicine(self.user, name='Ibuprofen', batch_number='IB-200', manufacturer='Zenith Pharma')
+        self.medicines = Medicine.objects.filter(user=self.user)
+
+    def pks(self, query):
+        return set(search_medicines(self.medicines, query).values_list('pk', flat=True))
+
+    def test_prefix_matches_name_batch_and_manufacturer(self):
+        self.assertEqual(self.pks('parac'), {self.paracetamol.pk})
+        self.assertEqual(self.pks('IB'), {self.ibuprofen.pk})
+        self.assertEqual(self.pks('zenith'), {self.ibuprofen.pk})
+        self.assertEqual(self.pks('acme parac'), {self.paracetamol.pk})
+        self.assertEqual(self.pks('aspirin'), set())
+        self.assertEqual(self.pks('  '), set())
+
+    def test_results_are_ranked(self):
+        results = list(search_medicines(self.medicines, 'parac'))
+        self.assertGreater(results[0].search_rank, 0)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.paracetamol.name = 'Amoxicillin'
+        self.paracetamol.save()
+        self.assertEqual(self.pks('parac'), set())
+        self.assertEqual(self.pks('amox'), {self.paracetamol.pk})
+
+        self.paracetamol.delete()
+        self.assertEqual(self.pks('amox'), set())
+        self.assertEqual(MedicineSearchEntry.objects.count(), 1)
+
+    def test_match_expression_quotes_tokens(self):
+        self.assertEqual(SQLiteMedicineSearch().build_match_expression('para "B1 OR'), '"para"* "B1"* "OR"*')
+
+    def test_substring_fallback(self):
+        with mock.patch('inventory.search.connection') as connection_mock, mock.patch.dict(_search_backends, clear=True):
+            connection_mock.vendor = 'mysql'
+            self.assertEqual(self.pks('cetam'), {self.paracetamol.pk})
+            self.assertEqual(self.pks('px-1'), {self.paracetamol.pk})
+            self.assertEqual(self.pks('100'), set())
+
+    def test_postgres_ranks_by_trigram_similarity(self):
+        sql = str(PostgresMedicineSearch().search(self.medicines, 'parac').query).upper()
+        self.assertEqual(sql.count('SIMILARITY('), 2)
+        self.assertIn('CASE WHEN', sql)
+        self.assertIn('LIKE', sql)
+
+
+class ExcelReportTests(TestCase):
+    """The Excel report is written in one streaming pass with constant_memory"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        create_medicine(self.user, name='Expired', expires_in=-5)
+        create_medicine(self.user, name='Soon', expires_in=10)
+        create_medicine(self.user, name='Low', quantity=2)
+        create_medicine(self.user, name='Good', description='Shelf 3')
+
+    def read_report(self, report_type):
+        output = io.BytesIO()
+        generator = MedicineReportGenerator(self.user)
+        with mock.patch('inventory.reports.xlsxwriter.Workbook', wraps=xlsxwriter.Workbook) as workbook:
+            with self.assertNumQueries(1):
+                generator.write_excel_report(report_type, output)
+        self.assertEqual(workbook.call_args.args[1], {'constant_memory': True})
+        output.seek(0)
+        return list(openpyxl.load_workbook(output).active.iter_rows(values_only=True))
+
+    def test_rows_and_status_columns(self):
+        header, *rows = self.read_report('all')
+        self.assertEqual(list(header), EXPORT_HEADERS)
+        statuses = {row[0]: (row[9], row[10]) for row in rows}
+        self.assertEqual(statuses, {
+            'Expired': ('Expired', -5),
+            'Soon': ('Expiring Soon', 10),
+            'Low': ('Low Stock', 200),
+            'Good': ('Good', 200),
+        })
+        good = next(row for row in rows if row[0] == 'Good')
+        self.assertEqual(good[4].date(), timezone.now().date() + timedelta(days=200))
+        self.assertEqual((good[5], good[6], good[8]), (50, 1, 'Shelf 3'))
+
+    def test_report_type_filters_rows(self):
+        header, *rows = self.read_report('expired')
+        self.assertEqual([row[0] for row in rows], ['Expired'])
+
+
+class ReportJobTests(TestCase):
+    """Claiming, running and recovering background report jobs"""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        override = override_settings(REPORT_CACHE_DIR=self.tempdir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = create_user('alice')
+        create_medicine(self.user)
+
+    def test_jobs_are_claimed_oldest_first_and_once(self):
+        first = enqueue_report_job(self.user, 'all', 'csv')
+        second = enqueue_report_job(self.user, 'all', 'pdf')
+        self.assertEqual(claim_next_job().pk, first.pk)
+        job = claim_next_job()
+        self.assertEqual((job.pk, job.status, job.attempts), (second.pk, ReportJob.STATUS_RUNNING, 1))
+        self.assertIsNone(claim_next_job())
+
+    def test_run_stores_the_report_in_the_database(self):
+        enqueue_report_job(self.user, 'all', 'csv')
+        job = run_report_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.STATUS_COMPLETED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIn(b'Paracetamol', bytes(job.content))
+
+        self.client.login(username='alice', password=PASSWORD)
+        response = self.client.get(reverse('download_report_job', args=[job.pk]))
+        self.assertIn(b'Paracetamol', b''.join(response.streaming_content))
+
+    def test_result_of_a_recovered_job_is_discarded(self):
+        job = enqueue_report_job(self.user, 'all', 'csv')
+        claimed = claim_next_job()
+        # The job outlived JOB_TIMEOUT and another worker claimed it again
+        ReportJob.objects.filter(pk=job.pk).update(attempts=2)
+        with self.assertLogs('inventory.jobs', 'WARNING'):
+            finished = run_report_job(claimed)
+        self.assertEqual(finished.status, ReportJob.STATUS_RUNNING)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.content, job.finished_at), (ReportJob.STATUS_RUNNING, None, None))
+
+    def test_failure_is_recorded(self):
+        enqueue_report_job(self.user, 'all', 'csv')
+        with mock.patch('inventory.jobs.report_cache.open_report', side_effect=RuntimeError('disk full')), \
+                self.assertLogs('inventory.jobs', 'ERROR'):
+            job = run_report_job(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.STATUS_FAILED)
+        self.assertIn('disk full', job.error)
+
+    def test_stale_job_is_retried_once_then_failed(self):
+        job = enqueue_report_job(self.user, 'all', 'csv')
+        claim_next_job()
+        self.assertIsNone(claim_next_job())
+
+        long_ago = timezone.now() - JOB_TIMEOUT - timedelta(minutes=1)
+        ReportJob.objects.filter(pk=job.pk).update(started_at=long_ago)
+        with self.assertLogs('inventory.jobs', 'WARNING'):
+            retried = claim_next_job()
+        self.assertEqual((retried.pk, retried.attempts), (job.pk, 2))
+
+        ReportJob.objects.filter(pk=job.pk).update(started_at=long_ago)
+        with self.assertLogs('inventory.jobs', 'WARNING'):
+            self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.STATUS_FAILED)
+
+    def test_views_require_verified_email(self):
+        enqueue_report_job(self.user, 'all', 'csv')
+        job = run_report_job(claim_next_job())
+        create_user('bob', verified=False)
+        self.client.login(username='bob', password=PASSWORD)
+        for method, url in (
+            ('post', reverse('create_report_job')),
+            ('get', reverse('report_job_status', args=[job.pk])),
+            ('get', reverse('download_report_job', args=[job.pk])),
+        ):
+            response = getattr(self.client, method)(url, {'report_type': 'all', 'format_type': 'csv'})
+            self.assertRedirects(response, reverse('resend_verification'), fetch_redirect_response=False)
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+    def test_worker_command(self):
+        enqueue_report_job(self.user, 'all', 'jsonl')
+        out = StringIO()
+        call_command('run_report_jobs', '--once', stdout=out)
+        self.assertIn('Processed 1 report job(s).', out.getvalue())
+        self.assertEqual(ReportJob.objects.get().status, ReportJob.STATUS_COMPLETED)
+
+
+class ReportCacheTests(TestCase):
+    """Generated reports are reused until the inventory changes, bounded by size"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.medicine = create_medicine(self.user)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.cache = ReportCache(directory=self.directory)
+
+    def open_report(self, report_type='all', format_type='csv'):
+        with self.cache.open_report(self.user, report_type, format_type) as report_file:
+            return report_file.read()
+
+    def test_hit_skips_generation(self):
+        first = self.open_report()
+        with mock.patch.object(MedicineReportGenerator, 'write_report') as write_report:
+            self.assertEqual(self.open_report(), first)
+        write_report.assert_not_called()
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_inventory_change_invalidates(self):
+        self.open_report()
+        self.medicine.name = 'Ibuprofen'
+        self.medicine.save()
+        # A new request loads the bumped version with the user
+        self.user = User.objects.get(pk=self.user.pk)
+        self.assertIn(b'Ibuprofen', self.open_report())
+        # The old version can never be hit again and is dropped right away
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_late_writer_keeps_the_newer_version(self):
+        def key(version):
+            return self.cache.get_key(self.user, 'all', 'csv', version=version)
+
+        self.cache.put(key(5), lambda output: output.write(b'v5')).close()
+        # A request that computed its key before the version bump finishes last
+        self.cache.put(key(4), lambda output: output.write(b'v4')).close()
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([key(4), key(5)]))
+
+        self.cache.put(key(6), lambda output: output.write(b'v6')).close()
+        self.assertEqual(os.listdir(self.directory), [key(6)])
+
+    def test_key_uses_the_current_date(self):
+        key = self.cache.get_key(self.user, 'all', 'csv', version=3)
+        self.assertTrue(key.endswith(f'-v3-{timezone.now().date().isoformat()}.csv'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for name, age in (('old.csv', 300), ('used.csv', 200)):
+            with open(os.path.join(self.directory, name), 'wb') as entry:
+                entry.write(b'x' * 100)
+            mtime = time.time() - age
+            os.utime(os.path.join(self.directory, name), (mtime, mtime))
+        self.cache.get('used.csv').close()
+
+        self.cache = ReportCache(directory=self.directory, max_bytes=250)
+        self.cache.put('new.csv', lambda output: output.write(b'y' * 100)).close()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['new.csv', 'used.csv'])
+
+
+class StreamingReportTests(TestCase):
+    """CSV and JSON Lines reports stream row by row from the database"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.medicine = create_medicine(self.user, name='Para, "extra"', expires_in=10, description='Shelf 3')
+        create_medicine(self.user, name='Ibuprofen', batch_number='B2', expires_in=-3)
+        self.client.login(username='alice', password=PASSWORD)
+
+    def download(self, report_type, format_type):
+        response = self.client.get(reverse('download_report', args=[report_type, format_type]))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], REPORT_CONTENT_TYPES[format_type])
+        self.assertIn(f'medicine_report_{report_type}_', response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.download('all', 'csv'))))
+        self.assertEqual(rows[0], EXPORT_HEADERS)
+        today = timezone.now().date()
+        self.assertIn([
+            'Para, "extra"', 'B1', 'Acme', (today - timedelta(days=500)).isoformat(),
+            (today + timedelta(days=10)).isoformat(), '50', '1.00', '10', 'Shelf 3', 'Expiring Soon', '10',
+        ], rows)
+        self.assertEqual(len(rows), 3)
+
+    def test_jsonl(self):
+        records = [json.loads(line) for line in self.download('expired', 'jsonl').splitlines()]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0], {
+            'name': 'Ibuprofen', 'batch_number': 'B2', 'manufacturer': 'Acme',
+            'manufacturing_date': (timezone.now().date() - timedelta(days=500)).isoformat(),
+            'expiry_date': (timezone.now().date() - timedelta(days=3)).isoformat(),
+            'quantity': 50, 'price_per_unit': '1.00', 'low_stock_threshold': 10, 'description': '',
+            'status': 'Expired', 'days_until_expiry': -3,
+        })
+
+    def test_chunks_are_read_lazily(self):
+        generator = MedicineReportGenerator(self.user)
+        with self.assertNumQueries(0):
+            chunks = generator.iter_report_chunks('all', 'csv')
+            self.assertEqual(next(chunks).decode('utf-8').strip(), ','.join(EXPORT_HEADERS))
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(chunks)), 2)
+
+
+class MedicineImporterTests(TestCase):
+    """CSV and XLSX imports validate every row and insert in batches"""
+
+    header = 'Medicine Name,Batch,Manufacturer,Manufacturing Date,Expiry,Quantity,Price,Low Stock Threshold\n'
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.today = timezone.now().date()
+
+    def csv_row(self, index, quantity=10):
+        return (
+            f'Imported {index},IMP{index},Acme,{self.today - timedelta(days=30)},'
+            f'{self.today + timedelta(days=200)},{quantity},2.00,5\n'
+        )
+
+    def import_csv(self, text, batch_size=500):
+        data = text if isinstance(text, bytes) else text.encode()
+        return MedicineImporter(self.user, batch_size=batch_size).import_file(io.BytesIO(data), 'medicines.csv')
+
+    def test_export_headers_are_mapped_and_rows_inserted_in_batches(self):
+        rows = ''.join(self.csv_row(index) for index in range(5))
+        with CaptureQueriesContext(connection) as ctx:
+            result = self.import_csv(self.header + rows, batch_size=2)
+        self.assertEqual((result.rows, result.created, result.failed), (5, 5, 0))
+        inserts = [query for query in ctx.captured_queries if query['sql'].startswith('INSERT INTO "inventory_medicine"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(InventoryStatistics(self.user).get_summary()['total_medicines'], 5)
+        self.assertTrue(search_medicines(Medicine.objects.filter(user=self.user), 'imported').exists())
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        result = self.import_csv(self.header + self.csv_row(1) + self.csv_row(2, quantity=0) + 'x,y\n')
+        self.assertEqual((result.rows, result.created), (3, 1))
+        self.assertEqual([row for row, _ in result.errors], [3, 4])
+        self.assertIn('quantity: Quantity must be greater than 0.', result.errors[0][1])
+
+    def test_missing_columns(self):
+        with self.assertRaisesMessage(ValueError, 'Missing required columns: quantity'):
+            self.import_csv('name,batch_number,manufacturer,manufacturing_date,expiry_date,price_per_unit,'
+                            'low_stock_threshold\n')
+
+    def test_unreadable_csv_is_a_value_error(self):
+        with self.assertRaises(ValueError):
+            self.import_csv(b'\xff\xfe\x00garbage')
+
+    def test_unreadable_rest_of_file_keeps_rows_read_so_far(self):
+        result = self.import_csv(self.header + self.csv_row(1) + 'x' * 200000 + '\n' + self.csv_row(2))
+        self.assertEqual(result.created, 1)
+        self.assertEqual(result.errors[0][0], 3)
+        self.assertIn('The rest of the file was skipped.', result.errors[0][1])
+        self.assertEqual(InventoryStatistics(self.user).get_summary()['total_medicines'], 1)
+
+    def test_xlsx(self):
+        output = io.BytesIO()
+        workbook = xlsxwriter.Workbook(output)
+        sheet = workbook.add_worksheet()
+        for row, line in enumerate([self.header, self.csv_row(1)]):
+            sheet.write_row(row, 0, line.strip().split(','))
+        workbook.close()
+        output.seek(0)
+        result = MedicineImporter(self.user).import_file(output, 'medicines.xlsx')
+        self.assertEqual((result.created, result.failed), (1, 0))
+
+    def test_corrupt_upload_is_a_form_error(self):
+        self.client.login(username='alice', password=PASSWORD)
+        upload = SimpleUploadedFile('medicines.xlsx', b'not a zip file')
+        response = self.client.post(reverse('import_medicines'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertFormError(response.context['form'], 'file', 'The file is not a valid .xlsx workbook.')
+
+
+class FlakyConnection:
+    """Email backend stand-in that fails for the given recipients"""
+
+    def __init__(self, failing=(), fail_open=False):
+        self.failing = set(failing)
+        self.fail_open = fail_open
+        self.sent = []
+
+    def open(self):
+        if self.fail_open:
+            raise ConnectionRefusedError('mail server down')
+
+    def close(self):
+        pass
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.failing & set(message.to):
+                raise OSError('rejected')
+            self.sent.append(message)
+        return len(messages)
+
+
+class MailQueueTests(TestCase):
+    """Claiming, retrying and giving up on queued emails"""
+
+    def test_claim_is_exclusive(self):
+        emails = [enqueue_email('Hi', 'Body', [f'user{i}@example.com']) for i in range(3)]
+        claimed = claim_due_emails(2)
+        self.assertEqual([email.pk for email in claimed], [emails[0].pk, emails[1].pk])
+        self.assertTrue(all(email.status == OutboundEmail.STATUS_SENDING for email in claimed))
+        self.assertEqual([email.pk for email in claim_due_emails(5)], [emails[2].pk])
+        self.assertEqual(claim_due_emails(5), [])
+
+    def test_rows_taken_by_another_worker_are_not_returned(self):
+        first, second = enqueue_email('Hi', 'Body', ['a@example.com']), enqueue_email('Hi', 'Body', ['b@example.com'])
+        # Another worker claims the second email between our select and update
+        OutboundEmail.objects.filter(pk=second.pk).update(
+            status=OutboundEmail.STATUS_SENDING, claim_token='other', claimed_at=timezone.now()
+        )
+        with mock.patch('inventory.mailqueue.get_claimable_ids', return_value=[first.pk, second.pk]):
+            claimed = claim_due_emails(2)
+        self.assertEqual([email.pk for email in claimed], [first.pk])
+        self.assertEqual(OutboundEmail.objects.get(pk=second.pk).claim_token, 'other')
+
+    def test_stale_claim_is_retried(self):
+        email = enqueue_email('Hi', 'Body', ['a@example.com'])
+        self.assertEqual(len(claim_due_emails(1)), 1)
+        self.assertEqual(claim_due_emails(1), [])
+        OutboundEmail.objects.filter(pk=email.pk).update(
+            claimed_at=timezone.now() - CLAIM_TIMEOUT - timedelta(seconds=1)
+        )
+        self.assertEqual([claimed.pk for claimed in claim_due_emails(1)], [email.pk])
+
+    def test_failures_back_off_then_give_up(self):
+        good = enqueue_email('Hi', 'Body', ['good@example.com'])
+        bad = enqueue_email('Hi', 'Body', ['bad@example.com'])
+        connection = FlakyConnection(failing=['bad@example.com'])
+        with self.assertLogs('inventory.mailqueue', 'WARNING'):
+            self.assertEqual(send_queued_emails(connection=connection), (1, 1))
+        self.assertEqual([message.to for message in connection.sent], [['good@example.com']])
+
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual((good.status, good.attempts), (OutboundEmail.STATUS_SENT, 1))
+        self.assertEqual((bad.status, bad.attempts, bad.last_error), (OutboundEmail.STATUS_PENDING, 1, 'rejected'))
+        self.assertGreater(bad.next_attempt_at, timezone.now())
+        # Not due until the backoff has passed
+        self.assertEqual(send_queued_emails(connection=connection), (0, 0))
+
+        for attempt in range(2, MAX_ATTEMPTS + 1):
+            OutboundEmail.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+            with self.assertLogs('inventory.mailqueue', 'WARNING'):
+                self.assertEqual(send_queued_emails(connection=connection), (0, 1))
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), (OutboundEmail.STATUS_FAILED, MAX_ATTEMPTS))
+
+    def test_unreachable_server_retries_whole_batch(self):
+        emails = [enqueue_email('Hi', 'Body', [f'user{i}@example.com']) for i in range(2)]
+        with self.assertLogs('inventory.mailqueue', 'WARNING'):
+            self.assertEqual(send_queued_emails(connection=FlakyConnection(fail_open=True)), (0, 2))
+        for email in emails:
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutboundEmail.STATUS_PENDING, 1))
+
+
+class VerifiedEmailRequiredTests(TestCase):
+    """Views behind verified_email_required, and the backend that makes the check free"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.unverified = create_user('bob', verified=False)
+
+    def test_anonymous_goes_to_login(self):
+        response = self.client.get(reverse('medicine_list'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('medicine_list')}")
+
+    def test_unverified_goes_to_resend_verification(self):
+        self.client.login(username='bob', password=PASSWORD)
+        response = self.client.get(reverse('medicine_list'))
+        self.assertRedirects(response, reverse('resend_verification'))
+
+    def test_verified_reaches_the_view(self):
+        self.client.login(username='alice', password=PASSWORD)
+        self.assertEqual(self.client.get(reverse('medicine_list')).status_code, 200)
+
+    def test_backend_preloads_profile_and_inventory_version(self):
+        create_medicine(self.user)
+        version = InventoryVersion.objects.get(user=self.user).version
+        with self.assertNumQueries(1):
+            user = ProfileModelBackend().get_user(self.user.pk)
+            self.assertTrue(user.userprofile.email_verified)
+            self.assertEqual(get_inventory_version(user), version)
+
+        with self.assertNumQueries(1):
+            user = ProfileModelBackend().get_user(self.unverified.pk)
+            self.assertEqual(get_inventory_version(user), 0)
+
+    def test_check_costs_no_queries(self):
+        request = RequestFactory().get('/')
+        request.user = ProfileModelBackend().get_user(self.user.pk)
+        view = verified_email_required(lambda request: HttpResponse('ok'))
+        with self.assertNumQueries(0):
+            self.assertEqual(view(request).content, b'ok')
+
+
+class UserProfileWriteTests(TestCase):
+    """Saving a user must not rewrite its profile unless the profile changed"""
+
+    def setUp(self):
+        self.user = create_user('alice', verified=False)
+
+    def profile_writes(self, queries):
+        return [
+            query['sql'] for query in queries
+            if query['sql'].startswith(('UPDATE', 'INSERT')) and UserProfile._meta.db_table in query['sql']
+        ]
+
+    def test_create_user_writes_profile_once(self):
+        with CaptureQueriesContext(connection) as ctx:
+            create_user('bob', verified=False)
+        self.assertEqual(len(self.profile_writes(ctx.captured_queries)), 1)
+
+    def test_unchanged_profile_is_not_saved(self):
+        user = User.objects.select_related('userprofile').get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            user.userprofile.save()
+
+    def test_changed_profile_updates_only_dirty_fields(self):
+        profile = UserProfile.objects.get(user=self.user)
+        profile.otp_attempts = 2
+        self.assertEqual(profile.get_dirty_fields(), ['otp_attempts'])
+        with CaptureQueriesContext(connection) as ctx:
+            profile.save()
+        writes = self.profile_writes(ctx.captured_queries)
+        self.assertEqual(len(writes), 1)
+        self.assertIn('otp_attempts', writes[0])
+        self.assertNotIn('email_verification_token', writes[0])
+        self.assertEqual(profile.get_dirty_fields(), [])
+
+    def test_login_does_not_touch_profile(self):
+        self.user.userprofile.email_verified = True
+        self.user.userprofile.save()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('login'), {'username': 'alice', 'password': PASSWORD})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.profile_writes(ctx.captured_queries), [])
+        self.assertFalse(any(
+            UserProfile._meta.db_table in query['sql'] for query in ctx.captured_queries
+        ))
+
+    def test_verify_otp_writes_profile_once(self):
+        self.user.is_active = False
+        self.user.save()
+        profile = self.user.userprofile
+        profile.otp_code = '123456'
+        profile.otp_created_at = timezone.now()
+        profile.save()
+
+        url = reverse('verify_otp', kwargs={'user_id': self.user.pk})
+        # user + profile fetch, profile update, user update
+        with self.assertNumQueries(3) as ctx:
+            response = self.client.post(url, {'otp_code': '123456'})
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        self.assertEqual(len(self.profile_writes(ctx.captured_queries)), 1)
+        profile.refresh_from_db()
+        self.assertTrue(profile.email_verified)
+        self.assertIsNone(profile.otp_code)
+
+    def test_verify_email_writes_profile_once(self):
+        self.user.is_active = False
+        self.user.save()
+        profile = self.user.userprofile
+        profile.email_verification_sent_at = timezone.now() - timedelta(minutes=5)
+        profile.save()
+
+        url = reverse('verify_email', kwargs={'token': profile.email_verification_token})
+        # profile + user fetch, profile update, user update
+        with self.assertNumQueries(3) as ctx:
+            response = self.client.get(url)
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        self.assertEqual(len(self.profile_writes(ctx.captured_queries)), 1)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+
+
+class InventoryRollupTests(TestCase):
+    """The incrementally maintained rollup must match a full recomputation"""
+
+    def setUp(self):
+        self.user = create_user('alice', verified=False)
+        self.today = timezone.now().date()
+
+    def add_medicine(self, **kwargs):
+        return create_medicine(self.user, **{'price_per_unit': '2.50', **kwargs})
+
+    def assertRollupMatchesMedicines(self):
+        statistics = InventoryStatistics(self.user)
+        expected = statistics.medicines.aggregate(**statistics.get_aggregates())
+        self.assertEqual(statistics.get_summary(), expected)
+
+    def test_summary_tracks_changes(self):
+        self.assertEqual(InventoryStatistics(self.user).get_summary()['total_medicines'], 0)
+
+        medicine = self.add_medicine()
+        expired = self.add_medicine(expiry_date=self.today - timedelta(days=1), quantity=3)
+        self.assertRollupMatchesMedicines()
+
+        medicine.quantity = 5
+        medicine.expiry_date = self.today + timedelta(days=10)
+        medicine.save()
+        self.assertRollupMatchesMedicines()
+
+        expired.delete()
+        self.assertRollupMatchesMedicines()
+        self.assertEqual(InventoryRollup.objects.get(user=self.user).total_medicines, 1)
+
+    def test_fresh_summary_is_single_query(self):
+        self.add_medicine()
+        InventoryStatistics(self.user).get_summary()
+        with self.assertNumQueries(1):
+            InventoryStatistics(self.user).get_summary()
+
+    def test_stale_rollup_is_reclassified(self):
+        self.add_medicine(expiry_date=self.today + timedelta(days=40))
+        InventoryStatistics(self.user).get_summary()
+        # Pretend the rollup was built long ago, before the medicine neared expiry
+        InventoryRollup.objects.filter(user=self.user).update(as_of=self.today - timedelta(days=30))
+        self.add_medicine()
+        self.assertRollupMatchesMedicines()
+
+        call_command('reclassify_inventory', stdout=StringIO())
+        self.assertEqual(InventoryRollup.objects.get(user=self.user).as_of, self.today)
+
+    def test_assigned_values_are_cleaned_before_the_delta(self):
+        InventoryStatistics(self.user).get_summary()
+        medicine = Medicine.objects.create(
+            user=self.user, name='Paracetamol', batch_number='B1', manufacturer='Acme',
+            manufacturing_date='2020-01-01', expiry_date=(self.today - timedelta(days=1)).isoformat(),
+            quantity='4', price_per_unit=2.5,
+        )
+        self.assertRollupMatchesMedicines()
+
+        medicine.quantity = '12'
+        medicine.expiry_date = (self.today + timedelta(days=5)).isoformat()
+        medicine.save()
+        self.assertRollupMatchesMedicines()
+
+        medicine.delete()
+        self.assertRollupMatchesMedicines()
+
+    def test_owner_is_locked_before_the_rollup_is_read(self):
+        medicine = self.add_medicine()
+        InventoryStatistics(self.user).get_summary()
+        medicine.quantity = 7
+        with CaptureQueriesContext(connection) as save_queries:
+            medicine.save()
+        with CaptureQueriesContext(connection) as rebuild_queries:
+            rebuild_inventory_rollups([self.user.pk])
+
+        for queries, guarded in ((save_queries, 'inventory_inventoryrollup'), (rebuild_queries, 'inventory_medicine"')):
+            sql = [query['sql'] for query in queries]
+            lock = next(index for index, query in enumerate(sql) if query.startswith('SELECT "auth_user"."id"'))
+            first_read = next(index for index, query in enumerate(sql) if guarded in query)
+            self.assertLess(lock, first_read)
+
+
+class InventoryRollupTransactionTests(TransactionTestCase):
+    """A medicine write and its rollup delta commit or roll back together"""
+
+    def test_failed_rollup_update_rolls_back_the_save(self):
+        user = create_user('alice', verified=False)
+        medicine = create_medicine(user)
+        medicine.quantity = 7
+        with mock.patch('inventory.signals.apply_rollup_change', side_effect=RuntimeError('rollup')):
+            with self.assertRaises(RuntimeError):
+                medicine.save()
+        self.assertEqual(Medicine.objects.get(pk=medicine.pk).quantity, 50)
+
+
+class MedicineStatusAnnotationTests(TestCase):
+    """with_status() must agree with the Python properties on every boundary"""
+
+    def test_annotations_match_properties(self):
+        user = create_user('alice', verified=False)
+        today = timezone.now().date()
+        for offset in (-400, -1, 0, 1, 29, 30, 31, 365):
+            for quantity in (5, 10, 11):
+                create_medicine(user, offset, name=f'Med {offset} {quantity}', quantity=quantity)
+
+        for medicine in Medicine.objects.filter(user=user).with_status(today):
+            self.assertEqual(medicine.days_to_expiry, medicine.days_until_expiry)
+            self.assertEqual(medicine.days_since_expiry, -medicine.days_until_expiry)
+            self.assertEqual(medicine.low_on_stock, medicine.is_low_stock)
+            if medicine.is_expired:
+                expected_status = 'expired'
+            elif medicine.is_expiring_within(30):
+                expected_status = 'expiring-soon'
+            else:
+                expected_status = 'good'
+            self.assertEqual(medicine.expiry_status, expected_status, medicine.name)
+            self.assertEqual(medicine.is_expiring_soon, expected_status == 'expiring-soon')
+
+    def test_is_expiring_soon_uses_the_owner_horizon(self):
+        user = create_user('bob')
+        user.userprofile.expiry_horizon_days = 7
+        user.userprofile.save()
+        create_medicine(user, 20)
+        medicine = Medicine.objects.with_status(horizon=7).get()
+        with self.assertNumQueries(0):
+            self.assertFalse(medicine.is_expiring_soon)
+        medicine = Medicine.objects.select_related('user__userprofile').get()
+        with self.assertNumQueries(0):
+            self.assertFalse(medicine.is_expiring_soon)
+
+        UserProfile.objects.filter(user=user).update(expiry_horizon_days=30)
+        self.assertTrue(Medicine.objects.get().is_expiring_soon)
+
+
+class MedicineQuerySetTests(TestCase):
+    """Status filters and the medicine list filter built on them"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.today = timezone.now().date()
+        for name, offset, quantity in (
+            ('Expired', -1, 50), ('Due Today', 0, 50), ('Expiring', 30, 50),
+            ('Later', 31, 50), ('Low', 200, 5),
+        ):
+            create_medicine(self.user, offset, name=name, quantity=quantity)
+        self.medicines = Medicine.objects.filter(user=self.user)
+
+    def names(self, queryset):
+        return sorted(queryset.values_list('name', flat=True))
+
+    def test_filters(self):
+        self.assertEqual(self.names(self.medicines.expired(self.today)), ['Expired'])
+        self.assertEqual(self.names(self.medicines.expiring_within(30, self.today)), ['Due Today', 'Expiring'])
+        self.assertEqual(self.names(self.medicines.low_stock()), ['Low'])
+        self.assertEqual(self.names(self.medicines.active(self.today)), ['Due Today', 'Expiring', 'Later'])
+
+    def test_summary_buckets_match_filters(self):
+        summary = InventoryStatistics(self.user).get_summary()
+        self.assertEqual(summary['expired_medicines'], self.medicines.expired().count())
+        self.assertEqual(summary['expiring_soon'], self.medicines.expiring_within().count())
+        self.assertEqual(summary['low_stock'], self.medicines.low_stock().count())
+
+    def test_medicine_list_expiring_soon_filter(self):
+        self.client.login(username='alice', password=PASSWORD)
+        response = self.client.get(reverse('medicine_list'), {'filter': 'expiring_soon'})
+        self.assertEqual(
+            sorted(medicine.name for medicine in response.context['medicines']),
+            ['Due Today', 'Expiring']
+        )
+
+
+class ExpiryHorizonTests(TestCase):
+    """Per-user expiring soon window and the expiry histogram"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.today = timezone.now().date()
+        for offset, quantity in ((-3, 1), (0, 1), (7, 2), (8, 3), (30, 4), (31, 5), (90, 6), (91, 7), (400, 8)):
+            create_medicine(
+                self.user, offset, name=f'Med {offset}', quantity=quantity, price_per_unit='10.00', low_stock_threshold=0
+            )
+
+    def test_histogram_buckets(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(2):
+            # Profile lookup for the horizon and one grouped aggregate
+            histogram = InventoryStatistics(user).compute_expiry_histogram(self.today)
+        self.assertEqual(
+            [(bucket['label'], bucket['medicines'], bucket['stock_value']) for bucket in histogram],
+            [('0-7 days', 2, 30), ('8-30 days', 2, 70), ('31-90 days', 2, 110), ('90+ days', 2, 150)]
+        )
+
+    def test_histogram_is_cached_until_inventory_changes(self):
+        statistics = InventoryStatistics(self.user)
+        statistics.get_expiry_histogram(self.today)
+        with self.assertNumQueries(0):
+            # The inventory version is already loaded with the user
+            statistics.get_expiry_histogram(self.today)
+
+        Medicine.objects.filter(name='Med 0').first().delete()
+        self.user.inventory_version.refresh_from_db()
+        self.assertEqual(InventoryStatistics(self.user).get_expiry_histogram(self.today)[0]['medicines'], 1)
+
+    def test_horizon_changes_expiring_soon(self):
+        self.assertEqual(InventoryStatistics(self.user).get_summary()['expiring_soon'], 4)
+
+        self.client.login(username='alice', password=PASSWORD)
+        response = self.client.post(reverse('update_expiry_horizon'), {'expiry_horizon_days': 7})
+        self.assertRedirects(response, reverse('reports'), fetch_redirect_response=False)
+
+        user = User.objects.get(pk=self.user.pk)
+        statistics = InventoryStatistics(user)
+        self.assertEqual(statistics.get_summary()['expiring_soon'], 2)
+        self.assertEqual(statistics.medicines.expiring_within(statistics.horizon).count(), 2)
+
+        # Incremental updates honour the stored horizon
+        create_medicine(user, 5, name='Soon', batch_number='B2', quantity=1, low_stock_threshold=0)
+        create_medicine(user, 20, name='Later', batch_number='B3', quantity=1, low_stock_threshold=0)
+        expected = statistics.medicines.aggregate(**statistics.get_aggregates())
+        self.assertEqual(statistics.get_summary(), expected)
+        self.assertEqual(expected['expiring_soon'], 3)
+
+    def test_invalid_horizon_is_rejected(self):
+        self.client.login(username='alice', password=PASSWORD)
+        self.client.post(reverse('update_expiry_horizon'), {'expiry_horizon_days': 0})
+        self.assertEqual(UserProfile.objects.get(user=self.user).expiry_horizon_days, 30)
+
+    def test_pages_show_histogram(self):
+        self.client.login(username='alice', password=PASSWORD)
+        for name in ('dashboard', 'reports'):
+            response = self.client.get(reverse(name))
+            self.assertContains(response, 'Stock Value by Time to Expiry')
+            self.assertEqual(len(response.context['expiry_histogram']), 4)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', BASE_URL='https://pharmatrack.test')
+class AlertDigestTests(TestCase):
+    """Digest emails list each alert once and re-alert after the condition clears"""
+
+    def setUp(self):
+        self.today = timezone.now().date()
+        self.users = []
+        for name in ('alice', 'bob'):
+            user = create_user(name)
+            self.users.append(user)
+            self.add_medicine(user, 'Expired', -2, 50)
+            self.add_medicine(user, 'Expiring', 10, 50)
+            self.add_medicine(user, 'Low', 200, 1)
+            self.add_medicine(user, 'Fine', 200, 50)
+        unverified = create_user('carol', verified=False)
+        self.add_medicine(unverified, 'Expired', -2, 50)
+
+    def add_medicine(self, user, name, offset, quantity):
+        return create_medicine(user, offset, name=name, quantity=quantity, low_stock_threshold=5)
+
+    def send_digests(self):
+        mail.outbox = []
+        call_command('send_alert_digests', stdout=StringIO())
+        return {message.to[0]: message for message in mail.outbox}
+
+    def test_digest_scans_all_users_in_one_query(self):
+        with self.assertNumQueries(1):
+            digests = collect_alert_digests(self.today)
+        self.assertEqual(sorted(digest.user.username for digest in digests), ['alice', 'bob'])
+        self.assertEqual(
+            {kind: [medicine.name for medicine in medicines] for kind, medicines in digests[0].alerts.items()},
+            {'expired': ['Expired'], 'expiring_soon': ['Expiring'], 'low_stock': ['Low']}
+        )
+
+    def test_alerts_fire_once(self):
+        messages = self.send_digests()
+        self.assertEqual(sorted(messages), ['alice@example.com', 'bob@example.com'])
+        self.assertIn('Expiring', messages['alice@example.com'].body)
+        self.assertIn('https://pharmatrack.test/alerts/', messages['alice@example.com'].body)
+        self.assertEqual(self.send_digests(), {})
+
+    def test_cleared_alert_fires_again(self):
+        self.send_digests()
+        low = Medicine.objects.get(user=self.users[0], name='Low')
+        low.quantity = 50
+        low.save()
+        self.assertEqual(self.send_digests(), {})
+
+        low.quantity = 2
+        low.save()
+        messages = self.send_digests()
+        self.assertEqual(list(messages), ['alice@example.com'])
+        self.assertIn('Low stock (1)', messages['alice@example.com'].body)
+        self.assertNotIn('Expired (', messages['alice@example.com'].body)
+
+
+class AlertFragmentCacheTests(TestCase):
+    """Alert fragments are served from the cache until the inventory or date changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.today = timezone.now().date()
+        create_medicine(self.user, -1, name='Old Stock', low_stock_threshold=5)
+        self.client.login(username='alice', password=PASSWORD)
+
+    def medicine_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [
+            query['sql'] for query in ctx.captured_queries
+            if 'FROM "inventory_medicine"' in query['sql']
+        ]
+
+    def test_alerts_page_repeat_visit_skips_medicine_queries(self):
+        response, queries = self.medicine_queries(reverse('alerts'))
+        self.assertTrue(queries)
+        self.assertContains(response, 'Old Stock')
+
+        response, queries = self.medicine_queries(reverse('alerts'))
+        self.assertEqual(queries, [])
+        self.assertContains(response, 'Old Stock')
+
+    def test_medicine_change_invalidates_fragments(self):
+        self.medicine_queries(reverse('alerts'))
+        self.medicine_queries(reverse('dashboard'))
+        Medicine.objects.filter(name='Old Stock').get().delete()
+
+        for name in ('alerts', 'dashboard'):
+            response, queries = self.medicine_queries(reverse(name))
+            self.assertTrue(queries)
+            self.assertNotContains(response, 'Old Stock')
+
+
+class MedicineApiTests(TestCase):
+    """JSON API with token auth, field selection and conditional requests"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.today = timezone.now().date()
+        self.medicines = [
+            create_medicine(
+                self.user, 10 * i, name=f'Medicine {i}', batch_number=f'B{i}',
+                quantity=10 * i, price_per_unit='2.50', low_stock_threshold=15,
+            )
+            for i in range(1, 6)
+        ]
+        _, key = ApiToken.create_token(self.user, 'scanner')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+
+    def payload(self, **overrides):
+        return json.dumps({
+            'name': 'Aspirin', 'batch_number': 'NEW1', 'manufacturer': 'Acme',
+            'manufacturing_date': (self.today - timedelta(days=10)).isoformat(),
+            'expiry_date': (self.today + timedelta(days=200)).isoformat(),
+            'quantity': 40, 'price_per_unit': '1.25', 'low_stock_threshold': 5, 'description': '',
+            **overrides,
+        })
+
+    def test_requires_authentication(self):
+        response = self.client.get(reverse('api_medicine_list'))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(reverse('api_medicine_list'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 401)
+
+    def test_list_pages_with_cursor_and_selected_fields(self):
+        url = reverse('api_medicine_list')
+        response = self.client.get(url, {'limit': 2, 'fields': 'id,name,status'}, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([row['name'] for row in data['results']], ['Medicine 5', 'Medicine 4'])
+        self.assertEqual(set(data['results'][0]), {'id', 'name', 'status'})
+        self.assertIsNone(data['previous'])
+
+        names = []
+        next_url = data['next']
+        while next_url:
+            data = self.client.get(next_url, **self.auth).json()
+            names.extend(row['name'] for row in data['results'])
+            next_url = data['next']
+        self.assertEqual(names, ['Medicine 3', 'Medicine 2', 'Medicine 1'])
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get(reverse('api_medicine_list'), {'fields': 'name,user'}, **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('user', response.json()['error'])
+
+    def test_conditional_list_is_not_modified_until_inventory_changes(self):
+        url = reverse('api_medicine_list')
+        etag = self.client.get(url, **self.auth)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('"inventory_medicine"' in query['sql'] for query in ctx.captured_queries))
+
+        self.medicines[0].delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_tags_survive_midnight_unless_statuses_are_served(self):
+        url = reverse('api_medicine_list')
+        plain = self.client.get(url, {'fields': 'id,name,quantity'}, **self.auth)['ETag']
+        with_status = self.client.get(url, **self.auth)['ETag']
+        summary = self.client.get(reverse('api_summary'), **self.auth)['ETag']
+        detail_url = reverse('api_medicine_detail', args=[self.medicines[0].pk])
+        detail = self.client.get(detail_url, **self.auth)['ETag']
+
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.now', return_value=tomorrow):
+            response = self.client.get(url, {'fields': 'id,name,quantity'}, HTTP_IF_NONE_MATCH=plain, **self.auth)
+            self.assertEqual(response.status_code, 304)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=with_status, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('api_summary'), HTTP_IF_NONE_MATCH=summary, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            # Yesterday's tag still guards a write to the unchanged medicine
+            response = self.client.patch(detail_url, json.dumps({'quantity': 7}), content_type='application/json',
+                                         HTTP_IF_MATCH=detail, **self.auth)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.patch(detail_url, json.dumps({'quantity': 8}), content_type='application/json',
+                                         HTTP_IF_MATCH=detail, **self.auth)
+            self.assertEqual(response.status_code, 412)
+
+    def test_conditional_detail(self):
+        url = reverse('api_medicine_detail', args=[self.medicines[0].pk])
+        response = self.client.get(url, **self.auth)
+        self.assertEqual(response.json()['status'], 'Expiring Soon')
+        # Token lookup and updated_at only
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], **self.auth)
+        self.assertEqual(response.status_code, 304)
+
+    def test_create_update_delete(self):
+        url = reverse('api_medicine_list')
+        response = self.client.post(url, self.payload(), content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 201)
+        detail_url = response['Location']
+        etag = response['ETag']
+
+        response = self.client.patch(detail_url, json.dumps({'quantity': 3}), content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['quantity'], 3)
+        self.assertEqual(response.json()['status'], 'Low Stock')
+
+        # The tag from before the update is stale now
+        response = self.client.put(detail_url, self.payload(), content_type='application/json',
+                                   HTTP_IF_MATCH=etag, **self.auth)
+        self.assertEqual(response.status_code, 412)
+
+        response = self.client.patch(detail_url, json.dumps({'quantity': 0}), content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('quantity', response.json()['errors'])
+
+        self.assertEqual(self.client.delete(detail_url, **self.auth).status_code, 204)
+        self.assertEqual(self.client.get(detail_url, **self.auth).status_code, 404)
+        self.assertEqual(InventoryStatistics(self.user).get_summary()['total_medicines'], 5)
+
+    def test_other_users_medicines_are_hidden(self):
+        bob = create_user('bob')
+        _, key = ApiToken.create_token(bob, 'scanner')
+        url = reverse('api_medicine_detail', args=[self.medicines[0].pk])
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {key}').status_code, 404)
+
+    def test_session_writes_require_csrf_token(self):
+        client = self.client_class(enforce_csrf_checks=True)
+        client.login(username='alice', password=PASSWORD)
+        self.assertEqual(client.get(reverse('api_summary')).status_code, 200)
+        response = client.post(reverse('api_medicine_list'), self.payload(), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_summary(self):
+        response = self.client.get(reverse('api_summary'), **self.auth)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['summary']['total_medicines'], 5)
+        self.assertEqual(data['expiry_horizon_days'], 30)
+        self.assertEqual(len(data['expiry_histogram']), 4)
+
+
+class StockAdjustmentTests(TestCase):
+    """Batch stock movements are atomic single UPDATEs that keep the rollup in sync"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.today = timezone.now().date()
+        self.first, self.second = [
+            create_medicine(
+                self.user, 10, name=f'Medicine {i}', batch_number=f'B{i}',
+                quantity=20, price_per_unit='2.00', low_stock_threshold=5,
+            )
+            for i in range(2)
+        ]
+        InventoryStatistics(self.user).get_summary()
+        _, key = ApiToken.create_token(self.user, 'till')
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {key}'}
+
+    def adjust(self, *pairs):
+        body = json.dumps({'adjustments': [{'id': pk, 'delta': delta} for pk, delta in pairs]})
+        return self.client.post(reverse('api_adjust_stock'), body, content_type='application/json', **self.auth)
+
+    def test_batch_updates_quantities_rollup_and_version(self):
+        version = self.user.inventory_version.version
+        response = self.adjust((self.first.pk, -4), (self.second.pk, -16), (self.first.pk, -1))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {row['id']: row['quantity'] for row in response.json()['results']},
+            {self.first.pk: 15, self.second.pk: 4},
+        )
+        self.assertEqual(Medicine.objects.get(pk=self.second.pk).quantity, 4)
+        self.user.inventory_version.refresh_from_db()
+        self.assertEqual(self.user.inventory_version.version, version + 1)
+
+        summary = InventoryRollup.objects.get(user=self.user).get_summary()
+        self.assertEqual(summary['total_quantity'], 19)
+        self.assertEqual(summary['low_stock'], 1)
+        self.assertEqual(summary['expiring_soon_stock_value'], 38)
+        rebuilt = rebuild_inventory_rollups([self.user.pk])[0].get_summary()
+        self.assertEqual(summary, rebuilt)
+
+    def test_insufficient_stock_rejects_whole_batch(self):
+        response = self.adjust((self.first.pk, -5), (self.second.pk, -21))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['errors'], [{'id': self.second.pk, 'error': 'Only 20 in stock.'}])
+        self.assertEqual(
+            list(Medicine.objects.order_by('pk').values_list('quantity', flat=True)), [20, 20]
+        )
+
+    def test_other_users_medicine_is_not_found(self):
+        bob = create_user('bob', verified=False)
+        theirs = create_medicine(bob, 10, name='Theirs', batch_number='X', quantity=20)
+        response = self.adjust((theirs.pk, -1))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Medicine.objects.get(pk=theirs.pk).quantity, 20)
+
+    def test_batch_query_count_does_not_grow_with_size(self):
+        # Token lookup, row lock, stock update, rollup read and update and version bump, whatever the batch size
+        with CaptureQueriesContext(connection) as small:
+            self.adjust((self.first.pk, -1))
+        with CaptureQueriesContext(connection) as large:
+            self.adjust((self.first.pk, -1), (self.second.pk, 3))
+        self.assertEqual(len(small), len(large))
+
+    def test_many_expiry_dates_update_rollup_in_one_statement(self):
+        medicines = Medicine.objects.bulk_create([
+            Medicine(
+                user=self.user, name=f'Dated {days}', batch_number=f'D{days}', manufacturer='Acme',
+                manufacturing_date=self.today - timedelta(days=100), expiry_date=self.today + timedelta(days=days),
+                quantity=50, price_per_unit='1.50', low_stock_threshold=5,
+            )
+            for days in range(-5, 295)
+        ])
+        rebuild_inventory_rollups([self.user.pk])
+        response = self.adjust(*[(medicine.pk, -7) for medicine in medicines])
+        self.assertEqual(response.status_code, 200)
+        summary = InventoryRollup.objects.get(user=self.user).get_summary()
+        self.assertEqual(summary, rebuild_inventory_rollups([self.user.pk])[0].get_summary())
+        self.assertEqual(summary['total_quantity'], 40 + 300 * 43)
+
+    def test_invalid_payload(self):
+        response = self.client.post(
+            reverse('api_adjust_stock'), json.dumps({'adjustments': [{'id': self.first.pk, 'delta': 'x'}]}),
+            content_type='application/json', **self.auth
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class RequestTimingMiddlewareTests(TestCase):
+    """Per-request timings in Server-Timing and the JSON request and slow query logs"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+        self.client.login(username='alice', password=PASSWORD)
+
+    def test_server_timing_header_counts_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('medicine_list'))
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+        self.assertIn(f'desc="{len(ctx.captured_queries)} queries"', timing)
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_server_timing_header_can_be_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get(reverse('medicine_list')))
+
+    def test_request_log_line(self):
+        with self.assertLogs('inventory.requests', 'INFO') as logs:
+            self.client.get(reverse('medicine_list'))
+        entry = json.loads(JsonFormatter().format(logs.records[0]))
+        self.assertEqual(entry['view'], 'medicine_list')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['user_id'], self.user.pk)
+        self.assertGreater(entry['db_queries'], 0)
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+    def test_slow_query_log_names_view_and_sql(self):
+        with self.assertLogs('inventory.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('medicine_list'))
+        entries = [json.loads(JsonFormatter().format(record)) for record in logs.records]
+        self.assertTrue(any(
+            entry['view'] == 'medicine_list' and 'inventory_medicine' in entry['sql'] for entry in entries
+        ))
+
+
+@override_settings(METRICS_TOKEN='', DEBUG=True)
+class MetricsTests(TestCase):
+    """Prometheus metrics and the deep health check"""
+
+    def setUp(self):
+        self.user = create_user('alice')
+
+    def metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_request_latency_and_query_metrics(self):
+        self.client.login(username='alice', password=PASSWORD)
+        self.client.get(reverse('medicine_list'))
+        body = self.metrics()
+        self.assertIn('# TYPE pharmatrack_request_duration_seconds histogram', body)
+        self.assertRegex(body, r'pharmatrack_request_duration_seconds_bucket\{view="medicine_list",method="GET",le="\+Inf"\} [1-9]')
+        self.assertRegex(body, r'pharmatrack_db_queries_total\{view="medicine_list"\} [1-9]')
+        self.assertRegex(body, r'pharmatrack_responses_total\{view="medicine_list",status="2xx"\} [1-9]')
+
+    def sample(self, body, series):
+        """Value of one series in a scrape, 0 when it is absent"""
+        for line in body.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0
+
+    def test_worker_metrics_are_observed_as_work_finishes(self):
+        series = (
+            'pharmatrack_report_job_duration_seconds_count{format="csv"}',
+            'pharmatrack_email_send_latency_seconds_bucket{le="+Inf"}',
+            'pharmatrack_email_send_failures_total',
+        )
+        before = self.metrics()
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(REPORT_CACHE_DIR=cache_dir):
+            enqueue_report_job(self.user, 'all', 'csv')
+            run_report_job(claim_next_job())
+        enqueue_email('Hi', 'Body', ['alice@example.com'])
+        send_queued_emails()
+        enqueue_email('Hi', 'Body', ['bob@example.com'])
+        with self.assertLogs('inventory.mailqueue', 'WARNING'):
+            send_queued_emails(connection=FlakyConnection(failing={'bob@example.com'}))
+
+        after = self.metrics()
+        self.assertIn('# TYPE pharmatrack_email_send_latency_seconds histogram', after)
+        self.assertIn('# TYPE pharmatrack_email_send_failures_total counter', after)
+        self.assertEqual([self.sample(after, name) - self.sample(before, name) for name in series], [1, 1, 1])
+
+    def test_database_metrics_are_gauges(self):
+        ReportJob.objects.create(user=self.user, report_type='all', format_type='csv')
+        email = enqueue_email('Hi', 'Body', ['alice@example.com'])
+        OutboundEmail.objects.filter(pk=email.pk).update(
+            status=OutboundEmail.STATUS_SENT, attempts=2, sent_at=email.created_at + timedelta(seconds=20)
+        )
+        enqueue_email('Hi', 'Body', ['bob@example.com'])
+
+        body = self.metrics()
+        self.assertIn('# TYPE pharmatrack_recent_email_send_failures gauge', body)
+        self.assertIn('pharmatrack_recent_email_send_failures 1', body)
+        self.assertIn('pharmatrack_queue_depth{queue="report_jobs",state="pending"} 1', body)
+        self.assertIn('pharmatrack_queue_depth{queue="emails",state="due"} 1', body)
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_worker_metrics_server(self):
+        server = start_metrics_server(0, '127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with self.assertRaises(HTTPError) as error:
+            urlopen(url)
+        self.assertEqual(error.exception.code, 401)
+        error.exception.close()
+        with urlopen(Request(url, headers={'Authorization': 'Bearer s3cret'})) as response:
+            body = response.read().decode()
+        self.assertIn('# TYPE pharmatrack_report_job_failures_total counter', body)
+        self.assertNotIn('pharmatrack_queue_depth', body)
+
+    def test_report_generation_duration(self):
+        MedicineReportGenerator(self.user).write_report('all', 'csv', io.BytesIO())
+        self.assertRegex(self.metrics(), r'pharmatrack_report_generation_seconds_count\{format="csv"\} [1-9]')
+
+    @override_settings(METRICS_TOKEN='s3cret', DEBUG=False)
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(DEBUG=False)
+    def test_metrics_closed_without_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_email_metrics_skip_old_emails(self):
+        email = enqueue_email('Hi', 'Body', ['alice@example.com'])
+        OutboundEmail.objects.filter(pk=email.pk).update(
+            status=OutboundEmail.STATUS_FAILED, attempts=5, next_attempt_at=timezone.now() - timedelta(days=2)
+        )
+        body = self.metrics()
+        self.assertIn('pharmatrack_recent_emails_failed 0', body)
+        self.assertIn('pharmatrack_recent_email_send_failures 0', body)
+
+    def test_deep_health_check_times_database(self):
+        self.assertNotIn('database', self.client.get('/health/').json())
+        data = self.client.get('/health/', {'deep': '1'}).json()
+        self.assertEqual(data['status'], 'healthy')
+        self.assertEqual(data['database']['status'], 'ok')
+        self.assertGreaterEqual(data['database']['latency_ms'], 0)
+
+    def test_deep_health_check_hides_database_error(self):
+        with mock.patch('pharmatrack.urls.connection.cursor', side_effect=Exception('password for dbuser wrong')), \
+                self.assertLogs('pharmatrack.urls', 'ERROR'), self.assertLogs('django.request', 'ERROR'):
+            response = self.client.get('/health/', {'deep': '1'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['database'], {'status': 'error'})
+        self.assertNotIn(b'dbuser', response.content)
+
+
+class PdfReportTests(TestCase):
+    """The PDF medicine table is laid out in page-sized chunks"""
+
+    def setUp(self):
+        self.user = create_user('pdf', verified=False)
+
+    def test_rows_are_split_into_chunks_with_a_header_each(self):
+        seed_inventory(self.user, PDF_TABLE_CHUNK_ROWS * 2 + 5)
+        generator = MedicineReportGenerator(self.user)
+        with self.assertNumQueries(1):
+            tables = list(generator._iter_pdf_tables('all'))
+        self.assertEqual([len(table._cellvalues) for table in tables], [
+            PDF_TABLE_CHUNK_ROWS + 1, PDF_TABLE_CHUNK_ROWS + 1, 6
+        ])
+        for table in tables:
+            self.assertEqual(table._cellvalues[0][0], 'Name')
+            self.assertEqual(table.repeatRows, 1)
+
+        output = io.BytesIO()
+        generator.write_pdf_report('all', output)
+        self.assertTrue(output.getvalue().startswith(b'%PDF'))
+
+    def read_pdf(self, data):
+        """(page count, distinct batch numbers drawn) of a reportlab PDF"""
+        pages = len(re.findall(rb'/Type /Page\b(?!s)', data))
+        text = b''.join(
+            zlib.decompress(base64.a85decode(stream.strip(), adobe=True))
+            for stream in re.findall(rb'stream\r?\n(.*?)endstream', data, re.S)
+        )
+        return pages, set(re.findall(rb'BN\d+-\d{6}', text))
+
+    def test_lazy_feed_draws_every_row(self):
+        # Guards _FlowableFeed against changes in reportlab's build() loop
+        rows = PDF_TABLE_CHUNK_ROWS * 3 + 7
+        seed_inventory(self.user, rows)
+        generator = MedicineReportGenerator(self.user)
+        lazy = io.BytesIO()
+        generator.write_pdf_report('all', lazy)
+        eager = io.BytesIO()
+        with mock.patch('inventory.reports._FlowableFeed', lambda flowables, more: flowables + list(more)):
+            generator.write_pdf_report('all', eager)
+
+        pages, batches = self.read_pdf(lazy.getvalue())
+        self.assertEqual(len(batches), rows)
+        self.assertGreater(pages, 3)
+        self.assertEqual((pages, batches), self.read_pdf(eager.getvalue()))
+
+    def test_tables_are_fed_to_the_builder_as_it_goes(self):
+        pulled = []
+
+        def tables():
+            for index in range(5):
+                pulled.append(index)
+                yield index
+
+        feed = _FlowableFeed(['title'], tables())
+        self.assertEqual(len(feed), 2)
+        self.assertEqual(pulled, [0])
+        drawn = []
+        while len(feed):
+            drawn.append(feed[0])
+            del feed[0]
+        self.assertEqual(drawn, ['title', 0, 1, 2, 3, 4])
+
+    def test_empty_report(self):
+        generator = MedicineReportGenerator(self.user)
+        self.assertEqual(list(generator._iter_pdf_tables('expired')), [])
+        output = io.BytesIO()
+        generator.write_pdf_report('expired', output)
+        self.assertTrue(output.getvalue().startswith(b'%PDF'))
+
+
+class BenchmarkTests(TestCase):
+    """The benchmark suite seeds inventories and enforces query and latency budgets"""
+
+    def test_seed_inventory_keeps_rollup_and_index_in_sync(self):
+        user = create_user('seeded', verified=False)
+        seed_inventory(user, 500, batch_size=200)
+        self.assertEqual(Medicine.objects.filter(user=user).count(), 500)
+        # Read from the rollup written by the seeding, not rebuilt
+        with self.assertNumQueries(1):
+            summary = InventoryStatistics(user).get_summary()
+        self.assertEqual(summary['total_medicines'], 500)
+        self.assertTrue(summary['expired_medicines'] and summary['expiring_soon'] and summary['low_stock'])
+        self.assertTrue(search_medicines(Medicine.objects.filter(user=user), 'para').exists())
+
+    def test_every_case_within_budget(self):
+        results = run_benchmark(sizes=[200], repeat=2)
+        self.assertEqual(results['failures'], [])
+        cases = results['sizes']['200']['cases']
+        self.assertEqual(set(cases), {case.name for case in get_benchmark_cases()})
+        self.assertTrue(all(case['status'] == 200 for case in cases.values()))
+        # Nothing is left behind
+        self.assertFalse(User.objects.filter(username='benchmark-200').exists())
+
+    def test_exceeded_budget_is_reported(self):
+        budgets = {'page': {'queries': 0, 'p95_ms': (60000, 0)}}
+        cases = [case for case in get_benchmark_cases() if case.name == 'dashboard']
+        results = run_benchmark(sizes=[10], repeat=1, budgets=budgets, cases=cases)
+        self.assertEqual(len(results['failures']), 1)
+        self.assertIn('dashboard', results['failures'][0])
+
+    def test_command_writes_json_and_fails_on_budgets(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            budgets = os.path.join(directory, 'budgets.json')
+            with open(budgets, 'w') as fileobj:
+                json.dump({'page': {'queries': 0, 'p95_ms': [60000, 0]}}, fileobj)
+            with self.assertRaises(CommandError):
+                call_command(
+                    'benchmark', '--sizes', '10', '--repeat', '1', '--output', output, '--budgets', budgets,
+                    stdout=StringIO(), stderr=StringIO(),
+                )
+            with open(output) as fileobj:
+                results = json.load(fileobj)
+        self.assertIn('dashboard', results['sizes']['10']['cases'])
+        self.assertTrue(results['failures'])
+
+
+# Maximum queries per request for every URL name in inventory/urls.py. The
+# count must also be the same at every inventory size: a query per row
+# (say a template reaching for medicine.user) shows up as growth.
+QUERY_BUDGETS = {
+    'register': 2,
+    'login': 2,
+    'logout': 4,
+    'verify_email': 3,
+    'verify_otp': 1,
+    'resend_otp': 4,
+    'pending_verification': 3,
+    'resend_verification': 7,
+    'dashboard': 8,
+    'medicine_list': 4,
+    'add_medicine': 9,
+    'import_medicines': 12,
+    'edit_medicine': 11,
+    'delete_medicine': 10,
+    'alerts': 5,
+    'reports': 5,
+    'update_expiry_horizon': 4,
+    'download_report': 8,
+    'create_report_job': 3,
+    'report_job_status': 3,
+    'download_report_job': 3,
+    'api_medicine_list': 3,
+    'api_adjust_stock': 10,
+    'api_medicine_detail': 3,
+    'api_summary': 4,
+}
+
+
+class QueryBudgetTests(TestCase):
+    """Query counts of every view stay within budget and do not grow with the inventory"""
+
+    sizes = (5, 50, 250)
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        override = override_settings(REPORT_CACHE_DIR=self.tempdir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get_requests(self, size):
+        """(url name, method, url, data) for every URL, against a fresh user with size medicines"""
+        user = create_user(f'owner{size}')
+        seed_inventory(user, size)
+        pending = create_user(f'pending{size}', verified=False, is_active=False)
+        # The resend views replace pending's token, verify_email gets a user of its own
+        unverified = create_user(f'unverified{size}', verified=False, is_active=False)
+        medicine = Medicine.objects.filter(user=user).order_by('pk').first()
+        other = Medicine.objects.filter(user=user).order_by('pk').last()
+        enqueue_report_job(user, 'all', 'csv')
+        # Oldest first, so the last job run is the one just queued
+        while (claimed := claim_next_job()) is not None:
+            job = run_report_job(claimed)
+        self.client.force_login(user)
+        session = self.client.session
+        session['pending_verification_user_id'] = pending.pk
+        session.save()
+
+        today = timezone.now().date()
+        medicine_data = {
+            'name': 'Budget Aspirin', 'batch_number': f'QB{size}', 'manufacturer': 'Acme',
+            'manufacturing_date': (today - timedelta(days=30)).isoformat(),
+            'expiry_date': (today + timedelta(days=300)).isoformat(),
+            'quantity': 40, 'price_per_unit': '1.25', 'low_stock_threshold': 5, 'description': '',
+        }
+        csv_file = SimpleUploadedFile('import.csv', (
+            'name,batch_number,manufacturer,manufacturing_date,expiry_date,quantity,price_per_unit,low_stock_threshold\n'
+            + ''.join(
+                f'Imported {i},IMP{size}-{i},Acme,{today - timedelta(days=30)},{today + timedelta(days=200)},10,2.00,5\n'
+                for i in range(3)
+            )
+        ).encode(), content_type='text/csv')
+        return [
+            ('register', 'get', reverse('register'), None),
+            ('login', 'get', reverse('login'), None),
+            ('verify_email', 'get', reverse('verify_email', args=[unverified.userprofile.email_verification_token]), None),
+            ('verify_otp', 'get', reverse('verify_otp', args=[pending.pk]), None),
+            ('resend_otp', 'get', reverse('resend_otp', args=[pending.pk]), None),
+            ('pending_verification', 'get', reverse('pending_verification'), None),
+            ('resend_verification', 'post', reverse('resend_verification'), {'email': pending.email}),
+            ('dashboard', 'get', reverse('dashboard'), None),
+            ('medicine_list', 'get', reverse('medicine_list'), None),
+            ('add_medicine', 'post', reverse('add_medicine'), medicine_data),
+            ('import_medicines', 'post', reverse('import_medicines'), {'file': csv_file}),
+            ('edit_medicine', 'post', reverse('edit_medicine', args=[medicine.pk]), dict(medicine_data, batch_number=f'QE{size}')),
+            ('delete_medicine', 'post', reverse('delete_medicine', args=[other.pk]), None),
+            ('alerts', 'get', reverse('alerts'), None),
+            ('reports', 'get', reverse('reports'), None),
+            ('update_expiry_horizon', 'post', reverse('update_expiry_horizon'), {'expiry_horizon_days': 45}),
+            ('download_report', 'get', reverse('download_report', args=['all', 'pdf']), None),
+            ('create_report_job', 'post', reverse('create_report_job'), {'report_type': 'all', 'format_type': 'pdf'}),
+            ('report_job_status', 'get', reverse('report_job_status', args=[job.pk]), None),
+            ('download_report_job', 'get', reverse('download_report_job', args=[job.pk]), None),
+            ('api_medicine_list', 'get', reverse('api_medicine_list'), None),
+            ('api_adjust_stock', 'post', reverse('api_adjust_stock'),
+             json.dumps({'adjustments': [{'id': medicine.pk, 'delta': -1}]})),
+            ('api_medicine_detail', 'get', reverse('api_medicine_detail', args=[medicine.pk]), None),
+            ('api_summary', 'get', reverse('api_summary'), None),
+            # Last, it ends the session
+            ('logout', 'get', reverse('logout'), None),
+        ]
+
+    def count_queries(self, method, url, data):
+        # Fragment and statistics caches would hide the queries being budgeted
+        cache.clear()
+        kwargs = {'content_type': 'application/json'} if isinstance(data, str) else {}
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        return len(ctx.captured_queries)
+
+    def test_every_url_has_a_budget(self):
+        from .urls import urlpatterns
+        self.assertEqual(set(QUERY_BUDGETS), {pattern.name for pattern in urlpatterns})
+
+    def test_query_counts_are_constant_and_within_budget(self):
+        counts = {}
+        for size in self.sizes:
+            for name, method, url, data in self.get_requests(size):
+                counts.setdefault(name, {})[size] = self.count_queries(method, url, data)
+        for name, by_size in counts.items():
+            with self.subTest(name):
+                self.assertEqual(len(set(by_size.values())), 1, f'{name} queries grow with the inventory: {by_size}')
+                self.assertLessEqual(max(by_size.values()), QUERY_BUDGETS[name])
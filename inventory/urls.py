@@ -1,6 +1,6 @@
 from django.urls import path
 from django.contrib.auth import views as auth_views
-from . import views
+from . import api, views
 
 urlpatterns = [
     # Authentication
@@ -22,6 +22,7 @@ urlpatterns = [
     # Medicine management
     path('medicines/', views.medicine_list, name='medicine_list'),
     path('medicines/add/', views.add_medicine, name='add_medicine'),
+    path('medicines/import/', views.import_medicines, name='import_medicines'),
     path('medicines/<int:pk>/edit/', views.edit_medicine, name='edit_medicine'),
     path('medicines/<int:pk>/delete/', views.delete_medicine, name='delete_medicine'),
     
@@ -30,5 +31,15 @@ urlpatterns = [
     
     # Reports
     path('reports/', views.reports, name='reports'),
+    path('reports/expiry-horizon/', views.update_expiry_horizon, name='update_expiry_horizon'),
     path('reports/download/<str:report_type>/<str:format_type>/', views.download_report, name='download_report'),
+    path('reports/jobs/', views.create_report_job, name='create_report_job'),
+    path('reports/jobs/<int:job_id>/', views.report_job_status, name='report_job_status'),
+    path('reports/jobs/<int:job_id>/download/', views.download_report_job, name='download_report_job'),
+    
+    # JSON API
+    path('api/medicines/', api.medicine_list, name='api_medicine_list'),
+    path('api/medicines/adjust-stock/', api.adjust_medicine_stock, name='api_adjust_stock'),
+    path('api/medicines/<int:pk>/', api.medicine_detail, name='api_medicine_detail'),
+    path('api/summary/', api.inventory_summary, name='api_summary'),
 ] 
\ No newline at end of file
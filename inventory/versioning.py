@@ -0,0 +1,28 @@
+from django.db.models import F
+from django.utils import timezone
+from .models import InventoryVersion
+
+
+def get_inventory_version(user):
+    """Current inventory version of a user (0 before their first change)"""
+    try:
+        return user.inventory_version.version
+    except InventoryVersion.DoesNotExist:
+        return 0
+
+
+def bump_inventory_version(user_id):
+    """Invalidate everything derived from a user's inventory"""
+    now = timezone.now()
+    updated = InventoryVersion.objects.filter(user_id=user_id).update(
+        version=F('version') + 1, updated_at=now
+    )
+    if not updated:
+        version, created = InventoryVersion.objects.get_or_create(
+            user_id=user_id, defaults={'version': 1, 'updated_at': now}
+        )
+        if not created:
+            # Lost a creation race, count our change on the winner's row
+            InventoryVersion.objects.filter(user_id=user_id).update(
+                version=F('version') + 1, updated_at=now
+            )
@@ -1,24 +1,42 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.db.models import Q, Count, F
 from django.utils import timezone
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.urls import reverse
-from django.http import Http404
+from django.http import Http404, JsonResponse, FileResponse
+from django.views.decorators.http import require_POST
 from datetime import timedelta
+from urllib.parse import urlencode
+import io
+import logging
 import os
-from .models import Medicine, UserProfile
-from .forms import UserRegistrationForm, MedicineForm
-from .reports import MedicineReportGenerator
+from .models import Medicine, UserProfile, ReportJob, get_expiry_horizon, MAX_EXPIRY_HORIZON_DAYS
+from .decorators import verified_email_required, get_or_create_user_profile
+from .forms import UserRegistrationForm, MedicineForm, MedicineImportForm, ExpiryHorizonForm
+from .reports import MedicineReportGenerator, REPORT_TYPES, REPORT_EXTENSIONS, REPORT_CONTENT_TYPES, STREAMING_FORMATS
+from .jobs import enqueue_report_job
+from .report_cache import report_cache
+from .importer import MedicineImporter
+from .mailqueue import enqueue_email
+from .stats import InventoryStatistics
+from .versioning import bump_inventory_version, get_inventory_version
+from .pagination import KeysetPaginator
+from .search import search_medicines, RANK_FIELD as SEARCH_RANK_FIELD
 from django.conf import settings
 import random
 import string
 
+logger = logging.getLogger(__name__)
+
+MEDICINE_LIST_PAGE_SIZE = 25
+IMPORT_ERRORS_SHOWN = 100
+# Alert fragments are keyed by inventory version and date, so this only bounds their lifetime
+ALERTS_CACHE_TIMEOUT = 24 * 60 * 60
+
 def generate_otp():
     """Generate a 6-digit OTP"""
     return ''.join(random.choices(string.digits, k=6))
@@ -43,34 +61,21 @@ def send_otp_email(user):
         })
         plain_message = f"Your verification code is: {otp}\n\nThis code will expire in 10 minutes."
         
-        # Send email
-        print(f"Sending OTP email to: {user.email}")
-        print(f"OTP: {otp}")
-        
-        send_mail(
+        # Queue email, the send_queued_emails worker delivers it
+        enqueue_email(
             subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
+            body=plain_message,
             recipient_list=[user.email],
-            html_message=html_message,
-            fail_silently=False,
+            html_body=html_message,
         )
         
-        print(f"✅ OTP email sent successfully to: {user.email}")
+        logger.info('OTP email queued for user %s', user.pk)
         return True
         
     except Exception as e:
-        print(f"❌ Error sending OTP email: {str(e)}")
+        logger.exception('Queueing OTP email for user %s failed', user.pk)
         return False
 
-def get_or_create_user_profile(user):
-    """Get or create UserProfile for a user"""
-    try:
-        return user.userprofile
-    except UserProfile.DoesNotExist:
-        # Create UserProfile if it doesn't exist (safety measure)
-        return UserProfile.objects.create(user=user, email_verified=True)
-
 def send_verification_email(user):
     """Send verification email to user"""
     try:
@@ -94,31 +99,14 @@ def send_verification_email(user):
         })
         plain_message = strip_tags(html_message)
         
-        # Send email
-        print(f"Attempting to send email to: {user.email}")
-        print(f"From email: {settings.DEFAULT_FROM_EMAIL}")
-        print(f"Email backend: {settings.EMAIL_BACKEND}")
-        print(f"Email host: {settings.EMAIL_HOST}")
-        print(f"Email port: {settings.EMAIL_PORT}")
-        print(f"Email user: {settings.EMAIL_HOST_USER}")
-        
-        try:
-            print(f"About to call send_mail...")
-            result = send_mail(
-                subject=subject,
-                message=plain_message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                html_message=html_message,
-                fail_silently=False,
-            )
-            print(f"✅ Email sent successfully to: {user.email}")
-            print(f"✅ Send result: {result}")
-        except Exception as email_error:
-            print(f"❌ Email sending failed: {str(email_error)}")
-            print(f"❌ Error type: {type(email_error).__name__}")
-            print(f"❌ Full error details: {repr(email_error)}")
-            raise email_error
+        # Queue email, the send_queued_emails worker delivers it
+        enqueue_email(
+            subject=subject,
+            body=plain_message,
+            recipient_list=[user.email],
+            html_body=html_message,
+        )
+        logger.info('Verification email queued for user %s', user.pk)
         
         # Update sent timestamp
         user.userprofile.email_verification_sent_at = timezone.now()
@@ -145,30 +133,26 @@ def register(request):
             if has_email_config:
                 # Try to send OTP email
                 try:
-                    print(f"About to send OTP email to user: {user.id}")
                     otp_result = send_otp_email(user)
-                    print(f"OTP email result: {otp_result}")
                     
                     if otp_result:
-                        print(f"Redirecting to verify_otp for user: {user.id}")
                         # Store user ID in session as backup
                         request.session['pending_verification_user_id'] = user.id
                         messages.success(request, f'Account created successfully! Please check your email for the verification code. <a href="/verify-otp/{user.id}/" class="btn btn-primary">Enter Verification Code</a>')
                         try:
                             return redirect('verify_otp', user_id=user.id)
                         except Exception as redirect_error:
-                            print(f"Redirect failed: {str(redirect_error)}")
+                            logger.warning('Redirect to verify_otp failed: %s', redirect_error)
                             # Fallback: render a page with the verification link
                             return render(request, 'inventory/otp_redirect.html', {
                                 'user': user,
                                 'verification_url': f'/verify-otp/{user.id}/'
                             })
                     else:
-                        print("OTP email failed, showing error")
                         messages.error(request, 'Account created but failed to send verification code. Please contact support or try again later.')
                         return render(request, 'inventory/register.html', {'form': form})
                 except Exception as e:
-                    print(f"Exception in registration: {str(e)}")
+                    logger.exception('Sending the OTP email during registration failed')
                     # If email fails, show error and don't activate user
                     messages.error(request, f'Account created but failed to send verification code. Please contact support or try again later.')
                     return render(request, 'inventory/register.html', {'form': form})
@@ -183,7 +167,7 @@ def register(request):
 def verify_email(request, token):
     """Verify user email with token"""
     try:
-        profile = UserProfile.objects.get(email_verification_token=token)
+        profile = UserProfile.objects.select_related('user').get(email_verification_token=token)
         
         # Check if token is expired (24 hours)
         if profile.email_verification_sent_at:
@@ -198,7 +182,7 @@ def verify_email(request, token):
         
         user = profile.user
         user.is_active = True
-        user.save()
+        user.save(update_fields=['is_active'])
         
         messages.success(request, 'Email verified successfully! You can now log in to your account.')
         return redirect('login')
@@ -209,7 +193,7 @@ def verify_email(request, token):
 
 def verify_otp(request, user_id):
     """Verify OTP code"""
-    user = get_object_or_404(User, id=user_id)
+    user = get_object_or_404(User.objects.select_related('userprofile'), id=user_id)
     
     if request.method == 'POST':
         otp_code = request.POST.get('otp_code', '').strip()
@@ -231,7 +215,7 @@ def verify_otp(request, user_id):
             
             # Activate user
             user.is_active = True
-            user.save()
+            user.save(update_fields=['is_active'])
             
             messages.success(request, 'Email verified successfully! You can now log in.')
             return redirect('login')
@@ -312,95 +296,85 @@ def logout_view(request):
     # Always redirect to login page
     return redirect('login')
 
-@login_required
+@verified_email_required
 def dashboard(request):
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
+    # Get user's medicines with their status computed by the database
+    today = timezone.now().date()
+    horizon = get_expiry_horizon(request.user)
+    medicines = Medicine.objects.filter(user=request.user).with_status(today, horizon)
     
-    # Get user's medicines
-    medicines = Medicine.objects.filter(user=request.user)
-    
-    # Calculate statistics
-    total_medicines = medicines.count()
-    expired_medicines = medicines.filter(expiry_date__lt=timezone.now().date()).count()
-    expiring_soon = medicines.filter(
-        expiry_date__lte=timezone.now().date() + timedelta(days=30),
-        expiry_date__gt=timezone.now().date()
-    ).count()
-    low_stock = medicines.filter(quantity__lte=F('low_stock_threshold')).count()
+    # Read statistics from the inventory rollup
+    statistics = InventoryStatistics(request.user)
+    summary = statistics.get_summary()
     
     # Get recent medicines
     recent_medicines = medicines[:5]
     
     # Get alerts
-    expired_list = medicines.filter(expiry_date__lt=timezone.now().date())[:5]
-    expiring_soon_list = medicines.filter(
-        expiry_date__lte=timezone.now().date() + timedelta(days=30),
-        expiry_date__gt=timezone.now().date()
-    )[:5]
-    low_stock_list = medicines.filter(quantity__lte=F('low_stock_threshold'))[:5]
+    expired_list = medicines.expired(today)[:5]
+    expiring_soon_list = medicines.expiring_within(horizon, today)[:5]
+    low_stock_list = medicines.low_stock()[:5]
     
     context = {
-        'total_medicines': total_medicines,
-        'expired_medicines': expired_medicines,
-        'expiring_soon': expiring_soon,
-        'low_stock': low_stock,
+        'summary': summary,
+        'total_medicines': summary['total_medicines'],
+        'expired_medicines': summary['expired_medicines'],
+        'expiring_soon': summary['expiring_soon'],
+        'low_stock': summary['low_stock'],
         'recent_medicines': recent_medicines,
         'expired_list': expired_list,
         'expiring_soon_list': expiring_soon_list,
         'low_stock_list': low_stock_list,
+        'expiry_horizon': horizon,
+        'expiry_histogram': statistics.get_expiry_histogram(today),
+        **_alerts_cache_context(request, today),
     }
     return render(request, 'inventory/dashboard.html', context)
 
-@login_required
+@verified_email_required
 def medicine_list(request):
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
-    
-    medicines = Medicine.objects.filter(user=request.user)
+    today = timezone.now().date()
+    horizon = get_expiry_horizon(request.user)
+    medicines = Medicine.objects.filter(user=request.user).with_status(today, horizon)
     
     # Search functionality
-    search_query = request.GET.get('search', '')
+    search_query = request.GET.get('search', '').strip()
     if search_query:
-        medicines = medicines.filter(
-            Q(name__icontains=search_query) |
-            Q(batch_number__icontains=search_query) |
-            Q(manufacturer__icontains=search_query)
-        )
+        medicines = search_medicines(medicines, search_query)
     
     # Filter functionality
     filter_type = request.GET.get('filter', '')
     if filter_type == 'expired':
-        medicines = medicines.filter(expiry_date__lt=timezone.now().date())
+        medicines = medicines.expired(today)
     elif filter_type == 'expiring_soon':
-        medicines.filter(
-            expiry_date__lte=timezone.now().date() + timedelta(days=30),
-            expiry_date__gt=timezone.now().date()
-        )
+        medicines = medicines.expiring_within(horizon, today)
     elif filter_type == 'low_stock':
-        medicines = medicines.filter(quantity__lte=F('low_stock_threshold'))
+        medicines = medicines.low_stock()
+    
+    # Keyset pagination keeps every page a single indexed range query
+    # Search results page by relevance, everything else newest first
+    paginator = KeysetPaginator(
+        medicines,
+        per_page=MEDICINE_LIST_PAGE_SIZE,
+        key=SEARCH_RANK_FIELD if search_query else 'created_at'
+    )
+    page = paginator.get_page(after=request.GET.get('after'), before=request.GET.get('before'))
+    
+    # Carry search and filter parameters across page links
+    query_params = {key: value for key, value in (('search', search_query), ('filter', filter_type)) if value}
     
     context = {
-        'medicines': medicines,
+        'medicines': page.object_list,
+        'page': page,
+        'page_query': urlencode(query_params),
+        'summary': InventoryStatistics(request.user).get_summary(),
         'search_query': search_query,
         'filter_type': filter_type,
     }
     return render(request, 'inventory/medicine_list.html', context)
 
-@login_required
+@verified_email_required
 def add_medicine(request):
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
-    
     if request.method == 'POST':
         form = MedicineForm(request.POST)
         if form.is_valid():
@@ -413,14 +387,35 @@ def add_medicine(request):
         form = MedicineForm()
     return render(request, 'inventory/medicine_form.html', {'form': form, 'title': 'Add Medicine'})
 
-@login_required
-def edit_medicine(request, pk):
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
+@verified_email_required
+def import_medicines(request):
+    """Bulk import medicines from a CSV or Excel upload"""
+    result = None
+    if request.method == 'POST':
+        form = MedicineImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                result = MedicineImporter(request.user).import_file(upload, upload.name)
+            except ValueError as e:
+                form.add_error('file', str(e))
+            else:
+                if result.created:
+                    messages.success(request, f'Imported {result.created} medicine{"s" if result.created != 1 else ""}.')
+                if result.failed:
+                    messages.warning(request, f'{result.failed} row{"s" if result.failed != 1 else ""} could not be imported.')
+    else:
+        form = MedicineImportForm()
     
+    context = {
+        'form': form,
+        'result': result,
+        'errors': result.errors[:IMPORT_ERRORS_SHOWN] if result else [],
+    }
+    return render(request, 'inventory/medicine_import.html', context)
+
+@verified_email_required
+def edit_medicine(request, pk):
     medicine = get_object_or_404(Medicine, pk=pk, user=request.user)
     if request.method == 'POST':
         form = MedicineForm(request.POST, instance=medicine)
@@ -432,14 +427,8 @@ def edit_medicine(request, pk):
         form = MedicineForm(instance=medicine)
     return render(request, 'inventory/medicine_form.html', {'form': form, 'title': 'Edit Medicine'})
 
-@login_required
+@verified_email_required
 def delete_medicine(request, pk):
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
-    
     medicine = get_object_or_404(Medicine, pk=pk, user=request.user)
     if request.method == 'POST':
         medicine.delete()
@@ -447,77 +436,142 @@ def delete_medicine(request, pk):
         return redirect('medicine_list')
     return render(request, 'inventory/medicine_confirm_delete.html', {'medicine': medicine})
 
-@login_required
+@verified_email_required
 def alerts(request):
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
+    today = timezone.now().date()
+    horizon = get_expiry_horizon(request.user)
+    medicines = Medicine.objects.filter(user=request.user).with_status(today, horizon)
     
-    medicines = Medicine.objects.filter(user=request.user)
-    
-    expired_medicines = medicines.filter(expiry_date__lt=timezone.now().date())
-    expiring_soon_medicines = medicines.filter(
-        expiry_date__lte=timezone.now().date() + timedelta(days=30),
-        expiry_date__gt=timezone.now().date()
-    )
-    low_stock_medicines = medicines.filter(quantity__lte=F('low_stock_threshold'))
+    expired_medicines = medicines.expired(today)
+    expiring_soon_medicines = medicines.expiring_within(horizon, today)
+    low_stock_medicines = medicines.low_stock()
     
     context = {
         'expired_medicines': expired_medicines,
         'expiring_soon_medicines': expiring_soon_medicines,
         'low_stock_medicines': low_stock_medicines,
+        **_alerts_cache_context(request, today),
     }
     return render(request, 'inventory/alerts.html', context)
 
-@login_required
+def _alerts_cache_context(request, today):
+    """Template variables keying the cached alert fragments
+    
+    The querysets behind the fragments are lazy, so a cache hit skips them.
+    Medicine changes bump the inventory version and the date rolls the key
+    over when items cross into expiring soon or expired.
+    """
+    return {
+        'alerts_cache_timeout': ALERTS_CACHE_TIMEOUT,
+        'inventory_version': get_inventory_version(request.user),
+        'today': today.isoformat(),
+    }
+
+@verified_email_required
 def reports(request):
     """Reports page with download options"""
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
-    
     # Get summary statistics
-    report_generator = MedicineReportGenerator(request.user)
-    summary = report_generator.get_inventory_summary()
+    statistics = InventoryStatistics(request.user)
     
     context = {
-        'summary': summary,
+        'summary': statistics.get_summary(),
+        'expiry_histogram': statistics.get_expiry_histogram(),
+        'expiry_horizon': statistics.horizon,
+        'max_expiry_horizon': MAX_EXPIRY_HORIZON_DAYS,
+        'horizon_form': ExpiryHorizonForm(instance=get_or_create_user_profile(request.user)),
+        'report_jobs': ReportJob.objects.filter(user=request.user).defer('content')[:5],
     }
     return render(request, 'inventory/reports.html', context)
 
-@login_required
+@verified_email_required
+@require_POST
+def update_expiry_horizon(request):
+    """Change how many days ahead medicines count as expiring soon"""
+    form = ExpiryHorizonForm(request.POST, instance=get_or_create_user_profile(request.user))
+    if form.is_valid():
+        if form.has_changed():
+            form.save()
+            # Cached reports and pages were built with the old horizon
+            bump_inventory_version(request.user.pk)
+        messages.success(request, f'Medicines expiring within {form.instance.expiry_horizon_days} days are now flagged as expiring soon.')
+    else:
+        messages.error(request, f'Enter a number of days between 1 and {MAX_EXPIRY_HORIZON_DAYS}.')
+    return redirect('reports')
+
+@verified_email_required
 def download_report(request, report_type, format_type):
     """Download report in specified format"""
-    # Check if user's email is verified
-    profile = get_or_create_user_profile(request.user)
-    if not profile.email_verified:
-        messages.warning(request, 'Please verify your email address to access all features.')
-        return redirect('resend_verification')
-    
     # Validate report type
-    valid_report_types = ['all', 'expired', 'expiring_soon', 'low_stock', 'active']
-    if report_type not in valid_report_types:
+    if report_type not in REPORT_TYPES:
         messages.error(request, 'Invalid report type.')
         return redirect('reports')
     
     # Validate format type
-    valid_formats = ['pdf', 'excel']
-    if format_type not in valid_formats:
+    if format_type not in REPORT_EXTENSIONS:
         messages.error(request, 'Invalid format type.')
         return redirect('reports')
     
-    # Generate report
-    report_generator = MedicineReportGenerator(request.user)
+    # CSV and JSON Lines are cheap to build, stream them straight from the database
+    if format_type in STREAMING_FORMATS:
+        return MedicineReportGenerator(request.user).stream_report(report_type, format_type)
     
+    # Serve from the report cache, generating on a miss
     try:
-        if format_type == 'excel':
-            return report_generator.generate_excel_report(report_type)
-        elif format_type == 'pdf':
-            return report_generator.generate_pdf_report(report_type)
+        report_file = report_cache.open_report(request.user, report_type, format_type)
+        return FileResponse(
+            report_file,
+            as_attachment=True,
+            filename=MedicineReportGenerator.get_filename(report_type, format_type),
+            content_type=REPORT_CONTENT_TYPES[format_type]
+        )
     except Exception as e:
         messages.error(request, f'Error generating report: {str(e)}')
         return redirect('reports')
+
+def _report_job_payload(job):
+    payload = {
+        'id': job.pk,
+        'report_type': job.report_type,
+        'format_type': job.format_type,
+        'status': job.status,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': reverse('report_job_status', args=[job.pk]),
+        'download_url': None,
+    }
+    if job.status == ReportJob.STATUS_COMPLETED:
+        payload['download_url'] = reverse('download_report_job', args=[job.pk])
+    elif job.status == ReportJob.STATUS_FAILED:
+        payload['error'] = 'Report generation failed.'
+    return payload
+
+@verified_email_required
+@require_POST
+def create_report_job(request):
+    """Queue a report for background generation"""
+    report_type = request.POST.get('report_type', '')
+    format_type = request.POST.get('format_type', '')
+    if report_type not in REPORT_TYPES or format_type not in REPORT_EXTENSIONS:
+        return JsonResponse({'error': 'Invalid report or format type.'}, status=400)
+    
+    job = enqueue_report_job(request.user, report_type, format_type)
+    return JsonResponse(_report_job_payload(job), status=202)
+
+@verified_email_required
+def report_job_status(request, job_id):
+    """Poll the status of a background report"""
+    job = get_object_or_404(ReportJob.objects.defer('content'), pk=job_id, user=request.user)
+    return JsonResponse(_report_job_payload(job))
+
+@verified_email_required
+def download_report_job(request, job_id):
+    """Download the artifact of a completed background report"""
+    job = get_object_or_404(ReportJob, pk=job_id, user=request.user, status=ReportJob.STATUS_COMPLETED)
+    if job.content is None:
+        raise Http404('Report file is missing.')
+    return FileResponse(
+        io.BytesIO(job.content),
+        as_attachment=True,
+        filename=MedicineReportGenerator.get_filename(job.report_type, job.format_type),
+        content_type=REPORT_CONTENT_TYPES[job.format_type]
+    )
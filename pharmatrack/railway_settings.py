@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inventory.instrumentation.RequestTimingMiddleware',  # Outermost, so it times everything below
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -117,6 +118,26 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Cache for rendered page fragments and computed statistics, on disk so every
+# gunicorn worker shares it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'django_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# Generated report cache (LRU, evicted down to REPORT_CACHE_MAX_BYTES)
+REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', BASE_DIR / 'report_cache')
+REPORT_CACHE_MAX_BYTES = int(os.environ.get('REPORT_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+
+# Request instrumentation (inventory.instrumentation.RequestTimingMiddleware)
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'True').lower() == 'true'
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+# Bearer token required to scrape /metrics (open when empty)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -124,6 +145,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 
+# Loads the user's profile and inventory version together with the session user
+AUTHENTICATION_BACKENDS = ['inventory.backends.ProfileModelBackend']
+
 # Email Configuration for Production
 # SendGrid is the most reliable option for Railway deployment
 
@@ -211,6 +235,9 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'inventory.logformat.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
@@ -218,6 +245,10 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
+        'json_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
     },
     'root': {
         'handlers': ['console'],
@@ -229,6 +260,16 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'inventory.requests': {
+            'handlers': ['json_console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'inventory.slow_queries': {
+            'handlers': ['json_console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 
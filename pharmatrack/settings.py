@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inventory.instrumentation.RequestTimingMiddleware',  # Outermost, so it times everything below
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -121,6 +123,53 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# Cache for rendered page fragments and computed statistics (per process)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'pharmatrack',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# Generated report cache (LRU, evicted down to REPORT_CACHE_MAX_BYTES)
+REPORT_CACHE_DIR = BASE_DIR / 'report_cache'
+REPORT_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 200MB
+
+# Request instrumentation (inventory.instrumentation.RequestTimingMiddleware)
+SERVER_TIMING_HEADER = True
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+# Bearer token required to scrape /metrics (open when empty)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Request timings and slow queries are logged as JSON lines. Per-request lines
+# are INFO, set REQUEST_LOG_LEVEL=INFO to see them locally.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'inventory.logformat.JsonFormatter'},
+    },
+    'handlers': {
+        'json_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'inventory.requests': {
+            'handlers': ['json_console'],
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+        'inventory.slow_queries': {
+            'handlers': ['json_console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -130,8 +179,15 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 
+# Loads the user's profile and inventory version together with the session user
+AUTHENTICATION_BACKENDS = ['inventory.backends.ProfileModelBackend']
+
 # Email Configuration for Gmail SMTP
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Emails are queued and delivered by `manage.py send_queued_emails`. For local
+# testing set EMAIL_BACKEND=django.core.mail.backends.filebased.EmailBackend to
+# write them to EMAIL_FILE_PATH instead (tests always use the locmem backend).
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = BASE_DIR / 'sent_emails'
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -16,14 +16,38 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from django.db import connection
 from django.http import JsonResponse
+from inventory.metrics import metrics_view
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 def health_check(request):
-    """Simple health check endpoint for Railway"""
-    return JsonResponse({'status': 'healthy', 'service': 'pharmatrack'})
+    """Health check endpoint for Railway
+
+    ?deep=1 also times a database round trip and answers 503 when it fails.
+    """
+    data = {'status': 'healthy', 'service': 'pharmatrack'}
+    if request.GET.get('deep'):
+        start = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+        except Exception:
+            # The error text can name hosts and users, keep it in the logs
+            logger.exception('Health check database query failed')
+            data['status'] = 'unhealthy'
+            data['database'] = {'status': 'error'}
+            return JsonResponse(data, status=503)
+        data['database'] = {'status': 'ok', 'latency_ms': round((time.perf_counter() - start) * 1000, 2)}
+    return JsonResponse(data)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('health/', health_check, name='health_check'),
+    path('metrics', metrics_view, name='metrics'),
     path('', include('inventory.urls')),
 ]